@@ -1,10 +1,26 @@
 import sys
-from app.app import App, Root
-from PyQt5 import QtWidgets
+from app.metrics import start_profiling_from_env
 
 if __name__ == '__main__':
+    # LABEL_VALIDATOR_PROFILE=FILE profiles the whole session
+    start_profiling_from_env()
+
+    # command line tools, Qt is not imported
+    if len(sys.argv) > 1:
+        from app.cli import main
+        sys.exit(main(sys.argv[1:]))
+
+    from PyQt5 import QtWidgets
+    from app.app import App, Root
+    from app.results import ResultsLockedError
+
     application = QtWidgets.QApplication(sys.argv)
     root = Root()
-    app = App(root)
+    try:
+        app = App(root)
+    except ResultsLockedError as error:
+        # another instance (or a command line import) still writes the results after the lock timeout
+        QtWidgets.QMessageBox.critical(None, "Label Validator", f"{error}.")
+        sys.exit(1)
     root.show()
-    sys.exit(application.exec_())
\ No newline at end of file
+    sys.exit(application.exec_())
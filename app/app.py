@@ -1,11 +1,17 @@
 # Author: Jeffrey Chen
 # Last Modified: 08/23/2023
-import os, json, atexit, time, threading, re, random
+import os, html
 from datetime import datetime
 from PyQt5 import QtWidgets
 from PyQt5.QtWidgets import QMainWindow, QLabel, QWidget, QFileDialog
-from PyQt5.QtGui import QPixmap
-from PyQt5.QtCore import Qt, pyqtSignal
+from PyQt5.QtGui import QPixmap, QKeySequence
+from PyQt5.QtCore import Qt, QEvent, QTimer, QObject, QRunnable, QThreadPool, pyqtSignal
+from app.core import ControlSystem
+from app.image_loader import ImageLoader
+from app.thumbnail_cache import default_thumbnail_cache
+from app.pixmap_cache import PixmapCache
+from app.gallery import GalleryWindow
+from app.metrics import metrics
 
 div_size = 224
 pad = 3
@@ -16,28 +22,69 @@ text_color = "rgb(124, 166, 215)"
 selected_border_color = "rgb(59, 47, 133)"
 inactivated_color = "gray"
 
-button_style_active = f"""
-    QPushButton {{
+# One style sheet for the whole window, set on the root
+# States are dynamic properties matched by the sheet: "selected" on the image labels, "active" on the buttons.
+# A state change sets the property and repolishes that one widget (set_style_state), nothing is restyled otherwise.
+# Rules are scoped by object name ("top_bar", "image_div"), within the one sheet the more specific rule wins.
+app_style = f"""
+    * {{
+        background-color: {background_color_dark};
+    }}
+    #top_bar, #top_bar *, #image_div, #image_div * {{
         background-color: {background_color_light};
+    }}
+    #top_bar QLabel, #image_div QLabel, #image_div QListWidget, #image_div QListWidget *, #image_div QTextEdit, #image_div QTextEdit * {{
         color: {text_color};
-        border: 1px solid {text_color};
     }}
-    QPushButton:hover {{
-        background-color: {text_color};
-        color: {background_color_light};
+    #image_div QLabel[selected="true"] {{
+        border: 5px solid {selected_border_color};
     }}
-"""
-
-button_style_inactive = f"""
-    QPushButton {{
+    #top_bar QPushButton, #image_div QPushButton {{
         background-color: {background_color_light};
         color: {inactivated_color};
         border: 1px solid {inactivated_color};
     }}
+    #top_bar QPushButton[active="true"], #image_div QPushButton[active="true"] {{
+        color: {text_color};
+        border: 1px solid {text_color};
+    }}
+    #top_bar QPushButton[active="true"]:hover, #image_div QPushButton[active="true"]:hover {{
+        background-color: {text_color};
+        color: {background_color_light};
+    }}
+    #top_bar QComboBox {{
+        border: 1px solid {background_color_dark};
+        border-radius: 4px;
+        padding-left: 10px;
+        color: {text_color};
+    }}
+    #top_bar QComboBox::drop-down {{
+        border: 0px;
+    }}
+    #top_bar QComboBox::down-arrow {{
+        image: url(./app/system_img/dropdown_arrow.png);
+        width: 12px;
+        height: 12px;
+        margin-right: 15px;
+    }}
+    #top_bar QComboBox:on {{
+        border: 2px solid {text_color};
+    }}
+    #top_bar QComboBox::item:selected {{
+        color: {background_color_dark};
+    }}
 """
 
-img_style_selected = f"border: 5px solid {selected_border_color};"
-img_style_unselected = f"border: 0px;"
+# sets a state property of app_style, the widget is only repolished if the value changed
+def set_style_state(widget, name, value):
+    if widget.property(name) == value:
+        return
+    widget.setProperty(name, value)
+    # polish() resolves the rules of the widget again, frames (the image labels) take their new border width
+    # from the style change event
+    widget.style().polish(widget)
+    QtWidgets.QApplication.sendEvent(widget, QEvent(QEvent.StyleChange))
+    widget.update()
 
 class ClickableLabel(QLabel):
     # Define a new signal called 'clicked'
@@ -49,173 +96,41 @@ class ClickableLabel(QLabel):
         if event.button() == Qt.LeftButton:
             self.clicked.emit()
 
+# Runs a function on the global thread pool, so the GUI thread keeps going while it runs
+# done(result) or failed(error message) is delivered on the GUI thread; keep the task referenced until then
+class BackgroundTask(QObject):
+
+    done = pyqtSignal(object)
+    failed = pyqtSignal(str)
+
+    class Runnable(QRunnable):
+
+        def __init__(self, task):
+            super().__init__()
+            self.task = task
+
+        def run(self):
+            try:
+                result = self.task.function()
+            except Exception as error:
+                self.task.failed.emit(str(error))
+                return
+            self.task.done.emit(result)
+
+    def __init__(self, function):
+        super().__init__()
+        self.function = function
+
+    def start(self):
+        QThreadPool.globalInstance().start(self.Runnable(self))
+
 # Root window
 class Root(QMainWindow):
     def __init__(self):
         super().__init__()
         self.setWindowTitle("Label Validator")
         self.setFixedSize(int(div_size * 6) + pad * 5, div_size * 4 + int(div_size * 0.09375) + pad * 8) # 1344 x 672
-        self.setStyleSheet(f"background-color: {background_color_dark};")
-
-# Backend logic
-class ControlSystem:
-
-    catagory2food = {
-        'A01': '米食',
-        'A02': '麵食',
-        'B01': '豬肉',
-        'B02': '雞肉',
-        'B03': '牛肉',
-        'B04': '羊肉',
-        'B05': '鴨肉',
-        'B06': '鵝肉',
-        'C01': '水果類',
-        'C02': '葉菜類',
-        'C03': '瓜果類',
-        'C04': '花菜花瓣類',
-        'C05': '根莖類',
-        'C06': '種子核果類',
-        'C07': '海菜菇蕈類',
-        'C08': '蒟蒻',
-        'D01': '魚肉',
-        'D02': '貝類',
-        'D03': '甲殼類',
-        'D04': '頭足軟體',
-        'E01': '蛋',
-        'E02': '豆腐',
-        'E03': '豆乾豆包',
-        'F01': '奶類'
-    }
-
-    def __init__(self):
-        # image paths
-        self.images_folder = os.path.join(os.path.dirname(__file__), "images")
-        # all images in the folder that fit the name format
-        # format: <food labels>_<image id>_<dataset id>.jpg
-        # food labels: Capital letter + 2 digit number, if multiple, no sperator
-        # image id: a sequence of digits
-        # dataset id: single digit
-        regex = re.compile(r"([A-Z]\d{2})+_\d+_\d\.jpg")
-        self.images = [os.path.join(self.images_folder, image) for image in os.listdir(self.images_folder) if regex.match(image)]
-
-        # Validators
-        self.validators = ["Jeffrey Chen", "Nancy Li", "Zoe Wang", "Vivian Wu"]
-        self.current_validator_index = 0
-
-        # placeholder image
-        self.placeholder_image = os.path.join(os.path.dirname(__file__), "system_img", "placeholder.png")
-
-        # selected image
-        self.selected_image_div = None
-
-        # Validate Results
-        if not os.path.exists(os.path.join(os.path.dirname(__file__), "validate_results.json")):
-            with open(os.path.join(os.path.dirname(__file__), "validate_results.json"), "w") as f:
-                json.dump({}, f, indent = 4, ensure_ascii = False)
-        with open(os.path.join(os.path.dirname(__file__), "validate_results.json"), "r") as f:
-            self.validate_results = json.load(f)
-
-        # prevent data loss
-        atexit.register(self.exit)
-        self.heartbeat_file = os.path.join(os.path.dirname(__file__), ".heartbeat.json")
-
-        # Check for unclean shutdown
-        if self.was_unclean_shutdown():
-            self.recover_from_unclean_shutdown()
-
-        # Start heartbeat in a separate thread
-        threading.Thread(target = self.start_heartbeat, daemon = True).start()
-
-        '''
-        # print selected image in a separate thread for debugging
-        def print_selected_image():
-            while True:
-                time.sleep(1)
-                print(self.selected_image_div.current_image)
-
-        threading.Thread(target = print_selected_image, daemon = True).start()
-        '''
-
-    def start_heartbeat(self):
-        last_saved = self.validate_results.copy()
-        while True:
-            time.sleep(60)  # update heartbeat file every minute
-            if self.validate_results != last_saved:
-                with open(self.heartbeat_file, 'w') as file:
-                    json.dump(self.validate_results, file, indent = 4, ensure_ascii = False)
-                last_saved = self.validate_results.copy()
-
-    def was_unclean_shutdown(self):
-        return os.path.exists(self.heartbeat_file)
-
-    def recover_from_unclean_shutdown(self):
-        with open(self.heartbeat_file, 'r') as file:
-            self.validate_results = json.load(file)
-
-    def current_validator(self):
-        return self.validators[self.current_validator_index]
-    
-    def labels_of(self, image_path):
-        if image_path == self.placeholder_image:
-            return ["None"]
-        image_name = os.path.basename(image_path)
-        # if has file extension, remove it
-        if '.' in image_name:
-            image_name = image_name[:image_name.index('.')]
-        labels = image_name.split('_')[0]
-        labels = [labels[i:i+3] for i in range(0, len(labels), 3)]
-        return [f"{label}: {self.catagory2food[label]}" for label in labels]
-    
-    def record_result(self, result, remark):
-        current_image_name = os.path.basename(self.selected_image_div.current_image)
-        # if has file extension, remove it
-        if '.' in current_image_name:
-            current_image_name = current_image_name[:current_image_name.index('.')]
-        if current_image_name not in self.validate_results:
-            self.validate_results[current_image_name] = {}
-        if remark == "":
-            remark = "None"
-        self.validate_results[current_image_name][self.current_validator()] = result + " - " + remark
-
-    def random_images(self, num = 1):
-        images = []
-        random.shuffle(self.images)
-        for image in self.images:
-            if image not in images and not self.is_already_validated_by_current_validator(image):
-                images.append(image)
-            if len(images) == num:
-                return images
-        # if not enough images, return placeholder image
-        return images + [self.placeholder_image] * (num - len(images))
-    
-    # remove file extension & char before first underscore
-    def id_of(self, image_path):
-        if image_path == self.placeholder_image:
-            return "No."
-        image_name = os.path.basename(image_path)
-        # if has file extension, remove it
-        if '.' in image_name:
-            image_name = image_name[:image_name.index('.')]
-        image_name = image_name[image_name.index('_') + 1:]
-        return image_name
-    
-    def is_already_validated_by_current_validator(self, image_path):
-        if image_path == self.placeholder_image:
-            return False
-        image_name = os.path.basename(image_path)
-        # if has file extension, remove it
-        if '.' in image_name:
-            image_name = image_name[:image_name.index('.')]
-        if image_name not in self.validate_results:
-            return False
-        return self.current_validator() in self.validate_results[image_name]
-    
-    def exit(self):
-        with open(os.path.join(os.path.dirname(__file__), "validate_results.json"), "w") as f:
-            json.dump(self.validate_results, f, indent = 4, ensure_ascii = False)
-        if os.path.exists(self.heartbeat_file):
-            os.remove(self.heartbeat_file)
-        exit()
+        self.setStyleSheet(app_style)
 
 # Main application
 class App:
@@ -223,12 +138,12 @@ class App:
     # create image div
     def create_img_div(self, root, *, is_temp = False):
         img_div = QWidget(root)
-        img_div.setStyleSheet(f"background-color: {background_color_light};")
+        img_div.setObjectName("image_div")
         img_div.setFixedSize(int(div_size * 1.5), div_size) # 336 x 224
 
         # image
         img_div.label = ClickableLabel(img_div)
-        img_div.label.setPixmap(QPixmap(self.control.placeholder_image))
+        img_div.label.setPixmap(self.placeholder_pixmap)
         img_div.label.setScaledContents(True)
         img_div.label.resize(div_size, div_size)
         img_div.label.clicked.connect(lambda: self.image_clicked(img_div))
@@ -238,7 +153,7 @@ class App:
 
         # button
         img_div.to_temp_button = QtWidgets.QPushButton(img_div)
-        img_div.to_temp_button.setStyleSheet(button_style_inactive)
+        img_div.to_temp_button.setProperty("active", False)
         img_div.to_temp_button.setFixedSize(int(div_size * 0.5) - pad * 2, int(div_size * 0.09375)) # 112 x 21
         if is_temp:
             img_div.to_temp_button.setText("Clear")
@@ -250,13 +165,11 @@ class App:
         # text label
         img_div.title_text = QLabel(img_div)
         img_div.title_text.setText("No.")
-        img_div.title_text.setStyleSheet(f"background-color: {background_color_light}; color: {text_color};")
         img_div.title_text.setFixedSize(int(div_size * 0.5) - pad * 2, int(div_size * 0.09375)) # 112 x 21
 
         # label text
         img_div.label_text = QLabel(img_div)
         img_div.label_text.setText("Current labels: ")
-        img_div.label_text.setStyleSheet(f"background-color: {background_color_light}; color: {text_color};")
         img_div.label_text.setFixedSize(int(div_size * 0.5) - pad * 2, int(div_size * 0.09375)) # 112 x 21
 
         # current labels
@@ -265,13 +178,11 @@ class App:
             "None"
         ])
         img_div.current_label_list.setFixedSize(int(div_size * 0.5) - pad * 2, int(((div_size - pad * 5 - int(div_size * 0.09375) * 3) - pad) * 0.4)) # 112 x 21
-        img_div.current_label_list.setStyleSheet(f"color: {text_color};")
 
         # remark (A text box for the validator to write down remarks)
         img_div.remark_text = QtWidgets.QTextEdit(img_div)
         img_div.remark_text.setFixedSize(int(div_size * 0.5) - pad * 2, int(((div_size - pad * 5 - int(div_size * 0.09375) * 3) - pad) * 0.6)) # 112 x 21
         img_div.remark_text.setReadOnly(True)
-        img_div.remark_text.setStyleSheet(f"color: {text_color};")
 
         # position items in img_div
         img_div.label.move(0, 0)
@@ -286,13 +197,27 @@ class App:
         self.root = root
         self.control = ControlSystem()
 
+        # images are decoded to tile size on worker threads, tiles show the placeholder until then
+        # decoded tiles are kept in the on-disk thumbnail cache
+        self.placeholder_pixmap = QPixmap(self.control.placeholder_image)
+        self.image_loader = ImageLoader(div_size, div_size, thumbnail_cache = default_thumbnail_cache(div_size, div_size))
+        self.image_loader.decoded.connect(self.on_image_decoded)
+        # decoded tiles of all image divs, 16 on screen plus prefetched batches and recent ones
+        self.pixmap_cache = PixmapCache()
+        # next batch for the random section, drawn and decoded ahead of the click
+        self.next_random_images = []
+        # review queue: the session files picked with Load, shown one after the other (ctrl+right / ctrl+left)
+        # while one is shown the images of the next one are decoded ahead
+        self.session_files = []
+        self.session_index = 0
+
         # rewrite closeEvent
         self.root.closeEvent = self.exit
 
         # create frames
         # - top bar
         self.top_bar = QWidget(self.root)
-        self.top_bar.setStyleSheet(f"background-color: {background_color_light};")
+        self.top_bar.setObjectName("top_bar")
         self.top_bar.setFixedSize(int(div_size * 6) + pad * 3, int(div_size * 0.09375) + pad * 2) # 1344 x 27
         self.top_bar.move(pad, pad)
 
@@ -316,36 +241,11 @@ class App:
         # - validator label
         self.validator_label = QLabel(self.top_bar)
         self.validator_label.setText("Validator:")
-        self.validator_label.setStyleSheet(f"background-color: {background_color_light}; color: {text_color};")
         self.validator_label.setFixedSize(int(div_size * 0.25), int(div_size * 0.09375)) # 168 x 21
         self.validator_label.move(pad, pad)
 
         # - validator dropdown
         self.validator_dropdown = QtWidgets.QComboBox(self.top_bar)
-        self.validator_dropdown.setStyleSheet(f""" 
-            QComboBox {{
-                border: 1px solid {background_color_dark};
-                border-radius: 4px;
-                padding-left: 10px;
-                color: {text_color};
-            }}
-            QComboBox::drop-down {{
-                border: 0px;
-            }}
-            QComboBox::down-arrow {{
-                image: url(./app/system_img/dropdown_arrow.png);
-                width: 12px;
-                height: 12px;
-                margin-right: 15px;
-            }}
-            QComboBox:on {{
-                border: 2px solid {text_color};
-            }}
-            QComboBox::item:selected {{
-                color: {background_color_dark};
-            }}
-            """
-        )
         self.validator_dropdown.setFixedSize(int(div_size * 0.75), int(div_size * 0.09375)) # 168 x 21
         self.validator_dropdown.addItems(self.control.validators)
         self.validator_dropdown.currentIndexChanged.connect(self.on_validator_changed)
@@ -354,7 +254,7 @@ class App:
         # - generate random image button
         self.generate_random_image_button = QtWidgets.QPushButton(self.top_bar)
         self.generate_random_image_button.setText("Random")
-        self.generate_random_image_button.setStyleSheet(button_style_active)
+        self.generate_random_image_button.setProperty("active", True)
         self.generate_random_image_button.setFixedSize(int(div_size * 0.4), int(div_size * 0.09375)) # 168 x 21
         self.generate_random_image_button.move(div_size + pad * 6, pad)
         self.generate_random_image_button.clicked.connect(self.random_image)
@@ -362,7 +262,7 @@ class App:
         # - accept button
         self.accept_button = QtWidgets.QPushButton(self.top_bar)
         self.accept_button.setText("Accept")
-        self.accept_button.setStyleSheet(button_style_inactive)
+        self.accept_button.setProperty("active", False)
         self.accept_button.setFixedSize(int(div_size * 0.4), int(div_size * 0.09375)) # 168 x 21
         self.accept_button.move(div_size + int(div_size * 0.4) + pad * 8, pad)
         self.accept_button.clicked.connect(lambda: self.record_result("accept"))
@@ -370,7 +270,7 @@ class App:
         # - incorrect button
         self.incorrect_button = QtWidgets.QPushButton(self.top_bar)
         self.incorrect_button.setText("Incorrect")
-        self.incorrect_button.setStyleSheet(button_style_inactive)
+        self.incorrect_button.setProperty("active", False)
         self.incorrect_button.setFixedSize(int(div_size * 0.4), int(div_size * 0.09375)) # 168 x 21
         self.incorrect_button.move(div_size + int(div_size * 0.8) + pad * 10, pad)
         self.incorrect_button.clicked.connect(lambda: self.record_result("incorrect"))
@@ -378,7 +278,7 @@ class App:
         # - reject button
         self.reject_button = QtWidgets.QPushButton(self.top_bar)
         self.reject_button.setText("Reject")
-        self.reject_button.setStyleSheet(button_style_inactive)
+        self.reject_button.setProperty("active", False)
         self.reject_button.setFixedSize(int(div_size * 0.4), int(div_size * 0.09375)) # 168 x 21
         self.reject_button.move(div_size + int(div_size * 1.2) + pad * 12, pad)
         self.reject_button.clicked.connect(lambda: self.record_result("reject"))
@@ -387,7 +287,7 @@ class App:
         # save main image section
         self.save_main_button = QtWidgets.QPushButton(self.top_bar)
         self.save_main_button.setText("Save")
-        self.save_main_button.setStyleSheet(button_style_active)
+        self.save_main_button.setProperty("active", True)
         self.save_main_button.setFixedSize(int(div_size * 0.4), int(div_size * 0.09375)) # 168 x 21
         self.save_main_button.move(div_size + int(div_size * 1.6) + pad * 14, pad)
         self.save_main_button.clicked.connect(self.save_main)
@@ -396,20 +296,123 @@ class App:
         # load main image section
         self.load_main_button = QtWidgets.QPushButton(self.top_bar)
         self.load_main_button.setText("Load")
-        self.load_main_button.setStyleSheet(button_style_active)
+        self.load_main_button.setProperty("active", True)
         self.load_main_button.setFixedSize(int(div_size * 0.4), int(div_size * 0.09375)) # 168 x 21
         self.load_main_button.move(div_size + int(div_size * 2.0) + pad * 16, pad)
         self.load_main_button.clicked.connect(self.load_main)
 
+        # - category filter dropdown
+        # random images only from the selected category
+        self.category_dropdown = QtWidgets.QComboBox(self.top_bar)
+        self.category_dropdown.setFixedSize(int(div_size * 0.75), int(div_size * 0.09375)) # 168 x 21
+        self.category_dropdown.addItem("All categories", None)
+        for code, food in self.control.catagory2food.items():
+            self.category_dropdown.addItem(f"{code}: {food}", code)
+        self.category_dropdown.currentIndexChanged.connect(self.on_category_changed)
+        self.category_dropdown.move(div_size + int(div_size * 2.4) + pad * 18, pad)
+
+        # - sampling mode dropdown
+        # uniform, images with the fewest validations first, or uniform over groups of near-duplicates
+        # item data: (sampling mode, duplicate mode)
+        self.sampling_mode_dropdown = QtWidgets.QComboBox(self.top_bar)
+        self.sampling_mode_dropdown.setFixedSize(int(div_size * 0.75), int(div_size * 0.09375)) # 168 x 21
+        self.sampling_mode_dropdown.addItem("Uniform", ("uniform", False))
+        self.sampling_mode_dropdown.addItem("Fewest validations", ("coverage", False))
+        self.sampling_mode_dropdown.addItem("One per duplicate group", ("uniform", True))
+        self.sampling_mode_dropdown.currentIndexChanged.connect(self.on_sampling_mode_changed)
+        self.sampling_mode_dropdown.move(div_size + int(div_size * 3.15) + pad * 20, pad)
+
+        # - report button
+        # progress and inter-validator agreement
+        self.report_button = QtWidgets.QPushButton(self.top_bar)
+        self.report_button.setText("Report")
+        self.report_button.setProperty("active", True)
+        self.report_button.setFixedSize(int(div_size * 0.4), int(div_size * 0.09375)) # 168 x 21
+        self.report_button.move(div_size + int(div_size * 3.9) + pad * 22, pad)
+        self.report_button.clicked.connect(self.show_report)
+        # report being built on a worker thread
+        self.report_task = None
+
+        # - gallery button
+        # scrollable gallery over the catalog or one category
+        self.gallery_button = QtWidgets.QPushButton(self.top_bar)
+        self.gallery_button.setText("Gallery")
+        self.gallery_button.setProperty("active", True)
+        self.gallery_button.setFixedSize(int(div_size * 0.4), int(div_size * 0.09375)) # 168 x 21
+        self.gallery_button.move(div_size + int(div_size * 4.3) + pad * 24, pad)
+        self.gallery_button.clicked.connect(self.show_gallery)
+        # created on first use
+        self.gallery = None
+
+        # debug overlay with p50/p99 per operation (metrics.py), toggled with F12
+        # shown from the start with LABEL_VALIDATOR_DEBUG_OVERLAY=1
+        self.metrics_overlay = QLabel(self.root)
+        self.metrics_overlay.setStyleSheet("background-color: rgba(0, 0, 0, 180); color: white; font-family: monospace; padding: 6px;")
+        self.metrics_overlay.setAttribute(Qt.WA_TransparentForMouseEvents)
+        self.metrics_overlay.hide()
+        self.metrics_timer = QTimer(self.root)
+        self.metrics_timer.timeout.connect(self.update_metrics_overlay)
+        QtWidgets.QShortcut(QKeySequence("F12"), self.root, self.toggle_metrics_overlay)
+        if os.environ.get("LABEL_VALIDATOR_DEBUG_OVERLAY") == "1":
+            self.toggle_metrics_overlay()
+
+        # selection and keyboard shortcuts
+        # image last clicked, shift-click selects the range from here
+        self.selection_anchor = None
+        # A / I / R: accept / incorrect / reject the selection, N: next random images,
+        # ctrl+A: select the whole section, Esc: clear the selection
+        # (text boxes keep plain keys and ctrl+A while they have the focus)
+        shortcuts = {
+            "A": lambda: self.record_result("accept"),
+            "I": lambda: self.record_result("incorrect"),
+            "R": lambda: self.record_result("reject"),
+            "N": self.random_image,
+            "Ctrl+A": self.select_all,
+            "Esc": self.clear_selection,
+            "Ctrl+Right": self.next_session,
+            "Ctrl+Left": self.previous_session,
+        }
+        for key, slot in shortcuts.items():
+            QtWidgets.QShortcut(QKeySequence(key), self.root, slot)
+
+        # first random batch is ready before the first click
+        self.prefetch_random_images()
+
     def on_validator_changed(self, index):
-        self.control.current_validator_index = index
+        self.control.set_current_validator(index)
+        self.prefetch_random_images()
+
+    def on_category_changed(self, index):
+        self.control.set_category_filter(self.category_dropdown.itemData(index))
+        self.prefetch_random_images()
 
+    def on_sampling_mode_changed(self, index):
+        sampling_mode, duplicate_mode = self.sampling_mode_dropdown.itemData(index)
+        self.control.set_sampling_mode(sampling_mode)
+        self.control.set_duplicate_mode(duplicate_mode)
+        self.prefetch_random_images()
+
+    @metrics.timed("app.random_image")
     def random_image(self):
+        # use the prefetched batch unless one of its images was validated
+        # or the validator changed since it was drawn
+        rand_img = self.next_random_images
+        sampler = self.control.sampler()
+        if len(rand_img) != len(self.rand_img_div) or not all(image in sampler or image == self.control.placeholder_image for image in rand_img):
+            rand_img = self.control.random_images(num = self.rand_img_div.__len__())
+
         # set images
-        rand_img = self.control.random_images(num = self.rand_img_div.__len__())
         for i, div in enumerate(self.rand_img_div):
             self.set_image_div(div, rand_img[i])
 
+        self.prefetch_random_images()
+
+    def prefetch_random_images(self):
+        self.next_random_images = self.control.random_images(num = self.rand_img_div.__len__())
+        for image in self.next_random_images:
+            if image != self.control.placeholder_image and image not in self.pixmap_cache:
+                self.image_loader.request(("prefetch", image), image)
+
     def swap_image_with_temp(self, img_div):
         # if this is the temp image, do nothing
         if img_div is self.temp_img_div:
@@ -434,58 +437,151 @@ class App:
         img_div.remark_text.setText(temp_remark)
         self.temp_img_div.remark_text.setText(image_remark)
 
-        # reselect image
-        if image_was_selected:
-            self.image_clicked(self.temp_img_div)
-        if temp_was_selected:
-            self.image_clicked(img_div)
-
-
-    def image_clicked(self, image_div):
+        # the selection follows the images
+        if image_was_selected != temp_was_selected:
+            if image_was_selected:
+                self.unselect_div(img_div)
+                self.select_div(self.temp_img_div)
+            else:
+                self.unselect_div(self.temp_img_div)
+                self.select_div(img_div)
+        self.update_validate_buttons()
+
+    # section (random, main or temp) an image div belongs to
+    def section_of(self, image_div):
+        if image_div in self.rand_img_div:
+            return self.rand_img_div
+        if image_div in self.main_img_div:
+            return self.main_img_div
+        return [self.temp_img_div]
+
+    # click: select only this image (or unselect it if it is the only one selected)
+    # ctrl-click: add to or remove from the selection
+    # shift-click: select the range from the last clicked image, within one section
+    @metrics.timed("app.image_clicked")
+    def image_clicked(self, image_div, modifiers = None):
         # if no image, do nothing
         if image_div.current_image == self.control.placeholder_image:
             return
-        
-        if image_div.is_selected:
-            # unselect image
-            image_div.label.setStyleSheet(img_style_unselected)
-            image_div.is_selected = False
-
-            # deactivate buttons
-            self.deactivate_validate_buttons()
-
-            # clear selected image
-            self.control.selected_image_div = None
+        if modifiers is None:
+            modifiers = QtWidgets.QApplication.keyboardModifiers()
+        selected = self.control.selected_image_divs
+
+        if modifiers & Qt.ShiftModifier and self.selection_anchor in self.section_of(image_div) and self.selection_anchor is not image_div:
+            section = self.section_of(image_div)
+            first, last = sorted((section.index(self.selection_anchor), section.index(image_div)))
+            for div in section[first:last + 1]:
+                self.select_div(div)
+        elif modifiers & Qt.ControlModifier:
+            if image_div.is_selected:
+                self.unselect_div(image_div)
+            else:
+                self.select_div(image_div)
+            self.selection_anchor = image_div
+        elif image_div.is_selected and len(selected) == 1:
+            self.unselect_div(image_div)
+        else:
+            self.unselect_all()
+            self.select_div(image_div)
+            self.selection_anchor = image_div
+        self.update_validate_buttons()
+
+    # select every image of the section of the last clicked image, the main section if none
+    def select_all(self):
+        section = self.section_of(self.selection_anchor) if self.selection_anchor is not None else self.main_img_div
+        for div in section:
+            self.select_div(div)
+        self.update_validate_buttons()
+
+    def select_div(self, image_div):
+        if image_div.is_selected or image_div.current_image == self.control.placeholder_image:
             return
-        
-        # activate buttons
-        self.activate_validate_buttons()
-
-        # update selected image
-        self.control.selected_image_div = image_div
+        image_div.is_selected = True
+        set_style_state(image_div.label, "selected", True)
+        self.control.selected_image_divs.append(image_div)
 
-        # unselect all other images
-        for div in self.rand_img_div:
-            div.label.setStyleSheet(img_style_unselected)
-            div.is_selected = False
+    def unselect_div(self, image_div):
+        if not image_div.is_selected:
+            return
+        image_div.is_selected = False
+        set_style_state(image_div.label, "selected", False)
+        self.control.selected_image_divs.remove(image_div)
 
-        for div in self.main_img_div:
-            div.label.setStyleSheet(img_style_unselected)
-            div.is_selected = False
+    def unselect_all(self):
+        for div in list(self.control.selected_image_divs):
+            self.unselect_div(div)
 
-        self.temp_img_div.label.setStyleSheet(img_style_unselected)
-        self.temp_img_div.is_selected = False
+    def clear_selection(self):
+        self.unselect_all()
+        self.update_validate_buttons()
 
-        # select this image
-        image_div.label.setStyleSheet(img_style_selected)
-        image_div.is_selected = True
+    def update_validate_buttons(self):
+        if self.control.selected_image_divs:
+            self.activate_validate_buttons()
+        else:
+            self.deactivate_validate_buttons()
 
+    # one result for every selected image, each with the remark of its own div, written as one batch
     def record_result(self, result):
-        if self.control.selected_image_div is None:
+        if not self.control.selected_image_divs:
+            return
+        self.control.record_result(result, [div.remark_text.toPlainText() for div in self.control.selected_image_divs])
+
+    # the inputs of the report are taken here (a copy of the results table), it is built and formatted on a worker
+    # thread; the button stays inactive until it is shown
+    def show_report(self):
+        if self.report_task is not None:
+            return
+        from app.report import format_report
+        build_report = self.control.report_job()
+        catagory2food = self.control.catagory2food
+        self.report_task = BackgroundTask(lambda: format_report(build_report(), catagory2food))
+        self.report_task.done.connect(self.on_report_built)
+        self.report_task.failed.connect(self.on_report_failed)
+        set_style_state(self.report_button, "active", False)
+        self.report_task.start()
+
+    def on_report_built(self, text):
+        self.report_task = None
+        set_style_state(self.report_button, "active", True)
+        self.show_message("Report", f"<pre>{html.escape(text)}</pre>")
+
+    def on_report_failed(self, message):
+        self.report_task = None
+        set_style_state(self.report_button, "active", True)
+        self.show_message("Report", f"The report could not be built: {html.escape(message)}")
+
+    def show_message(self, title, text):
+        dialog = QtWidgets.QMessageBox(self.root)
+        dialog.setWindowTitle(title)
+        dialog.setText(text)
+        dialog.setStyleSheet(f"background-color: {background_color_light}; color: {text_color};")
+        dialog.exec_()
+
+    def show_gallery(self):
+        if self.gallery is None:
+            self.gallery = GalleryWindow(self, tile_size = div_size, caption_height = int(div_size * 0.09375), pad = pad, style = f"background-color: {background_color_light}; color: {text_color};")
+        else:
+            self.gallery.refresh()
+        self.gallery.show()
+        self.gallery.raise_()
+
+    def toggle_metrics_overlay(self):
+        if self.metrics_overlay.isVisible():
+            self.metrics_timer.stop()
+            self.metrics_overlay.hide()
             return
-        remark = self.control.selected_image_div.remark_text.toPlainText()
-        self.control.record_result(result, remark)
+        self.update_metrics_overlay()
+        self.metrics_overlay.show()
+        self.metrics_overlay.raise_()
+        self.metrics_timer.start(1000)
+
+    def update_metrics_overlay(self):
+        self.metrics_overlay.setText(metrics.format())
+        self.metrics_overlay.adjustSize()
+        self.metrics_overlay.move(pad, self.root.height() - self.metrics_overlay.height() - pad)
 
+    @metrics.timed("app.save_main")
     def save_main(self):
         # save into {date}_{time}.data
         current_time = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
@@ -496,36 +592,86 @@ class App:
         if save_file == "":
             return
 
-        with open(save_file, 'w') as f:
-            images = [(div.current_image, div.remark_text.toPlainText()) for div in self.main_img_div]
-            json.dump(images, f, indent = 4, ensure_ascii = False)
+        self.control.write_session(save_file, [(div.current_image, div.remark_text.toPlainText()) for div in self.main_img_div])
 
     def load_main(self):
-        # select a .data file
-        load_file = QFileDialog.getOpenFileName(self.root, "Select File", filter = "Data Files (*.data)")[0]
-        if load_file == "":
+        # select one or more .data files, more than one make a review queue
+        load_files = QFileDialog.getOpenFileNames(self.root, "Select Files", filter = "Data Files (*.data)")[0]
+        if not load_files:
             return
-        
-        with open(load_file, 'r') as f:
-            images = json.load(f)
-            for img_div, (image, remark) in zip(self.main_img_div, images):
-                self.set_image_div(img_div, image, remark = remark)
+        self.session_files = load_files
+        self.show_session(0)
+
+    # fills the main section right away, tiles show their images as the decodes finish
+    @metrics.timed("app.show_session")
+    def show_session(self, index):
+        if not 0 <= index < len(self.session_files):
+            return
+        session_file = self.session_files[index]
+        try:
+            items, missing = self.control.read_session(session_file)
+        except (OSError, ValueError) as error:
+            QtWidgets.QMessageBox.warning(self.root, "Load", f"{session_file} can not be loaded: {error}")
+            return
+        self.session_index = index
+        self.fill_main(items)
+
+        title = f"Label Validator - {os.path.basename(session_file)}"
+        if len(self.session_files) > 1:
+            title += f" ({index + 1}/{len(self.session_files)})"
+        if missing:
+            title += f" - {len(missing)} not in the catalog"
+        self.root.setWindowTitle(title)
+        self.prefetch_session(index + 1)
+
+    def next_session(self):
+        self.show_session(self.session_index + 1)
+
+    def previous_session(self):
+        self.show_session(self.session_index - 1)
+
+    # decode the images of a queued session into the pixmap cache
+    def prefetch_session(self, index):
+        if index >= len(self.session_files):
+            return
+        try:
+            items, missing = self.control.read_session(self.session_files[index])
+        except (OSError, ValueError):
+            return
+        for image, remark in items:
+            if image != self.control.placeholder_image and image not in self.pixmap_cache:
+                self.image_loader.request(("prefetch", image), image)
+
+    # items: (image path, remark) per main div
+    def fill_main(self, items):
+        for img_div, (image, remark) in zip(self.main_img_div, items):
+            self.set_image_div(img_div, image, remark = remark)
 
+    @metrics.timed("app.set_image_div")
     def set_image_div(self, image_div, image_path, remark = ""):
         # if image is placeholder, clear image div
         if image_path == self.control.placeholder_image:
             self.clear_image_div(image_div)
             return
         
-        image_div.label.setPixmap(QPixmap(image_path))
-        image_div.current_image = image_path
-
-        # update title
-        image_div.title_text.setText(f"No.{self.control.id_of(image_path)}")
-
-        # update current labels
-        image_div.current_label_list.clear()
-        image_div.current_label_list.addItems(self.control.labels_of(image_path))
+        if image_path != image_div.current_image:
+            pixmap = self.pixmap_cache.get(image_path)
+            if pixmap is not None:
+                metrics.increment("app.pixmap_cache_hits")
+                self.image_loader.cancel(image_div)
+                image_div.label.setPixmap(pixmap)
+            else:
+                metrics.increment("app.pixmap_cache_misses")
+                image_div.label.setPixmap(self.placeholder_pixmap)
+                self.image_loader.request(image_div, image_path)
+            image_div.current_image = image_path
+
+            # update title
+            image_div.title_text.setText(f"No.{self.control.id_of(image_path)}")
+
+            # update current labels
+            image_div.current_label_list.clear()
+            image_div.current_label_list.addItems(self.control.labels_of(image_path))
 
         # update remark
         image_div.remark_text.setText(remark)
@@ -539,13 +685,29 @@ class App:
         else:
             self.activate_swap_button(image_div)
 
-        # update selected image
-        if image_div.is_selected:
-            image_div.is_selected = False
-            self.image_clicked(image_div)
+    # key is the image div the image was requested for, or ("prefetch", image path)
+    def on_image_decoded(self, key, ticket, image_path, image):
+        # result of an older request, the div shows another image by now
+        if not self.image_loader.is_current(key, ticket):
+            return
+        self.image_loader.done(key, ticket)
+        if image.isNull():
+            return
+        metrics.increment("app.images_decoded")
+        pixmap = QPixmap.fromImage(image)
+        self.pixmap_cache.put(image_path, pixmap)
+        if not isinstance(key, tuple):
+            key.label.setPixmap(pixmap)
+            return
+        # a prefetched image a div asked for in the meantime, its own request is not needed any more
+        for div in self.rand_img_div + self.main_img_div + [self.temp_img_div]:
+            if div.current_image == image_path and div in self.image_loader.pending:
+                self.image_loader.cancel(div)
+                div.label.setPixmap(pixmap)
 
     def clear_image_div(self, image_div):
-        image_div.label.setPixmap(QPixmap(self.control.placeholder_image))
+        self.image_loader.cancel(image_div)
+        image_div.label.setPixmap(self.placeholder_pixmap)
         image_div.current_image = self.control.placeholder_image
         image_div.title_text.setText("No.")
         image_div.current_label_list.clear()
@@ -555,12 +717,8 @@ class App:
 
         # unselect image
         if image_div.is_selected:
-            self.control.selected_image_div = None
-            image_div.label.setStyleSheet(img_style_unselected)
-            image_div.is_selected = False
-
-            # deactivate buttons
-            self.deactivate_validate_buttons()
+            self.unselect_div(image_div)
+            self.update_validate_buttons()
 
         if image_div is self.temp_img_div:
             self.deactivate_clear_button()
@@ -572,26 +730,25 @@ class App:
                 self.deactivate_swap_button(image_div)
 
     def activate_swap_button(self, image_div):
-        image_div.to_temp_button.setStyleSheet(button_style_active)
+        set_style_state(image_div.to_temp_button, "active", True)
 
     def deactivate_swap_button(self, image_div):
-        image_div.to_temp_button.setStyleSheet(button_style_inactive)
+        set_style_state(image_div.to_temp_button, "active", False)
 
     def activate_clear_button(self):
-        self.temp_img_div.to_temp_button.setStyleSheet(button_style_active)
+        set_style_state(self.temp_img_div.to_temp_button, "active", True)
 
     def deactivate_clear_button(self):
-        self.temp_img_div.to_temp_button.setStyleSheet(button_style_inactive)
+        set_style_state(self.temp_img_div.to_temp_button, "active", False)
 
     def activate_validate_buttons(self):
-        self.accept_button.setStyleSheet(button_style_active)
-        self.incorrect_button.setStyleSheet(button_style_active)
-        self.reject_button.setStyleSheet(button_style_active)
+        for button in (self.accept_button, self.incorrect_button, self.reject_button):
+            set_style_state(button, "active", True)
 
     def deactivate_validate_buttons(self):
-        self.accept_button.setStyleSheet(button_style_inactive)
-        self.incorrect_button.setStyleSheet(button_style_inactive)
-        self.reject_button.setStyleSheet(button_style_inactive)
+        for button in (self.accept_button, self.incorrect_button, self.reject_button):
+            set_style_state(button, "active", False)
 
     def exit(self, event):
+        self.image_loader.shutdown()
         self.control.exit()
@@ -0,0 +1,188 @@
+import os, json, re
+from collections import namedtuple
+
+# format: <food labels>_<image id>_<dataset id>.jpg
+# food labels: Capital letter + 2 digit number, if multiple, no sperator
+# image id: a sequence of digits
+# dataset id: single digit
+image_name_regex = re.compile(r"((?:[A-Z]\d{2})+)_(\d+)_(\d)\.jpg")
+
+# one catalog entry per image file
+# labels: the label string as in the file name, e.g. "A01B01C02"
+CatalogEntry = namedtuple("CatalogEntry", ["path", "labels", "image_id", "dataset_id"])
+
+# image name is the file name without extension, e.g. "A01B01C02_3611_1"
+def image_name_of(image_path):
+    image_name = os.path.basename(image_path)
+    # if has file extension, remove it
+    if '.' in image_name:
+        image_name = image_name[:image_name.index('.')]
+    return image_name
+
+# image roots can be set as LABEL_VALIDATOR_IMAGE_ROOTS (separated by os.pathsep), default is app/images
+def default_image_roots():
+    if os.environ.get("LABEL_VALIDATOR_IMAGE_ROOTS"):
+        return os.environ["LABEL_VALIDATOR_IMAGE_ROOTS"].split(os.pathsep)
+    return [os.path.join(os.path.dirname(__file__), "images")]
+
+# results, the catalog manifest and the thumbnail cache are kept in LABEL_VALIDATOR_DATA_DIR, default is the app directory
+def default_data_dir():
+    return os.environ.get("LABEL_VALIDATOR_DATA_DIR") or os.path.dirname(__file__)
+
+def default_manifest_file():
+    return os.path.join(default_data_dir(), ".catalog.json")
+
+def parse_image_file_name(file_name):
+    match = image_name_regex.match(file_name)
+    if match is None:
+        return None
+    labels, image_id, dataset_id = match.groups()
+    return [labels, image_id, dataset_id]
+
+# Persistent image catalog
+# The parsed file names of every image directory are kept in a manifest file.
+# On refresh only directories whose mtime changed since the last run are scanned again,
+# unchanged directories are taken from the manifest as they are.
+class Catalog:
+
+    manifest_version = 1
+
+    def __init__(self, roots, manifest_file):
+        self.roots = [os.path.abspath(root) for root in roots]
+        self.manifest_file = manifest_file
+
+        # directory path -> {"mtime": mtime in ns, "subdirs": [names], "files": {file name: [labels, image id, dataset id]}}
+        self.directories = {}
+
+        # image name -> CatalogEntry
+        self.entries = {}
+
+        self.load_manifest()
+
+    def load_manifest(self):
+        if not os.path.exists(self.manifest_file):
+            return
+        try:
+            with open(self.manifest_file, "r") as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            # broken manifest, rebuild it from scratch
+            return
+        if manifest.get("version") != self.manifest_version:
+            return
+        self.directories = manifest.get("directories", {})
+
+    def save_manifest(self):
+        manifest = {"version": self.manifest_version, "roots": self.roots, "directories": self.directories}
+        temp_file = self.manifest_file + ".tmp"
+        with open(temp_file, "w") as f:
+            json.dump(manifest, f, ensure_ascii = False, separators = (",", ":"))
+        os.replace(temp_file, self.manifest_file)
+
+    # bring the catalog up to date with the image roots
+    # returns the number of directories that had to be scanned
+    def refresh(self):
+        directories = {}
+        scanned = 0
+        for root in self.roots:
+            scanned += self._refresh_directory(root, directories)
+
+        # directories that disappeared also change the manifest
+        changed = scanned > 0 or directories.keys() != self.directories.keys()
+        self.directories = directories
+        self._rebuild_entries()
+        if changed:
+            self.save_manifest()
+        return scanned
+
+    def _refresh_directory(self, path, directories):
+        # a directory may be reachable from more than one root
+        if path in directories:
+            return 0
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return 0
+
+        scanned = 0
+        record = self.directories.get(path)
+        if record is None or record["mtime"] != mtime:
+            record = self._scan_directory(path, mtime)
+            scanned = 1
+        directories[path] = record
+
+        # a change inside a sub directory does not change the mtime of its parent,
+        # so sub directories are always checked on their own
+        for subdir in record["subdirs"]:
+            scanned += self._refresh_directory(os.path.join(path, subdir), directories)
+        return scanned
+
+    def _scan_directory(self, path, mtime):
+        subdirs = []
+        files = {}
+        try:
+            with os.scandir(path) as it:
+                for entry in it:
+                    if entry.name.startswith('.'):
+                        continue
+                    if entry.is_dir(follow_symlinks = False):
+                        subdirs.append(entry.name)
+                        continue
+                    parsed = parse_image_file_name(entry.name)
+                    if parsed is not None:
+                        files[entry.name] = parsed
+        except OSError:
+            pass
+        return {"mtime": mtime, "subdirs": sorted(subdirs), "files": files}
+
+    def _rebuild_entries(self):
+        entries = {}
+        # earlier roots win if the same image is found more than once
+        for path, record in self.directories.items():
+            for file_name, (labels, image_id, dataset_id) in record["files"].items():
+                image_name = image_name_of(file_name)
+                if image_name not in entries:
+                    entries[image_name] = CatalogEntry(os.path.join(path, file_name), labels, image_id, dataset_id)
+        self.entries = entries
+
+    # incremental updates for files added or removed while the app runs (watcher.py)
+    # the directory keeps its old mtime in the manifest, so it is scanned again on the next refresh
+    # returns the new entry, None if the file does not fit the name format or the image is known already
+    def add_file(self, path):
+        directory, file_name = os.path.split(path)
+        parsed = parse_image_file_name(file_name)
+        if parsed is None:
+            return None
+        record = self.directories.setdefault(directory, {"mtime": None, "subdirs": [], "files": {}})
+        record["files"][file_name] = parsed
+        image_name = image_name_of(file_name)
+        if image_name in self.entries:
+            return None
+        entry = CatalogEntry(path, *parsed)
+        self.entries[image_name] = entry
+        return entry
+
+    # returns the removed entry, None if the file was not the catalog entry of its image
+    def remove_file(self, path):
+        directory, file_name = os.path.split(path)
+        record = self.directories.get(directory)
+        if record is not None:
+            record["files"].pop(file_name, None)
+        image_name = image_name_of(file_name)
+        entry = self.entries.get(image_name)
+        if entry is None or entry.path != path:
+            return None
+        del self.entries[image_name]
+        return entry
+
+    def directory_snapshot(self):
+        return {path: (record["mtime"], list(record["files"]), list(record["subdirs"])) for path, record in self.directories.items()}
+
+    def paths(self):
+        return [entry.path for entry in self.entries.values()]
+
+    def get(self, image_path):
+        return self.entries.get(image_name_of(image_path))
+
+    def __len__(self):
+        return len(self.entries)
@@ -0,0 +1,272 @@
+import os, sys, json, argparse
+from collections import Counter
+from app.core import ControlSystem
+from app.catalog import image_name_of
+from app.export import export_formats, export_results
+from app import merge
+from app.results import ResultsLockedError, ResultsUnavailableError
+from app.results_model import read_results_file, read_timestamps_file
+
+# Command line tools, no Qt involved
+# usage: python -m app stats|export|import|merge|validate-batch|query|report|duplicates|check-images|serve ...
+
+results_choices = ["accept", "incorrect", "reject"]
+
+def stats(control, args):
+    per_validator = Counter()
+    per_result = Counter()
+    validated_images = set()
+    for image, validator, result, remark in control.results.iter_records():
+        per_validator[validator] += 1
+        per_result[result] += 1
+        validated_images.add(image)
+
+    print(f"images: {len(control.catalog)}")
+    print(f"validated images: {len(validated_images)}")
+    print(f"results: {sum(per_result.values())}")
+    for validator, count in per_validator.most_common():
+        print(f"  {validator}: {count}")
+    for result, count in per_result.most_common():
+        print(f"  {result}: {count}")
+    return 0
+
+# writes {image: {validator: "result - remark"}} one image at a time,
+# or flat CSV/JSONL rows through app.export
+def export(control, args):
+    if args.format != "json":
+        return export_rows(control, args)
+    if args.incremental:
+        print("--incremental needs --format csv or jsonl", file = sys.stderr)
+        return 2
+    out = open(args.output, "w") if args.output else sys.stdout
+    try:
+        out.write("{")
+        current_image = None
+        for image, validator, result, remark in control.results.iter_records():
+            if image != current_image:
+                if current_image is not None:
+                    out.write("},")
+                out.write(f"\n{json.dumps(image, ensure_ascii = False)}:{{")
+                current_image = image
+            else:
+                out.write(",")
+            out.write(f"{json.dumps(validator, ensure_ascii = False)}:{json.dumps(result + ' - ' + remark, ensure_ascii = False)}")
+        if current_image is not None:
+            out.write("}")
+        out.write("\n}\n")
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    return 0
+
+def export_rows(control, args):
+    watermark_file = args.watermark
+    if args.incremental and not watermark_file:
+        if not args.output:
+            print("--incremental needs --watermark FILE when writing to stdout", file = sys.stderr)
+            return 2
+        watermark_file = args.output + ".watermark"
+    count = export_results(control.results, control.catalog, args.format, args.output, out = sys.stdout, watermark_file = watermark_file if args.incremental else None)
+    print(f"{count} results exported", file = sys.stderr)
+    return 0
+
+# merge validate_results.json files (either snapshot version) into the results store, one batched write per file
+# every result keeps its time and is only taken if it is newer than the local result of its (image, validator),
+# so importing an older file never overwrites newer verdicts (a version 1 file brings its .timestamps.json along,
+# its results without a time are older than any local result)
+def import_results(control, args):
+    for file in args.files:
+        try:
+            records = read_import_file(file)
+        except OSError as error:
+            print(f"{file}: cannot be read: {error.strerror}", file = sys.stderr)
+            return 2
+        except ValueError as error:
+            print(f"{file}: not a results file: {error}", file = sys.stderr)
+            return 2
+        taken = control.results.import_records(records)
+        print(f"{file}: {len(records)} results, {taken} newer than the local ones imported")
+    return 0
+
+# [(image, validator, result, remark, ts)] of a results file, ValueError if it is malformed
+def read_import_file(file):
+    timestamps = {}
+    timestamps_file = os.path.splitext(file)[0] + ".timestamps.json"
+    try:
+        records = list(read_results_file(file))
+        if os.path.exists(timestamps_file):
+            timestamps = {(image, validator): ts for image, validator, ts in read_timestamps_file(timestamps_file)}
+    except (LookupError, TypeError, AttributeError) as error:
+        raise ValueError(f"unexpected structure ({error!r})") from error
+    for record in records:
+        if not all(isinstance(field, str) for field in record[:4]) or not isinstance(record[4], (int, float)):
+            raise ValueError(f"malformed result {record!r}")
+    return [(image, validator, result, remark, ts or timestamps.get((image, validator), 0)) for image, validator, result, remark, ts in records]
+
+def validate_batch(control, args):
+    if args.validator not in control.validators:
+        print(f"unknown validator {args.validator!r}, one of: {', '.join(control.validators)}", file = sys.stderr)
+        return 2
+    control.set_current_validator(control.validators.index(args.validator))
+
+    images = args.images
+    if not images or images == ["-"]:
+        images = [line.strip() for line in sys.stdin if line.strip()]
+
+    known = []
+    for image in images:
+        if control.catalog.get(image) is None:
+            print(f"not in catalog, skipped: {image_name_of(image)}", file = sys.stderr)
+            continue
+        known.append((image, args.remark))
+    # one batched write for all of them
+    control.record_image_results(known, args.result)
+    print(f"{len(known)} results recorded for {args.validator}")
+    return 0
+
+# images by label, e.g. unvalidated images carrying B03, or the number of images carrying both C02 and D01
+def query(control, args):
+    index = control.label_index()
+    images = index.images_with(all_of = args.all_of, any_of = args.any_of, none_of = args.none_of)
+    if args.unvalidated_by:
+        validated = control.results.images_validated_by(args.unvalidated_by)
+        images = [image for image in images if image not in validated]
+    if args.count:
+        print(len(images))
+    else:
+        for image in images:
+            print(image)
+    return 0
+
+# progress and inter-validator agreement
+def report(control, args):
+    from app.report import format_report
+    result = control.report()
+    if args.json:
+        print(json.dumps(result, ensure_ascii = False, indent = 4))
+    else:
+        print(format_report(result, control.catagory2food))
+    return 0
+
+# perceptual hashes of new or changed images, then the groups of near-duplicates
+def duplicates(control, args):
+    from app.duplicates import DuplicateIndex, PerceptualHashStore, default_hash_file
+    store = PerceptualHashStore(default_hash_file())
+    hashed = store.update(control.catalog, processes = args.processes, progress = lambda done, total: print(f"{done}/{total} hashed", file = sys.stderr))
+    index = DuplicateIndex({image_name: value for image_name, value in store.values().items() if image_name in control.catalog.entries}, threshold = args.threshold)
+    if args.list:
+        for representative, members in sorted(index.groups.items()):
+            print(" ".join(members))
+    else:
+        print(f"images: {len(control.catalog)}, newly hashed: {hashed}")
+        print(f"groups of near-duplicates: {len(index.groups)} ({len(index.group_of)} images)")
+    return 0
+
+# check new or changed image files, then the report of bad and unusual images
+def check_images(control, args):
+    from app.image_check import ImageCheckStore, check_report, default_check_file, format_check_report
+    store = ImageCheckStore(default_check_file())
+    checked = 0
+    if not args.no_update:
+        checked = store.update(list(control.catalog.entries.items()), processes = args.processes, progress = lambda done, total: print(f"{done}/{total} checked", file = sys.stderr))
+    result = check_report(store.checks, control.catalog.entries)
+    if args.json:
+        print(json.dumps(result, ensure_ascii = False, indent = 4))
+    else:
+        print(f"images: {len(control.catalog)}, newly checked: {checked}")
+        print(format_check_report(result))
+    return 1 if result["bad"] else 0
+
+# work distribution server for several validator workstations
+def serve(control, args):
+    from app.coordinator import make_server
+    server = make_server(control, args.host, args.port, lease_seconds = args.lease_seconds)
+    print(f"coordinator listening on http://{args.host}:{server.server_port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog = "python -m app", description = "Label Validator command line tools, run without arguments to start the GUI.")
+    commands = parser.add_subparsers(dest = "command", required = True)
+
+    command = commands.add_parser("stats", help = "number of images and results")
+    command.set_defaults(func = stats)
+
+    command = commands.add_parser("export", help = "write all results as validate_results.json, CSV or JSONL")
+    command.add_argument("-o", "--output", help = "output file, default stdout")
+    command.add_argument("--format", default = "json", choices = ["json"] + export_formats)
+    command.add_argument("--incremental", action = "store_true", help = "only results changed since the last incremental export (csv and jsonl)")
+    command.add_argument("--watermark", metavar = "FILE", help = "where the incremental export keeps its watermark, default OUTPUT.watermark")
+    command.set_defaults(func = export)
+
+    command = commands.add_parser("import", help = "merge validate_results.json files into the results, newer results win")
+    command.add_argument("files", nargs = "+")
+    command.set_defaults(func = import_results)
+
+    # works on files only, runs without a ControlSystem
+    command = commands.add_parser("merge", help = "merge results files of several machines into one")
+    merge.add_arguments(command)
+
+    command = commands.add_parser("validate-batch", help = "record one result for many images")
+    command.add_argument("--validator", required = True)
+    command.add_argument("--result", required = True, choices = results_choices)
+    command.add_argument("--remark", default = "")
+    command.add_argument("images", nargs = "*", help = "image names or paths, read from stdin if none or -")
+    command.set_defaults(func = validate_batch)
+
+    codes = list(ControlSystem.catagory2food)
+    command = commands.add_parser("query", help = "images by category codes")
+    command.add_argument("--all", dest = "all_of", nargs = "+", default = [], choices = codes, metavar = "CODE", help = "carrying all of these codes")
+    command.add_argument("--any", dest = "any_of", nargs = "+", default = [], choices = codes, metavar = "CODE", help = "carrying at least one of these codes")
+    command.add_argument("--none", dest = "none_of", nargs = "+", default = [], choices = codes, metavar = "CODE", help = "carrying none of these codes")
+    command.add_argument("--unvalidated-by", metavar = "VALIDATOR", help = "only images this validator has not validated")
+    command.add_argument("--count", action = "store_true", help = "print the number of images only")
+    command.set_defaults(func = query)
+
+    command = commands.add_parser("report", help = "progress and inter-validator agreement")
+    command.add_argument("--json", action = "store_true", help = "machine-readable output")
+    command.set_defaults(func = report)
+
+    command = commands.add_parser("duplicates", help = "hash new images and group near-duplicates")
+    command.add_argument("--processes", type = int, help = "hashing processes, default one per CPU")
+    command.add_argument("--threshold", type = int, default = 6, help = "maximum number of differing hash bits")
+    command.add_argument("--list", action = "store_true", help = "print every group, one line of image names each")
+    command.set_defaults(func = duplicates)
+
+    command = commands.add_parser("check-images", help = "decode new images, report bad and unusual ones")
+    command.add_argument("--processes", type = int, help = "checking processes, default one per CPU")
+    command.add_argument("--no-update", action = "store_true", help = "only report the images checked before")
+    command.add_argument("--json", action = "store_true", help = "machine-readable output")
+    command.set_defaults(func = check_images)
+
+    command = commands.add_parser("serve", help = "run the work distribution server")
+    command.add_argument("--host", default = "127.0.0.1")
+    command.add_argument("--port", type = int, default = 8765)
+    command.add_argument("--lease-seconds", type = int, default = 600)
+    command.set_defaults(func = serve)
+
+    args = parser.parse_args(argv)
+    if args.command == "merge":
+        return merge.merge_command(args)
+    # the server is long running and the one place that must not lease from a server itself
+    serving = args.command == "serve"
+    # only the commands that record results take the writer lock, and they do not wait for it:
+    # while the GUI (or another writer) runs they refuse, the other commands read the files as they are
+    writes = args.command in ("import", "validate-batch", "serve")
+    try:
+        control = ControlSystem(background = serving, use_coordinator = not serving, read_only = not writes, results_lock_timeout = 0)
+    except ResultsLockedError as error:
+        print(f"{error}, close it and try again", file = sys.stderr)
+        return 2
+    except ResultsUnavailableError as error:
+        print(error, file = sys.stderr)
+        return 2
+    try:
+        return args.func(control, args)
+    finally:
+        control.close()
@@ -0,0 +1,200 @@
+import json, time, uuid, threading
+import urllib.request, urllib.error
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from app.catalog import image_name_of
+from app.results_model import result_names
+from app.sampler import RandomPool
+
+# Work distribution between validator workstations
+# A small HTTP/JSON server hands out time-limited leases on batches of images per validator,
+# so the same validator working on two machines never gets the same image twice.
+# Images are sent as image names, every workstation resolves them through its own catalog.
+#
+# POST /lease   {"validator", "count"}                        -> {"lease", "images", "expires"}
+# POST /submit  {"validator", "lease", "results": [{"image", "result", "remark"}]} -> {"recorded"}
+# POST /release {"validator", "lease"}                        -> {"released"}
+# A lease belongs to the validator it was handed to, submitting into or releasing another validator's lease
+# is refused, like a count below 1 or a result other than accept, incorrect or reject (400).
+# GET  /validators                                            -> {"validators"}
+
+class Coordinator:
+
+    def __init__(self, control, *, lease_seconds = 600):
+        self.control = control
+        self.lease_seconds = lease_seconds
+        # validator -> pool of image names neither validated by nor leased to that validator
+        self.pools = {}
+        # lease id -> {"validator", "images": set of image names, "expires"}
+        self.leases = {}
+        self.lock = threading.Lock()
+
+    def pool(self, validator):
+        if validator not in self.pools:
+            validated = self.control.results.images_validated_by(validator)
+            leased = {image for lease in self.leases.values() if lease["validator"] == validator for image in lease["images"]}
+            bad = self.control.bad_images
+            self.pools[validator] = RandomPool(image for image in self.control.catalog.entries if image not in validated and image not in leased and image not in bad)
+        return self.pools[validator]
+
+    def check_validator(self, validator):
+        if validator not in self.control.validators:
+            raise ValueError(f"unknown validator {validator!r}")
+
+    # {"image", "result", "remark"} -> (image, result, remark)
+    @staticmethod
+    def check_record(record):
+        image, result, remark = record["image"], record["result"], record["remark"]
+        if not isinstance(image, str) or not (remark is None or isinstance(remark, str)):
+            raise ValueError(f"malformed result {record!r}")
+        if result not in result_names:
+            raise ValueError(f"unknown result {result!r}, one of: {', '.join(result_names)}")
+        return image, result, remark
+
+    # the lease of lease_id if it is one of validator's, None if there is none (e.g. expired)
+    # called with the lock held
+    def lease_of(self, validator, lease_id):
+        lease = self.leases.get(lease_id)
+        if lease is not None and lease["validator"] != validator:
+            raise ValueError(f"lease {lease_id} is not a lease of {validator!r}")
+        return lease
+
+    def lease(self, validator, count):
+        self.check_validator(validator)
+        if count < 1:
+            raise ValueError(f"count must be at least 1, not {count}")
+        with self.lock:
+            self.reclaim_expired()
+            self.apply_catalog_changes()
+            pool = self.pool(validator)
+            images = pool.sample(count)
+            for image in images:
+                pool.discard(image)
+            lease_id = uuid.uuid4().hex
+            expires = time.time() + self.lease_seconds
+            self.leases[lease_id] = {"validator": validator, "images": set(images), "expires": expires}
+        return {"lease": lease_id, "images": images, "expires": expires}
+
+    # the whole batch is checked before anything is recorded, a malformed record fails it as a whole
+    def submit(self, validator, lease_id, results):
+        self.check_validator(validator)
+        records = [self.check_record(record) for record in results]
+        with self.lock:
+            lease = self.lease_of(validator, lease_id)
+            self.control.results.record_many([(image, validator, result, remark) for image, result, remark in records])
+            pool = self.pool(validator)
+            for image, result, remark in records:
+                pool.discard(image)
+                if lease is not None:
+                    lease["images"].discard(image)
+            if lease is not None and not lease["images"]:
+                del self.leases[lease_id]
+        return {"recorded": len(results)}
+
+    def release(self, validator, lease_id):
+        self.check_validator(validator)
+        with self.lock:
+            lease = self.lease_of(validator, lease_id)
+            if lease is not None:
+                del self.leases[lease_id]
+                self.return_images(lease)
+        return {"released": lease is not None}
+
+    # images added to or removed from the image roots since the last lease
+    # called with the lock held
+    def apply_catalog_changes(self):
+        for kind, entry in self.control.apply_catalog_changes():
+            image_name = image_name_of(entry.path)
+            for validator, pool in self.pools.items():
+                if kind != "added":
+                    pool.discard(image_name)
+                elif not self.control.results.has(image_name, validator):
+                    pool.add(image_name)
+
+    # called with the lock held
+    def reclaim_expired(self):
+        now = time.time()
+        for lease_id in [lease_id for lease_id, lease in self.leases.items() if lease["expires"] < now]:
+            self.return_images(self.leases.pop(lease_id))
+
+    # called with the lock held
+    def return_images(self, lease):
+        validator = lease["validator"]
+        if validator not in self.pools:
+            return
+        for image in lease["images"]:
+            if not self.control.results.has(image, validator):
+                self.pools[validator].add(image)
+
+class CoordinatorHandler(BaseHTTPRequestHandler):
+
+    # set by serve()
+    coordinator = None
+
+    def do_GET(self):
+        if self.path == "/validators":
+            self.reply(200, {"validators": self.coordinator.control.validators})
+        else:
+            self.reply(404, {"error": "not found"})
+
+    def do_POST(self):
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            if self.path == "/lease":
+                response = self.coordinator.lease(request["validator"], int(request.get("count", 1)))
+            elif self.path == "/submit":
+                response = self.coordinator.submit(request["validator"], request.get("lease"), request["results"])
+            elif self.path == "/release":
+                response = self.coordinator.release(request["validator"], request["lease"])
+            else:
+                self.reply(404, {"error": "not found"})
+                return
+        except (KeyError, TypeError, ValueError) as error:
+            self.reply(400, {"error": str(error)})
+            return
+        self.reply(200, response)
+
+    def reply(self, status, body):
+        data = json.dumps(body, ensure_ascii = False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+def make_server(control, host = "127.0.0.1", port = 8765, *, lease_seconds = 600):
+    handler = type("Handler", (CoordinatorHandler,), {"coordinator": Coordinator(control, lease_seconds = lease_seconds)})
+    return ThreadingHTTPServer((host, port), handler)
+
+# Client side, used by ControlSystem
+# every call raises OSError (including URLError and timeouts) or ValueError when the server is unavailable
+class CoordinatorClient:
+
+    def __init__(self, url, *, timeout = 2):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+
+    def post(self, path, body):
+        request = urllib.request.Request(
+            self.url + path,
+            data = json.dumps(body, ensure_ascii = False).encode("utf-8"),
+            headers = {"Content-Type": "application/json"}
+        )
+        try:
+            with urllib.request.urlopen(request, timeout = self.timeout) as response:
+                return json.loads(response.read())
+        except urllib.error.HTTPError as error:
+            raise ValueError(f"coordinator replied {error.code}: {error.read().decode('utf-8', 'replace')}")
+
+    def lease(self, validator, count):
+        return self.post("/lease", {"validator": validator, "count": count})
+
+    # results: [(image path or name, result, remark)]
+    def submit(self, validator, lease_id, results):
+        records = [{"image": image_name_of(image), "result": result, "remark": remark} for image, result, remark in results]
+        return self.post("/submit", {"validator": validator, "lease": lease_id, "results": records})
+
+    def release(self, validator, lease_id):
+        return self.post("/release", {"validator": validator, "lease": lease_id})
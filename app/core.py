@@ -0,0 +1,641 @@
+import os, sys, json, atexit, time, threading
+from collections import deque
+from app.catalog import Catalog, image_name_of, default_data_dir, default_image_roots, default_manifest_file
+from app.sampler import RandomPool, CoveragePool
+from app.results import JournalResultsStore, ResultsUnavailableError
+from app.results_sqlite import SqliteResultsStore
+from app.metrics import metrics
+from app.watcher import start_watcher
+from app.session import read_session, write_session
+
+# number of results in the JSON results files, read without the writer lock
+def count_json_results(results_file, journal_file):
+    if not (os.path.exists(results_file) or os.path.exists(journal_file)):
+        return 0
+    json_store = JournalResultsStore(results_file, journal_file, read_only = True)
+    json_store.load()
+    json_store.close()
+    return len(json_store)
+
+# Backend logic, free of Qt so it can be used by the command line tools and on headless machines
+# background: run the heartbeat thread, off for short-lived scripts that close() when done
+# read_only: open the results without the writer lock (results.py), for tools that only read them while
+# the GUI may be writing (a SQLite database is opened read-only, ResultsUnavailableError if it cannot be read as it is);
+# results_lock_timeout: seconds to wait for the lock held by another writer
+class ControlSystem:
+
+    catagory2food = {
+        'A01': '米食',
+        'A02': '麵食',
+        'B01': '豬肉',
+        'B02': '雞肉',
+        'B03': '牛肉',
+        'B04': '羊肉',
+        'B05': '鴨肉',
+        'B06': '鵝肉',
+        'C01': '水果類',
+        'C02': '葉菜類',
+        'C03': '瓜果類',
+        'C04': '花菜花瓣類',
+        'C05': '根莖類',
+        'C06': '種子核果類',
+        'C07': '海菜菇蕈類',
+        'C08': '蒟蒻',
+        'D01': '魚肉',
+        'D02': '貝類',
+        'D03': '甲殼類',
+        'D04': '頭足軟體',
+        'E01': '蛋',
+        'E02': '豆腐',
+        'E03': '豆乾豆包',
+        'F01': '奶類'
+    }
+
+    @metrics.timed("control.startup")
+    def __init__(self, image_roots = None, *, background = True, use_coordinator = True, read_only = False, results_lock_timeout = 10):
+        # image paths
+        self.images_folder = os.path.join(os.path.dirname(__file__), "images")
+        # image roots can be given as argument or as LABEL_VALIDATOR_IMAGE_ROOTS (separated by os.pathsep)
+        self.image_roots = image_roots or default_image_roots()
+        # all images in the roots that fit the name format
+        # format: <food labels>_<image id>_<dataset id>.jpg
+        # parsed names are kept in the catalog manifest, only changed directories are scanned again
+        self.catalog = Catalog(self.image_roots, default_manifest_file())
+        self.catalog.refresh()
+
+        # images added to or removed from the roots while running (watcher.py), queued by the watcher thread
+        # and applied to the catalog and samplers by the thread that samples next (apply_catalog_changes)
+        self.catalog_changes = deque()
+        self.watcher = None
+
+        # Validators
+        self.validators = ["Jeffrey Chen", "Nancy Li", "Zoe Wang", "Vivian Wu"]
+        self.current_validator_index = 0
+        # validator -> pool of images not yet validated by that validator
+        self.samplers = {}
+
+        # label bit masks of all images (label_index.py), built on first use
+        self._label_index = None
+        # category code random images must carry, None for all images
+        self.category_filter = None
+        # "uniform": any image the validator has not validated
+        # "coverage": images with the fewest validations (by anyone) first
+        self.sampling_mode = "uniform"
+        # only one image per group of near-duplicates is drawn (duplicates.py), its result is also recorded for the others
+        self.duplicate_mode = False
+        # built on a thread of its own, None until it is ready
+        self._duplicate_index = None
+        self.duplicate_index_thread = None
+        # a sampler was built in duplicate mode before the index was ready, rebuilt once it is
+        self.samplers_without_duplicates = False
+        # label string -> label texts shown in the GUI
+        self.label_texts = {}
+        # names of images found broken by the pre-validation pass (image_check.py), never drawn as random images
+        self.bad_images = set()
+        self.image_checks = None
+        self.image_checks_stopped = False
+
+        # placeholder image
+        self.placeholder_image = os.path.join(os.path.dirname(__file__), "system_img", "placeholder.png")
+
+        # selected image divs, in the order they were selected
+        self.selected_image_divs = []
+
+        # Validate Results
+        # backend is chosen with LABEL_VALIDATOR_RESULTS_BACKEND: "json" (default) or "sqlite"
+        # json: validate_results.json is the snapshot, every result is also appended to the journal,
+        #       the journal is replayed on start and folded back into the snapshot in the background
+        # sqlite: results are kept in a database (LABEL_VALIDATOR_RESULTS_DB) that several app instances can share
+        data_dir = default_data_dir()
+        results_file = os.path.join(data_dir, "validate_results.json")
+        journal_file = os.path.join(data_dir, "validate_results.journal.jsonl")
+        if os.environ.get("LABEL_VALIDATOR_RESULTS_BACKEND", "json") == "sqlite":
+            database_file = os.environ.get("LABEL_VALIDATOR_RESULTS_DB", os.path.join(data_dir, "validate_results.sqlite3"))
+            self.results = SqliteResultsStore(database_file, read_only = read_only)
+            # the database is only created and filled by writers, a reader must not take results still in the
+            # JSON files for no results at all
+            not_imported = f"the results in {data_dir} have not been imported into {database_file} yet, start the app once to import them"
+            if read_only and not os.path.exists(database_file) and count_json_results(results_file, journal_file):
+                raise ResultsUnavailableError(not_imported)
+            self.results.load()
+            # first start with the database, bring over the results saved so far
+            if self.results.is_empty() and (os.path.exists(results_file) or os.path.exists(journal_file)):
+                if not read_only:
+                    self.results.import_json(results_file, journal_file)
+                elif count_json_results(results_file, journal_file):
+                    self.results.close()
+                    raise ResultsUnavailableError(not_imported)
+        else:
+            # one process writes the files, raises ResultsLockedError while another one does
+            self.results = JournalResultsStore(results_file, journal_file, read_only = read_only, lock_timeout = results_lock_timeout)
+            self.results.load()
+
+        # work distribution server (coordinator.py), set as LABEL_VALIDATOR_COORDINATOR=http://host:port
+        # random images are taken from leases on the server, local sampling is the fallback when it is unavailable
+        self.coordinator = None
+        if use_coordinator and os.environ.get("LABEL_VALIDATOR_COORDINATOR"):
+            # imported only here, the HTTP client (urllib, http.client, ssl) is a large share of the import time
+            from app.coordinator import CoordinatorClient
+            self.coordinator = CoordinatorClient(os.environ["LABEL_VALIDATOR_COORDINATOR"])
+        self.lease_size = 30
+        # leased images of the current validator not shown yet: [(lease id, image path)]
+        self.leased_images = []
+        # image name -> lease id of leased images that were shown
+        self.lease_of = {}
+        # results waiting to be sent to the server: [(validator, lease id, image name, result, remark)]
+        self.pending_submissions = []
+        self.coordinator_lock = threading.Lock()
+        self.refilling_leases = False
+        # do not try the server again before this time after it failed
+        self.coordinator_retry_at = 0
+        if self.coordinator is not None:
+            self.refill_leases()
+
+        # latency histograms and counters (metrics.py) are appended to metrics.jsonl every metrics_interval seconds
+        self.metrics_file = os.path.join(data_dir, "metrics.jsonl")
+        self.metrics_interval = 60
+
+        # prevent data loss
+        atexit.register(self.close)
+        # heartbeat file written by older versions
+        self.heartbeat_file = os.path.join(data_dir, ".heartbeat.json")
+
+        # Check for unclean shutdown
+        if not read_only and self.was_unclean_shutdown():
+            self.recover_from_unclean_shutdown()
+
+        # Start heartbeat in a separate thread
+        if background:
+            threading.Thread(target = self.start_heartbeat, daemon = True).start()
+
+        # watch the image roots, set LABEL_VALIDATOR_WATCH=0 to turn it off
+        if background and os.environ.get("LABEL_VALIDATOR_WATCH", "1") != "0":
+            self.watcher = start_watcher(self.catalog.directory_snapshot(), self.queue_catalog_change)
+
+        # pre-validate new and changed image files in the background, set LABEL_VALIDATOR_IMAGE_CHECK=0 to turn it off
+        if background and os.environ.get("LABEL_VALIDATOR_IMAGE_CHECK", "1") != "0":
+            from app.image_check import ImageCheckStore, default_check_file
+            # the checks of earlier runs are loaded before any sampler is built,
+            # so images known to be broken are never drawn, not even in the first batch
+            self.image_checks = ImageCheckStore(default_check_file())
+            self.bad_images = {image_name for image_name in self.image_checks.bad_names() if image_name in self.catalog.entries}
+            # the entries are listed here, before the GUI thread starts changing the catalog
+            threading.Thread(target = self.check_images, args = (list(self.catalog.entries.items()),), daemon = True).start()
+
+        '''
+        # print selected image in a separate thread for debugging
+        def print_selected_image():
+            while True:
+                time.sleep(1)
+                print([div.current_image for div in self.selected_image_divs])
+
+        threading.Thread(target = print_selected_image, daemon = True).start()
+        '''
+
+    # let the results store flush and compact in the background
+    # and send results to the work distribution server
+    def start_heartbeat(self):
+        last_metrics_dump = time.time()
+        while True:
+            time.sleep(1)
+            # a failing tick (disk full, a file removed under us) is counted and reported, the next one retries
+            try:
+                with metrics.timer("control.heartbeat"):
+                    self.results.maintain()
+                self.submit_pending_results()
+            except Exception as error:
+                metrics.increment("control.heartbeat_errors")
+                print(f"heartbeat failed: {error!r}", file = sys.stderr)
+            if time.time() - last_metrics_dump >= self.metrics_interval:
+                self.dump_metrics()
+                last_metrics_dump = time.time()
+
+    def dump_metrics(self):
+        try:
+            metrics.dump(self.metrics_file)
+        except OSError:
+            pass
+
+    def coordinator_available(self):
+        return self.coordinator is not None and time.time() >= self.coordinator_retry_at
+
+    def coordinator_failed(self):
+        metrics.increment("control.coordinator_failures")
+        self.coordinator_retry_at = time.time() + 30
+
+    # fetch a new lease on a background thread, unless one is on its way
+    def refill_leases(self):
+        if not self.coordinator_available():
+            return
+        with self.coordinator_lock:
+            if self.refilling_leases:
+                return
+            self.refilling_leases = True
+        threading.Thread(target = self.fetch_lease, args = (self.current_validator(),), daemon = True).start()
+
+    def fetch_lease(self, validator):
+        try:
+            lease = self.coordinator.lease(validator, self.lease_size)
+        except (OSError, ValueError):
+            self.coordinator_failed()
+            return
+        finally:
+            with self.coordinator_lock:
+                self.refilling_leases = False
+        with self.coordinator_lock:
+            stale = validator != self.current_validator()
+        # the validator changed meanwhile
+        if stale:
+            self.release_lease_ids(validator, [lease["lease"]])
+            return
+        with self.coordinator_lock:
+            for image_name in lease["images"]:
+                entry = self.catalog.entries.get(image_name)
+                if entry is not None:
+                    self.leased_images.append((lease["lease"], entry.path))
+
+    # hand the leases of validator back to the server: the images not shown yet and the ones shown but not judged
+    # background: on a thread of its own, otherwise the call waits for the server
+    def release_leases(self, validator, *, background = True):
+        with self.coordinator_lock:
+            lease_ids = {lease_id for lease_id, image in self.leased_images} | {lease_id for lease_id in self.lease_of.values() if lease_id is not None}
+            self.leased_images = []
+            self.lease_of = {}
+        if not lease_ids or not self.coordinator_available():
+            return
+        if background:
+            threading.Thread(target = self.release_lease_ids, args = (validator, sorted(lease_ids)), daemon = True).start()
+        else:
+            self.release_lease_ids(validator, sorted(lease_ids))
+
+    def release_lease_ids(self, validator, lease_ids):
+        for lease_id in lease_ids:
+            try:
+                self.coordinator.release(validator, lease_id)
+            except (OSError, ValueError):
+                # the server reclaims it when it expires
+                self.coordinator_failed()
+                return
+
+    def take_leased_images(self, num):
+        with self.coordinator_lock:
+            images = []
+            while self.leased_images and len(images) < num:
+                lease_id, image = self.leased_images.pop()
+                if image_name_of(image) not in self.bad_images and not self.is_already_validated_by_current_validator(image):
+                    self.lease_of[image_name_of(image)] = lease_id
+                    images.append(image)
+            running_low = len(self.leased_images) < self.lease_size // 2
+        if running_low:
+            self.refill_leases()
+        return images
+
+    def submit_pending_results(self):
+        if not self.coordinator_available():
+            return
+        with self.coordinator_lock:
+            pending, self.pending_submissions = self.pending_submissions, []
+        # one request per (validator, lease)
+        batches = {}
+        for validator, lease_id, image_name, result, remark in pending:
+            batches.setdefault((validator, lease_id), []).append((image_name, result, remark))
+        for (validator, lease_id), results in batches.items():
+            try:
+                self.coordinator.submit(validator, lease_id, results)
+            except (OSError, ValueError):
+                self.coordinator_failed()
+                with self.coordinator_lock:
+                    self.pending_submissions[:0] = [(validator, lease_id, *result) for result in results]
+
+    def was_unclean_shutdown(self):
+        return os.path.exists(self.heartbeat_file)
+
+    def recover_from_unclean_shutdown(self):
+        with open(self.heartbeat_file, 'r') as file:
+            self.results.merge(json.load(file))
+        self.results.compact()
+        os.remove(self.heartbeat_file)
+
+    # runs on its own thread: the images not checked yet, on a process pool with half the CPUs at low priority.
+    # Broken images are queued like catalog changes (kind "bad"), apply_catalog_changes drops them from the samplers.
+    def check_images(self, entries):
+        if self.image_checks_stopped:
+            return
+
+        def on_checked(image_path, check):
+            metrics.increment("control.images_checked")
+            if check[0] is not None:
+                self.queue_catalog_change("bad", image_path)
+
+        self.image_checks.update(entries, processes = max(1, (os.cpu_count() or 2) // 2), niceness = 10, on_checked = on_checked)
+
+    # all image paths in the catalog
+    @property
+    def images(self):
+        return self.catalog.paths()
+
+    # called on the watcher thread
+    def queue_catalog_change(self, kind, path):
+        self.catalog_changes.append((kind, path))
+
+    # bring the catalog, label index and samplers up to date with the queued changes
+    # kinds: "added" and "removed" by the watcher, "bad" by the pre-validation pass
+    # returns [(kind, catalog entry)] of the changes that changed the catalog or the images that can be drawn
+    def apply_catalog_changes(self):
+        applied = []
+        while self.catalog_changes:
+            kind, path = self.catalog_changes.popleft()
+            if kind == "bad":
+                entry = self.catalog.get(path)
+                if entry is None or image_name_of(entry.path) in self.bad_images:
+                    continue
+                self.bad_images.add(image_name_of(entry.path))
+                for sampler in self.samplers.values():
+                    sampler.discard(entry.path)
+            elif kind == "added":
+                entry = self.catalog.add_file(path)
+                if entry is None:
+                    continue
+                image_name = image_name_of(entry.path)
+                if self._label_index is not None:
+                    self._label_index.add(image_name, entry.labels)
+                # new images have no perceptual hash yet, they count as unique in duplicate mode
+                if image_name in self.bad_images:
+                    pass
+                elif self.category_filter is None or self.category_filter in [entry.labels[i:i+3] for i in range(0, len(entry.labels), 3)]:
+                    for validator, sampler in self.samplers.items():
+                        if not self.results.has(image_name, validator):
+                            sampler.add(entry.path)
+            else:
+                entry = self.catalog.remove_file(path)
+                if entry is None:
+                    continue
+                if self._label_index is not None:
+                    self._label_index.remove(image_name_of(entry.path))
+                for sampler in self.samplers.values():
+                    sampler.discard(entry.path)
+            applied.append((kind, entry))
+        return applied
+
+    def current_validator(self):
+        return self.validators[self.current_validator_index]
+
+    def set_current_validator(self, index):
+        # the leases of the previous validator go back to the server, so its images are not locked until they expire
+        if self.coordinator is not None and index != self.current_validator_index:
+            self.release_leases(self.current_validator())
+        self.current_validator_index = index
+        # results may have changed since this validator was last selected
+        self.samplers[self.current_validator()] = self.build_sampler(self.current_validator())
+        if self.coordinator is not None:
+            self.refill_leases()
+
+    def build_sampler(self, validator):
+        validated = self.results.images_validated_by(validator)
+        if self.category_filter is None:
+            candidates = self.catalog.entries
+        else:
+            candidates = self.label_index().images_with(all_of = [self.category_filter])
+        # one image per group of near-duplicates, the first one the validator has not validated
+        if self.duplicate_mode:
+            duplicates = self.duplicate_index()
+            if duplicates is None:
+                # until the groups are known every image counts as unique
+                self.samplers_without_duplicates = True
+            else:
+                groups = set()
+                unique = []
+                for image_name in candidates:
+                    group = duplicates.representative(image_name)
+                    if image_name not in validated and image_name not in self.bad_images and group not in groups:
+                        groups.add(group)
+                        unique.append(image_name)
+                candidates = unique
+        if self.sampling_mode == "coverage":
+            counts = self.results.validator_counts()
+            return CoveragePool((self.catalog.entries[image_name].path, counts.get(image_name, 0)) for image_name in candidates if image_name not in validated and image_name not in self.bad_images)
+        return RandomPool(self.catalog.entries[image_name].path for image_name in candidates if image_name not in validated and image_name not in self.bad_images)
+
+    def set_sampling_mode(self, mode):
+        self.sampling_mode = mode
+        self.samplers = {}
+
+    def set_duplicate_mode(self, enabled):
+        self.duplicate_mode = enabled
+        self.samplers = {}
+        if enabled:
+            self.duplicate_index()
+
+    # groups of near-duplicates over the hashes computed so far (python -m app.duplicates), images without a hash
+    # yet count as unique. The first call starts building it on a thread, None until it is ready.
+    def duplicate_index(self):
+        if self._duplicate_index is None and self.duplicate_index_thread is None:
+            # the names are listed here, before the GUI thread changes the catalog again
+            self.duplicate_index_thread = threading.Thread(target = self.build_duplicate_index, args = (set(self.catalog.entries),), daemon = True)
+            self.duplicate_index_thread.start()
+        return self._duplicate_index
+
+    @metrics.timed("control.build_duplicate_index")
+    def build_duplicate_index(self, image_names):
+        from app.duplicates import DuplicateIndex, PerceptualHashStore, default_hash_file
+        try:
+            hashes = PerceptualHashStore(default_hash_file()).values()
+            self._duplicate_index = DuplicateIndex({image_name: value for image_name, value in hashes.items() if image_name in image_names})
+        except Exception as error:
+            # duplicate mode goes on without groups
+            print(f"building the duplicate index failed: {error!r}", file = sys.stderr)
+
+    def label_index(self):
+        # NumPy is only imported once the index is needed
+        if self.catalog_changes:
+            self.apply_catalog_changes()
+        if self._label_index is None:
+            from app.label_index import LabelIndex
+            self._label_index = LabelIndex.build(self.catagory2food, {image_name: entry.labels for image_name, entry in self.catalog.entries.items()})
+        return self._label_index
+
+    # progress and agreement report (report.py), as a dict
+    def report(self):
+        return self.report_job()()
+
+    # the report in two steps: takes what it is built from (a copy of the results table, the label index) on the
+    # calling thread and returns a function that builds it on any thread, e.g. a worker of the GUI
+    def report_job(self):
+        from app.report import ResultColumns, build_report_from_columns
+        label_index = self.label_index()
+        # the JSON store's table is read column by column, the SQLite store aggregates in SQL on a connection of its own
+        if hasattr(self.results, "copy_table"):
+            table = self.results.copy_table()
+            columns = lambda: ResultColumns.from_table(table, label_index)
+        else:
+            results = self.results
+            columns = lambda: ResultColumns.from_groups(*results.result_groups(), label_index)
+        return lambda: build_report_from_columns(columns(), label_index)
+
+    # restrict random images to one category code, None to lift the filter
+    def set_category_filter(self, code):
+        self.category_filter = code
+        self.samplers = {}
+
+    def sampler(self):
+        if self.catalog_changes:
+            self.apply_catalog_changes()
+        # samplers drawn from before the groups of near-duplicates were known
+        if self.samplers_without_duplicates and self._duplicate_index is not None:
+            self.samplers_without_duplicates = False
+            self.samplers = {}
+        validator = self.current_validator()
+        if validator not in self.samplers:
+            self.samplers[validator] = self.build_sampler(validator)
+        return self.samplers[validator]
+    
+    def labels_of(self, image_path):
+        if image_path == self.placeholder_image:
+            return ["None"]
+        entry = self.catalog.get(image_path)
+        if entry is not None:
+            labels = entry.labels
+        else:
+            labels = image_name_of(image_path).split('_')[0]
+        # only a few hundred label combinations exist, each is built once
+        if labels not in self.label_texts:
+            codes = [labels[i:i+3] for i in range(0, len(labels), 3)]
+            self.label_texts[labels] = [f"{code}: {self.catagory2food[code]}" for code in codes]
+        return list(self.label_texts[labels])
+    
+    # record one result for every selected image, remarks: one per selected image div
+    def record_result(self, result, remarks):
+        self.record_image_results([(div.current_image, remark) for div, remark in zip(self.selected_image_divs, remarks)], result)
+
+    # record a result of the current validator for any image, given as path or image name
+    @metrics.timed("control.record_result")
+    def record_image_result(self, image_path, result, remark):
+        # the verdict goes to the whole group of near-duplicates
+        if self.duplicate_mode:
+            self.record_image_results([(image_path, remark)], result)
+            return
+        if remark == "":
+            remark = "None"
+        image_name = image_name_of(image_path)
+        first_result = not self.results.has(image_name, self.current_validator())
+        self.results.record(image_name, self.current_validator(), result, remark)
+        self.result_recorded(image_path, image_name, result, remark, first_result)
+
+    # record the same result for many images at once, items: [(image path or name, remark)]
+    # the results store writes them as one batch
+    @metrics.timed("control.record_results")
+    def record_image_results(self, items, result):
+        validator = self.current_validator()
+        records = []
+        # an image given twice is recorded once, with its last remark
+        items = {image_name_of(image_path): (image_path, remark) for image_path, remark in items}
+        # near-duplicates the validator has not judged yet get the verdict of their representative
+        duplicates = self.duplicate_index() if self.duplicate_mode else None
+        if duplicates is not None:
+            for image_name, (image_path, remark) in list(items.items()):
+                for member in duplicates.members(image_name):
+                    # the hashes may be of images no longer in the catalog
+                    if member not in items and member in self.catalog.entries and not self.results.has(member, validator):
+                        items[member] = (member, remark)
+        for image_name, (image_path, remark) in items.items():
+            records.append((image_path, image_name, remark or "None", not self.results.has(image_name, validator)))
+        self.results.record_many([(image_name, validator, result, remark) for _, image_name, remark, _ in records])
+        for image_path, image_name, remark, first_result in records:
+            self.result_recorded(image_path, image_name, result, remark, first_result)
+
+    # keep leases and samplers in step with a recorded result
+    def result_recorded(self, image_path, image_name, result, remark, first_result):
+        if self.coordinator is not None:
+            with self.coordinator_lock:
+                self.pending_submissions.append((self.current_validator(), self.lease_of.pop(image_name, None), image_name, result, remark))
+        entry = self.catalog.get(image_path)
+        image_path = entry.path if entry is not None else image_path
+        self.sampler().discard(image_path)
+        # one more validation, the image moves down in the queues of the other validators
+        if first_result and self.sampling_mode == "coverage":
+            for validator, sampler in self.samplers.items():
+                if validator != self.current_validator():
+                    sampler.set_count(image_path, sampler.counts.get(image_path, 0) + 1)
+
+    @metrics.timed("control.random_images")
+    def random_images(self, num = 1):
+        images = []
+        # leased images from the work distribution server first
+        # leases are drawn uniformly and not filtered by category, so they are only used in that mode
+        if self.coordinator is not None and self.category_filter is None and self.sampling_mode == "uniform" and not self.duplicate_mode:
+            images = self.take_leased_images(num)
+
+        # local sampling for the rest
+        sampler = self.sampler()
+        drawn = [image for image in images if image in sampler]
+        for image in drawn:
+            sampler.discard(image)
+        while len(images) < num and len(sampler) > 0:
+            for image in sampler.sample(num - len(images)):
+                # another app instance sharing the results may have validated it in the meantime
+                sampler.discard(image)
+                if not self.is_already_validated_by_current_validator(image):
+                    images.append(image)
+                    drawn.append(image)
+        # drawn images stay in the pool until they are validated
+        for image in drawn:
+            sampler.add(image)
+        # if not enough images, return placeholder image
+        return images + [self.placeholder_image] * (num - len(images))
+    
+    # remove file extension & char before first underscore
+    def id_of(self, image_path):
+        if image_path == self.placeholder_image:
+            return "No."
+        entry = self.catalog.get(image_path)
+        if entry is not None:
+            return f"{entry.image_id}_{entry.dataset_id}"
+        image_name = image_name_of(image_path)
+        image_name = image_name[image_name.index('_') + 1:]
+        return image_name
+    
+    # session file (session.py) with its images resolved through the catalog
+    # returns [(image path, remark)], the placeholder image for empty divs and images not in the catalog,
+    # and the names of the images not in the catalog
+    def read_session(self, session_file):
+        if self.catalog_changes:
+            self.apply_catalog_changes()
+        items = []
+        missing = []
+        for image_name, remark in read_session(session_file):
+            entry = self.catalog.entries.get(image_name) if image_name is not None else None
+            if entry is not None:
+                items.append((entry.path, remark))
+            else:
+                if image_name is not None:
+                    missing.append(image_name)
+                items.append((self.placeholder_image, ""))
+        return items, missing
+
+    # items: (image path, remark) per div
+    def write_session(self, session_file, items):
+        write_session(session_file, items, self.placeholder_image)
+
+    def is_already_validated_by_current_validator(self, image_path):
+        if image_path == self.placeholder_image:
+            return False
+        return self.results.has(image_name_of(image_path), self.current_validator())
+    
+    def close(self):
+        with metrics.timer("control.exit"):
+            if self.watcher is not None:
+                self.watcher.stop()
+            # the checks done so far are kept, the next start continues
+            self.image_checks_stopped = True
+            if self.image_checks is not None:
+                self.image_checks.stop()
+            self.submit_pending_results()
+            if self.coordinator is not None:
+                self.release_leases(self.current_validator(), background = False)
+            # every result is already in the journal, only the pending fsync is left
+            self.results.close()
+        self.dump_metrics()
+
+    def exit(self):
+        self.close()
+        exit()
@@ -0,0 +1,194 @@
+import os, sys, math
+from itertools import combinations
+import numpy as np
+from app.catalog import Catalog, default_data_dir, default_image_roots, default_manifest_file
+from app.signature_cache import SignatureCache
+
+# Near-duplicate detection with perceptual hashes
+# Every catalog image gets a 64-bit difference hash (dHash): the image is decoded to 9x8 gray pixels
+# and every bit tells whether a pixel is brighter than its right neighbour. Visually identical photos
+# (re-encoded, resized, from another dataset) end up within a few bits of each other.
+
+# dHash of one image file, None if it can not be decoded
+# the QImageReader scales while decoding, a JPEG is decoded at a fraction of its size; Qt is imported in the hashing
+# processes only, the grouping (DuplicateIndex) needs nothing but NumPy and also runs in the headless tools
+def dhash(image_path):
+    from PyQt5.QtCore import QSize
+    from PyQt5.QtGui import QImage, QImageReader
+    reader = QImageReader(image_path)
+    reader.setScaledSize(QSize(9, 8))
+    image = reader.read()
+    if image.isNull():
+        return None
+    image = image.convertToFormat(QImage.Format_Grayscale8)
+    bits = image.constBits()
+    bits.setsize(image.bytesPerLine() * 8)
+    pixels = bytes(bits)
+    value = 0
+    for y in range(8):
+        row = pixels[y * image.bytesPerLine():y * image.bytesPerLine() + 9]
+        for x in range(8):
+            value = value << 1 | (row[x] > row[x + 1])
+    return value
+
+def hash_one(image_path):
+    try:
+        return image_path, dhash(image_path)
+    except OSError:
+        return image_path, None
+
+# Hashes kept on disk, keyed by image name and checked against the mtime and size of the file
+# format: {"version", "hashes": {image name: [hash, mtime in ns, size]}}, hash is null for undecodable files
+class PerceptualHashStore(SignatureCache):
+
+    key = "hashes"
+    work = staticmethod(hash_one)
+
+    @property
+    def hashes(self):
+        return self.entries
+
+    # hash the catalog images without an up-to-date hash, returns the number of images hashed
+    def update(self, catalog, *, processes = None, progress = None):
+        return super().update(list(catalog.entries.items()), processes = processes, progress = progress)
+
+    # image name -> hash of the decodable images
+    def values(self):
+        return {image_name: stored[0] for image_name, stored in self.hashes.items() if stored[0] is not None}
+
+# number of set bits of every 16-bit value
+word_bits = np.array([bin(word).count("1") for word in range(1 << 16)], dtype = np.uint8)
+
+# number of set bits of every value of a uint64 array
+def popcount(values):
+    return word_bits[np.ascontiguousarray(values).view(np.uint16)].reshape(-1, 4).sum(axis = 1)
+
+# Groups of near-duplicates, found with multi-index hashing
+# The 64-bit hashes are split into chunks with one lookup table per chunk. Two hashes within distance r differ in
+# at most r // chunks bits in at least one chunk (pigeonhole), so the candidates of a hash are the table entries
+# within r // chunks bits of one of its chunks, and only those are compared in full.
+# Chunks are about log2(N) bits wide, so a table entry holds about one hash whatever the number of hashes, and
+# the lookups and comparisons are vectorized with NumPy: one pass over all hashes per chunk and bit pattern.
+class DuplicateIndex:
+
+    # candidate pairs compared at once, bounds the memory of a pass
+    block_pairs = 1 << 22
+
+    def __init__(self, hashes, threshold = 6):
+        # hashes: {image name: hash}
+        self.hashes = hashes
+        self.threshold = threshold
+        # image name -> representative of its group, for images in a group of two or more
+        self.group_of = {}
+        # representative -> member names (representative included)
+        self.groups = {}
+        self.build()
+
+    # bit offsets of the chunks of the hashes of size images: log2(size) bits each, 3 to 8 chunks
+    @staticmethod
+    def chunk_bounds(size):
+        chunks = min(max(round(64 / math.log2(max(size, 2))), 3), 8)
+        return [64 * i // chunks for i in range(chunks + 1)]
+
+    # all bit patterns of up to radius bits out of bits
+    @staticmethod
+    def flip_masks(bits, radius):
+        return [sum(1 << bit for bit in flipped) for count in range(radius + 1) for flipped in combinations(range(bits), count)]
+
+    # (i, j) index pairs of the values within the threshold of each other, a pair may come up more than once
+    def close_pairs(self, values):
+        bounds = self.chunk_bounds(len(values))
+        radius = self.threshold // (len(bounds) - 1)
+        found = []
+        for low, high in zip(bounds, bounds[1:]):
+            bits = high - low
+            chunks = ((values >> np.uint64(low)) & np.uint64((1 << bits) - 1)).astype(np.int64)
+            # values sorted on the chunk, so the table lookups of a pass walk the tables in order
+            order = np.argsort(chunks, kind = "stable")
+            chunks, chunk_values = chunks[order], values[order]
+            # positions of the values of every chunk value: offsets[chunk] to offsets[chunk + 1]
+            offsets = np.searchsorted(chunks, np.arange((1 << bits) + 1))
+            occupied = offsets[1:] > offsets[:-1]
+            for mask in self.flip_masks(bits, radius):
+                probes = chunks ^ mask
+                # a pair comes up from both of its values, from the one with the smaller chunk is enough
+                hits = np.flatnonzero(probes > chunks) if mask else np.arange(len(chunks))
+                hits = hits[occupied[probes[hits]]]
+                begins = offsets[probes[hits]]
+                sizes = offsets[probes[hits] + 1] - begins
+                ends = np.cumsum(sizes)
+                first = 0
+                while first < len(hits):
+                    # as many hits as fit their candidates into one block
+                    last = max(first + 1, int(np.searchsorted(ends, (ends[first - 1] if first else 0) + self.block_pairs, side = "right")))
+                    block_sizes = sizes[first:last]
+                    total = int(block_sizes.sum())
+                    left = np.repeat(hits[first:last], block_sizes)
+                    right = np.repeat(begins[first:last] - (np.cumsum(block_sizes) - block_sizes), block_sizes) + np.arange(total)
+                    if not mask:
+                        # the values of one chunk value pair up with each other, each pair once
+                        keep = left < right
+                        left, right = left[keep], right[keep]
+                    close = popcount(chunk_values[left] ^ chunk_values[right]) <= self.threshold
+                    found.append(np.stack([order[left[close]], order[right[close]]], axis = 1))
+                    first = last
+        return np.concatenate(found) if found else np.empty((0, 2), dtype = np.int64)
+
+    def build(self):
+        # equal hashes are one value, so a flood of identical images costs nothing extra
+        names = sorted(self.hashes)
+        values, inverse = np.unique(np.array([self.hashes[name] for name in names], dtype = np.uint64), return_inverse = True)
+        inverse = inverse.reshape(-1)
+
+        # union-find over the distinct values, then the names of every value join the group of their value
+        parent = list(range(len(values)))
+
+        def find(value):
+            root = value
+            while parent[root] != root:
+                root = parent[root]
+            while value != root:
+                parent[value], value = root, parent[value]
+            return root
+
+        for i, j in self.close_pairs(values).tolist():
+            a, b = find(i), find(j)
+            if a != b:
+                parent[max(a, b)] = min(a, b)
+
+        members = {}
+        for name, value in zip(names, inverse.tolist()):
+            members.setdefault(find(value), []).append(name)
+        # the smallest name represents the group, so groups come out the same on every machine
+        for group in members.values():
+            if len(group) < 2:
+                continue
+            self.groups[group[0]] = group
+            for image_name in group:
+                self.group_of[image_name] = group[0]
+
+    def representative(self, image_name):
+        return self.group_of.get(image_name, image_name)
+
+    def is_representative(self, image_name):
+        return self.group_of.get(image_name, image_name) == image_name
+
+    # other images of the group of image_name
+    def members(self, image_name):
+        root = self.group_of.get(image_name)
+        if root is None:
+            return []
+        return [name for name in self.groups[root] if name != image_name]
+
+def default_hash_file():
+    return os.path.join(default_data_dir(), ".phashes.json")
+
+# usage: python -m app.duplicates [processes]
+if __name__ == '__main__':
+    catalog = Catalog(default_image_roots(), default_manifest_file())
+    catalog.refresh()
+    store = PerceptualHashStore(default_hash_file())
+    processes = int(sys.argv[1]) if len(sys.argv) > 1 else None
+    hashed = store.update(catalog, processes = processes, progress = lambda done, total: print(f"{done}/{total}"))
+    index = DuplicateIndex(store.values())
+    print(f"{len(catalog)} images, {hashed} hashed, {len(index.groups)} groups of near-duplicates with {len(index.group_of)} images")
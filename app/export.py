@@ -0,0 +1,92 @@
+import os, csv, json
+from app.catalog import parse_image_file_name
+
+# Streaming export of the results as flat rows for downstream jobs
+# Records are read one at a time from the results store and written straight out,
+# so memory does not grow with the number of results.
+# Incremental exports only write the records committed since the watermark of the previous export.
+# The watermark is the commit sequence number (seq) of the newest exported record, not its time: a record
+# committed late with an older time (another writer, a clock stepped back) still comes after it.
+
+export_fields = ["image", "image_id", "dataset_id", "labels", "validator", "result", "remark", "ts"]
+export_formats = ["csv", "jsonl"]
+
+# records: (image, validator, result, remark, ts, seq), yields one dict per record
+def export_rows(records, catalog):
+    for image, validator, result, remark, ts, seq in records:
+        entry = catalog.entries.get(image)
+        if entry is not None:
+            labels, image_id, dataset_id = entry.labels, entry.image_id, entry.dataset_id
+        else:
+            # results of images no longer in the catalog still carry their labels in the name
+            labels, image_id, dataset_id = parse_image_file_name(image + ".jpg") or ["", "", ""]
+        yield {
+            "image": image,
+            "image_id": image_id,
+            "dataset_id": dataset_id,
+            "labels": labels,
+            "validator": validator,
+            "result": result,
+            # empty remarks are stored as "None"
+            "remark": "" if remark == "None" else remark,
+            "ts": ts,
+        }
+
+# writes the rows to out, returns the number of rows
+def write_rows(rows, out, format):
+    count = 0
+    if format == "csv":
+        writer = csv.DictWriter(out, fieldnames = export_fields)
+        writer.writeheader()
+        write = writer.writerow
+    else:
+        write = lambda row: out.write(json.dumps(row, ensure_ascii = False) + "\n")
+    for row in rows:
+        write(row)
+        count += 1
+    return count
+
+# seq to export after, None without a watermark; watermarks of earlier versions hold a record time {"ts"}
+def read_watermark(watermark_file, results):
+    try:
+        with open(watermark_file, "r") as f:
+            watermark = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if "seq" in watermark:
+        return watermark["seq"]
+    if "ts" in watermark:
+        return results.seq_at(watermark["ts"])
+    return None
+
+def write_watermark(watermark_file, seq):
+    temp_file = watermark_file + ".tmp"
+    with open(temp_file, "w") as f:
+        json.dump({"seq": seq}, f)
+    os.replace(temp_file, watermark_file)
+
+# passes the records through, newest[0] is the largest seq seen
+def tracking_seq(records, newest):
+    for record in records:
+        if newest[0] is None or record[5] > newest[0]:
+            newest[0] = record[5]
+        yield record
+
+# exports the records of the results store to output_file (a file object if output_file is None, e.g. stdout)
+# with a watermark file only the records changed since the last export are written, and the watermark is advanced
+# afterwards; the output file is written under a temporary name first, so a failed export leaves both untouched
+# returns the number of rows written
+def export_results(results, catalog, format, output_file = None, *, out = None, watermark_file = None):
+    since = read_watermark(watermark_file, results) if watermark_file else None
+    newest = [None]
+    rows = export_rows(tracking_seq(results.iter_changes(since), newest), catalog)
+    if output_file is None:
+        count = write_rows(rows, out, format)
+    else:
+        temp_file = output_file + ".tmp"
+        with open(temp_file, "w", newline = "", encoding = "utf-8") as f:
+            count = write_rows(rows, f, format)
+        os.replace(temp_file, output_file)
+    if watermark_file and newest[0] is not None:
+        write_watermark(watermark_file, newest[0])
+    return count
@@ -0,0 +1,195 @@
+from PyQt5 import QtWidgets
+from PyQt5.QtWidgets import QMainWindow, QLabel, QWidget, QAbstractScrollArea
+from PyQt5.QtCore import Qt, pyqtSignal
+from app.metrics import metrics
+
+# Virtualized gallery over the catalog or any filtered subset of it
+# Only the tiles of the visible rows (plus one) exist. On scroll they are recycled: the tile of row r, column c
+# is always pool[r % pool rows][c], so a tile only changes its image when its row scrolled out and a new row in.
+# Tile images come from the App's pixmap cache or are requested from its ImageLoader with the tile as key,
+# so a recycled tile's older request goes stale and is dropped like the one of an image div.
+
+class GalleryTile(QWidget):
+
+    clicked = pyqtSignal(object)
+
+    def __init__(self, parent, size, caption_height, placeholder_pixmap):
+        super().__init__(parent)
+        self.setFixedSize(size, size + caption_height)
+        # named like the image divs, App.on_image_decoded sets the pixmap of key.label
+        self.label = QLabel(self)
+        self.label.setScaledContents(True)
+        self.label.resize(size, size)
+        self.label.setPixmap(placeholder_pixmap)
+        self.caption = QLabel(self)
+        self.caption.setAlignment(Qt.AlignCenter)
+        self.caption.setGeometry(0, size, size, caption_height)
+        self.current_image = None
+
+    def mousePressEvent(self, event):
+        super().mousePressEvent(event)
+        if event.button() == Qt.LeftButton and self.current_image is not None:
+            self.clicked.emit(self)
+
+class GalleryView(QAbstractScrollArea):
+
+    def __init__(self, app, parent, *, tile_size, caption_height, spacing):
+        super().__init__(parent)
+        self.app = app
+        self.tile_size = tile_size
+        self.caption_height = caption_height
+        self.spacing = spacing
+        self.cell_width = tile_size + spacing
+        self.cell_height = tile_size + caption_height + spacing
+        self.setHorizontalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
+        self.verticalScrollBar().setSingleStep(self.cell_height // 4)
+
+        # image paths shown, in order
+        self.items = []
+        self.columns = 1
+        # pool[row slot][column]
+        self.pool = []
+
+        # called with the image path of a clicked tile
+        self.on_tile_clicked = None
+
+    def set_items(self, items):
+        self.items = items
+        for row in self.pool:
+            for tile in row:
+                tile.current_image = None
+        self.verticalScrollBar().setValue(0)
+        self.relayout()
+
+    def rows(self):
+        return (len(self.items) + self.columns - 1) // self.columns
+
+    # size of the pool and range of the scroll bar follow the viewport
+    def relayout(self):
+        columns = max(1, (self.viewport().width() - self.spacing) // self.cell_width)
+        pool_rows = self.viewport().height() // self.cell_height + 2
+        if columns != self.columns or pool_rows != len(self.pool):
+            self.build_pool(columns, pool_rows)
+        scroll_bar = self.verticalScrollBar()
+        scroll_bar.setPageStep(self.viewport().height())
+        scroll_bar.setRange(0, max(0, self.rows() * self.cell_height + self.spacing - self.viewport().height()))
+        self.update_tiles()
+
+    def build_pool(self, columns, pool_rows):
+        for row in self.pool:
+            for tile in row:
+                self.app.image_loader.cancel(tile)
+                tile.deleteLater()
+        self.columns = columns
+        self.pool = []
+        for _ in range(pool_rows):
+            row = []
+            for _ in range(columns):
+                tile = GalleryTile(self.viewport(), self.tile_size, self.caption_height, self.app.placeholder_pixmap)
+                tile.clicked.connect(self.tile_clicked)
+                row.append(tile)
+            self.pool.append(row)
+
+    @metrics.timed("gallery.update_tiles")
+    def update_tiles(self):
+        offset = self.verticalScrollBar().value()
+        first_row = offset // self.cell_height
+        for row in range(first_row, first_row + len(self.pool)):
+            for column, tile in enumerate(self.pool[row % len(self.pool)]):
+                index = row * self.columns + column
+                if index >= len(self.items):
+                    self.hide_tile(tile)
+                    continue
+                tile.move(self.spacing + column * self.cell_width, self.spacing + row * self.cell_height - offset)
+                self.show_tile(tile, self.items[index])
+
+    def show_tile(self, tile, image_path):
+        if tile.current_image != image_path:
+            tile.current_image = image_path
+            tile.caption.setText(f"No.{self.app.control.id_of(image_path)}")
+            pixmap = self.app.pixmap_cache.get(image_path)
+            if pixmap is not None:
+                self.app.image_loader.cancel(tile)
+                tile.label.setPixmap(pixmap)
+            else:
+                tile.label.setPixmap(self.app.placeholder_pixmap)
+                self.app.image_loader.request(tile, image_path)
+        tile.show()
+
+    def hide_tile(self, tile):
+        if tile.current_image is not None:
+            self.app.image_loader.cancel(tile)
+            tile.current_image = None
+        tile.hide()
+
+    def tile_clicked(self, tile):
+        if self.on_tile_clicked is not None:
+            self.on_tile_clicked(tile.current_image)
+
+    def scrollContentsBy(self, dx, dy):
+        self.update_tiles()
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        self.relayout()
+
+    # tiles of a closed gallery must not receive images any more
+    def release(self):
+        for row in self.pool:
+            for tile in row:
+                self.hide_tile(tile)
+
+# Gallery window, opened from the top bar
+# filters: one category code and / or images not validated by the current validator yet
+# clicking a tile shows the image in the temp div of the main window, where it can be validated
+class GalleryWindow(QMainWindow):
+
+    def __init__(self, app, *, tile_size, caption_height, pad, style):
+        super().__init__(app.root)
+        self.app = app
+        self.setWindowTitle("Gallery")
+        self.resize(tile_size * 5 + pad * 8 + 30, tile_size * 3 + 80)
+        self.setStyleSheet(style)
+
+        central = QWidget(self)
+        layout = QtWidgets.QVBoxLayout(central)
+        layout.setContentsMargins(pad, pad, pad, pad)
+        bar = QtWidgets.QHBoxLayout()
+        self.category_dropdown = QtWidgets.QComboBox(central)
+        self.category_dropdown.addItem("All categories", None)
+        for code, food in app.control.catagory2food.items():
+            self.category_dropdown.addItem(f"{code}: {food}", code)
+        self.category_dropdown.currentIndexChanged.connect(self.refresh)
+        self.unvalidated_checkbox = QtWidgets.QCheckBox("Not validated by me", central)
+        self.unvalidated_checkbox.stateChanged.connect(self.refresh)
+        self.count_label = QLabel(central)
+        bar.addWidget(self.category_dropdown)
+        bar.addWidget(self.unvalidated_checkbox)
+        bar.addStretch()
+        bar.addWidget(self.count_label)
+        layout.addLayout(bar)
+
+        self.view = GalleryView(app, central, tile_size = tile_size, caption_height = caption_height, spacing = pad)
+        self.view.on_tile_clicked = lambda image_path: app.set_image_div(app.temp_img_div, image_path)
+        layout.addWidget(self.view)
+        self.setCentralWidget(central)
+        self.refresh()
+
+    def refresh(self):
+        control = self.app.control
+        control.apply_catalog_changes()
+        code = self.category_dropdown.currentData()
+        if code is None:
+            names = list(control.catalog.entries)
+        else:
+            names = control.label_index().images_with(all_of = [code])
+        if self.unvalidated_checkbox.isChecked():
+            validated = control.results.images_validated_by(control.current_validator())
+            names = [name for name in names if name not in validated]
+        entries = control.catalog.entries
+        self.view.set_items([entries[name].path for name in names if name in entries])
+        self.count_label.setText(f"{len(self.view.items)} images")
+
+    def closeEvent(self, event):
+        self.view.release()
+        super().closeEvent(event)
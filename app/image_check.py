@@ -0,0 +1,165 @@
+import os, re, sys
+from app.catalog import Catalog, default_data_dir, default_image_roots, default_manifest_file
+from app.signature_cache import SignatureCache
+
+# Pre-validation of the image files
+# Every catalog image is decoded once to find files a reviewer would only see as a blank tile:
+# empty, unreadable or undecodable files, and truncated JPEGs (Qt decodes those without an error, the
+# missing part just stays gray, so the JPEG is walked segment by segment up to its end-of-image marker as well).
+# Pixel size and byte size of every file are recorded on the way, for the report of unusual images, and so are
+# bytes after the end of a JPEG (padding, appended metadata): they decode fine, the report only lists them.
+
+# unusual, but not broken: the report lists them for a look
+min_side = 64
+max_aspect_ratio = 4
+max_pixels = 50_000_000
+min_bytes = 2048
+
+# end of the entropy-coded data of a scan: a marker other than a stuffed 0xff00 or a restart marker
+scan_end = re.compile(rb"\xff+[^\x00\xd0-\xd7\xff]")
+
+# offset just past the end-of-image marker of the JPEG data, None if the data ends before it
+# Segments are skipped by their length, so the end-of-image marker of an embedded thumbnail (EXIF) is not taken
+# for the end of the image; where the data is not laid out as segments the last marker in the data is taken.
+def jpeg_end(data):
+    pos = 2
+    while pos + 1 < len(data):
+        if data[pos] != 0xff:
+            end = data.rfind(b"\xff\xd9")
+            return end + 2 if end >= 0 else None
+        marker = data[pos + 1]
+        if marker == 0xff:
+            # fill byte
+            pos += 1
+        elif marker == 0xd9:
+            return pos + 2
+        elif 0xd0 <= marker <= 0xd7 or marker == 0x01:
+            pos += 2
+        else:
+            if pos + 4 > len(data):
+                return None
+            pos += 2 + int.from_bytes(data[pos + 2:pos + 4], "big")
+            if marker == 0xda:
+                match = scan_end.search(data, pos)
+                if match is None:
+                    return None
+                pos = match.end() - 2
+    return None
+
+# one image file -> (image path, [problem or None, width, height, bytes, bytes after the end of a JPEG])
+# runs in the worker processes; the reports of the command line (check_report, ImageCheckStore) read the stored
+# checks and must not pull in Qt, so it is only imported by the workers that decode
+def check_image(image_path):
+    from PyQt5.QtCore import QSize
+    from PyQt5.QtGui import QImageReader
+    try:
+        with open(image_path, "rb") as f:
+            data = f.read()
+    except OSError as error:
+        return image_path, [f"unreadable: {error.strerror}", 0, 0, 0, 0]
+    size = len(data)
+    if size == 0:
+        return image_path, ["empty file", 0, 0, 0, 0]
+    reader = QImageReader(image_path)
+    dimensions = reader.size()
+    if dimensions.isValid():
+        # every byte is still decoded, but JPEGs are decoded at 1/8 scale, which is much cheaper
+        reader.setScaledSize(QSize(max(1, dimensions.width() // 8), max(1, dimensions.height() // 8)))
+    image = reader.read()
+    if image.isNull() or not dimensions.isValid():
+        return image_path, [f"not decodable: {reader.errorString()}", 0, 0, size, 0]
+    problem = None
+    trailing = 0
+    if data.startswith(b"\xff\xd8"):
+        end = jpeg_end(data)
+        if end is None:
+            problem = "truncated"
+        else:
+            trailing = size - end
+    return image_path, [problem, dimensions.width(), dimensions.height(), size, trailing]
+
+# Checks kept on disk, keyed by image name and checked against the mtime and size of the file
+# format: {"version", "checks": {image name: [problem or null, width, height, bytes, bytes after the end, mtime in ns]}}
+# version 1 took JPEGs with trailing data for truncated, its checks are done again
+# the workers are spawned, not forked: the pass also runs inside the GUI process, whose threads must not be forked
+class ImageCheckStore(SignatureCache):
+
+    key = "checks"
+    version = 2
+    work = staticmethod(check_image)
+    chunksize = 16
+    start_method = "spawn"
+
+    @property
+    def checks(self):
+        return self.entries
+
+    # the byte size is the size of the signature
+    def entry(self, check, signature):
+        return [*check[:3], signature[1], check[4], signature[0]]
+
+    def stored_signature(self, stored):
+        return stored[5], stored[3]
+
+    # check the missing images on a process pool, returns the number of images checked
+    # on_checked(image path, [problem, width, height, bytes, bytes after the end]) is called for every checked image
+    def update(self, entries, *, processes = None, niceness = 0, progress = None, on_checked = None):
+        return super().update(entries, processes = processes, niceness = niceness, progress = progress, on_done = on_checked)
+
+    def bad_names(self):
+        return {image_name for image_name, check in self.checks.items() if check[0] is not None}
+
+# why a decodable image is unusual, None if it is not
+def unusual_reason(width, height, size, trailing = 0):
+    reasons = []
+    if min(width, height) < min_side:
+        reasons.append(f"small ({width}x{height})")
+    if max(width, height) > max_aspect_ratio * min(width, height):
+        reasons.append(f"aspect ratio {max(width, height) / max(1, min(width, height)):.1f}")
+    if width * height > max_pixels:
+        reasons.append(f"large ({width}x{height})")
+    if size < min_bytes:
+        reasons.append(f"{size} bytes")
+    if trailing:
+        reasons.append(f"{trailing} bytes after the end of the image")
+    return ", ".join(reasons) or None
+
+# report over the checks of the given image names (all checked images if None)
+# {"checked", "bad": [[image name, problem]], "unusual": [[image name, reason]]}
+def check_report(checks, image_names = None):
+    if image_names is None:
+        image_names = checks
+    report = {"checked": 0, "bad": [], "unusual": []}
+    for image_name in sorted(image_names):
+        check = checks.get(image_name)
+        if check is None:
+            continue
+        report["checked"] += 1
+        problem, width, height, size, trailing = check[:5]
+        if problem is not None:
+            report["bad"].append([image_name, problem])
+        else:
+            reason = unusual_reason(width, height, size, trailing)
+            if reason is not None:
+                report["unusual"].append([image_name, reason])
+    return report
+
+def format_check_report(report):
+    lines = [f"checked images: {report['checked']}", f"bad images: {len(report['bad'])}"]
+    lines += [f"  {image_name}: {problem}" for image_name, problem in report["bad"]]
+    lines.append(f"unusual images: {len(report['unusual'])}")
+    lines += [f"  {image_name}: {reason}" for image_name, reason in report["unusual"]]
+    return "\n".join(lines)
+
+def default_check_file():
+    return os.path.join(default_data_dir(), ".image_checks.json")
+
+# usage: python -m app.image_check [processes]
+if __name__ == '__main__':
+    catalog = Catalog(default_image_roots(), default_manifest_file())
+    catalog.refresh()
+    store = ImageCheckStore(default_check_file())
+    processes = int(sys.argv[1]) if len(sys.argv) > 1 else None
+    checked = store.update(list(catalog.entries.items()), processes = processes, progress = lambda done, total: print(f"{done}/{total}"))
+    print(f"{len(catalog)} images, {checked} checked")
+    print(format_check_report(check_report(store.checks, catalog.entries)))
@@ -0,0 +1,101 @@
+import threading
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, QSize, pyqtSignal
+from PyQt5.QtGui import QImage, QImageReader
+from app.metrics import metrics
+
+# decode an image straight to the given size
+# for JPEG files the reader scales while decoding (reduced-resolution DCT), so the full-size image is never built
+def decode_image(image_path, width, height):
+    reader = QImageReader(image_path)
+    if reader.size().isValid():
+        reader.setScaledSize(QSize(width, height))
+    image = reader.read()
+    return image
+
+class DecodeTask(QRunnable):
+
+    def __init__(self, loader, key, ticket, image_path):
+        super().__init__()
+        self.loader = loader
+        self.key = key
+        self.ticket = ticket
+        self.image_path = image_path
+        self.started = False
+
+    def run(self):
+        # the target moved on to another image before this task started
+        if not self.loader.claim(self):
+            return
+        # thumbnail cache first, the original image is only decoded on a miss
+        cache = self.loader.thumbnail_cache
+        with metrics.timer("loader.thumbnail_lookup"):
+            image = cache.get(self.image_path) if cache is not None else None
+        if image is None:
+            with metrics.timer("loader.decode"):
+                image = decode_image(self.image_path, self.loader.width, self.loader.height)
+            if cache is not None and not image.isNull():
+                cache.put(self.image_path, image)
+        self.loader.decoded.emit(self.key, self.ticket, self.image_path, image)
+
+# Decodes images on a worker thread pool
+# Every request belongs to a key (e.g. an image div) and gets a ticket. A new request or cancel() for the
+# same key makes the older ticket stale: tasks that have not started are dropped, and results of
+# tasks that were already running are to be ignored by the receiver (compare with current ticket).
+# decoded(key, ticket, image path, image) is delivered on the GUI thread, image is null if decoding failed.
+class ImageLoader(QObject):
+
+    decoded = pyqtSignal(object, int, str, QImage)
+
+    def __init__(self, width, height, *, thumbnail_cache = None, max_threads = 4):
+        super().__init__()
+        self.width = width
+        self.height = height
+        self.thumbnail_cache = thumbnail_cache
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(max(1, min(max_threads, QThreadPool.globalInstance().maxThreadCount())))
+
+        # key -> (ticket, task)
+        self.pending = {}
+        self.next_ticket = 0
+        # tasks check their ticket from the worker threads
+        self.lock = threading.Lock()
+
+    def request(self, key, image_path):
+        self.cancel(key)
+        with self.lock:
+            self.next_ticket += 1
+            ticket = self.next_ticket
+            task = DecodeTask(self, key, ticket, image_path)
+            self.pending[key] = (ticket, task)
+        self.pool.start(task)
+        return ticket
+
+    def cancel(self, key):
+        with self.lock:
+            ticket, task = self.pending.pop(key, (None, None))
+            # drop the task if it is still queued, a started task is owned (and deleted) by the pool
+            if task is not None and not task.started:
+                self.pool.tryTake(task)
+
+    # called by a task when it starts, returns whether its result is still wanted
+    def claim(self, task):
+        with self.lock:
+            task.started = True
+            return task.key in self.pending and self.pending[task.key][0] == task.ticket
+
+    def is_current(self, key, ticket):
+        with self.lock:
+            return key in self.pending and self.pending[key][0] == ticket
+
+    # to be called by the receiver once it used the result of ticket
+    def done(self, key, ticket):
+        with self.lock:
+            if key in self.pending and self.pending[key][0] == ticket:
+                del self.pending[key]
+
+    # drop queued tasks and wait for the running ones, before the loader goes away
+    def shutdown(self):
+        with self.lock:
+            self.pending.clear()
+        self.pool.clear()
+        self.pool.waitForDone()
@@ -0,0 +1,100 @@
+from itertools import repeat
+import numpy as np
+
+# Label set of every catalog image as a bit mask, one bit per category code
+# masks is a NumPy array parallel to image_names, so filters and counts over the whole catalog are vectorized
+class LabelIndex:
+
+    def __init__(self, codes, capacity = 1024):
+        # bit i stands for codes[i]
+        self.codes = list(codes)
+        self.bits = {code: 1 << i for i, code in enumerate(self.codes)}
+        self.image_names = []
+        # row of every image name
+        self.rows = {}
+        self.masks = np.zeros(capacity, dtype = np.uint32)
+        self.size = 0
+
+    @classmethod
+    def build(cls, codes, labels_by_image):
+        # labels_by_image: {image name: label string, e.g. "A01B01C02"}
+        index = cls(codes, capacity = max(1024, len(labels_by_image)))
+        for image_name, labels in labels_by_image.items():
+            index.add(image_name, labels)
+        return index
+
+    # label string (e.g. "A01B01C02") to mask, unknown codes are ignored
+    def mask_of(self, labels):
+        mask = 0
+        for i in range(0, len(labels), 3):
+            mask |= self.bits.get(labels[i:i+3], 0)
+        return mask
+
+    # masks of the given image names as an array, names not in the index are parsed
+    def masks_of(self, image_names):
+        rows = np.fromiter(map(self.rows.get, image_names, repeat(-1)), dtype = np.int64, count = len(image_names))
+        # row -1 picks the 0 appended at the end
+        masks = np.append(self.masks[:self.size], np.uint32(0))[rows]
+        for row in np.flatnonzero(rows < 0):
+            masks[row] = self.mask_of(image_names[row].partition('_')[0])
+        return masks
+
+    # codes (e.g. ["B03", "C02"]) to mask
+    def mask_of_codes(self, codes):
+        mask = 0
+        for code in codes:
+            mask |= self.bits[code]
+        return mask
+
+    def add(self, image_name, labels):
+        if image_name in self.rows:
+            self.masks[self.rows[image_name]] = self.mask_of(labels)
+            return
+        if self.size == len(self.masks):
+            self.masks = np.concatenate([self.masks, np.zeros(len(self.masks), dtype = np.uint32)])
+        self.masks[self.size] = self.mask_of(labels)
+        self.rows[image_name] = self.size
+        self.image_names.append(image_name)
+        self.size += 1
+
+    # the last row moves into the removed one, rows are not stable across removals
+    def remove(self, image_name):
+        row = self.rows.pop(image_name, None)
+        if row is None:
+            return
+        last = self.size - 1
+        if row != last:
+            moved = self.image_names[last]
+            self.masks[row] = self.masks[last]
+            self.image_names[row] = moved
+            self.rows[moved] = row
+        self.image_names.pop()
+        self.masks[last] = 0
+        self.size -= 1
+
+    # boolean array over the rows: images carrying all of all_of, at least one of any_of and none of none_of
+    def select(self, all_of = (), any_of = (), none_of = ()):
+        masks = self.masks[:self.size]
+        selected = np.ones(self.size, dtype = bool)
+        if all_of:
+            all_mask = self.mask_of_codes(all_of)
+            selected &= (masks & all_mask) == all_mask
+        if any_of:
+            selected &= (masks & self.mask_of_codes(any_of)) != 0
+        if none_of:
+            selected &= (masks & self.mask_of_codes(none_of)) == 0
+        return selected
+
+    def images_with(self, all_of = (), any_of = (), none_of = ()):
+        return [self.image_names[row] for row in np.flatnonzero(self.select(all_of, any_of, none_of))]
+
+    def count(self, all_of = (), any_of = (), none_of = ()):
+        return int(np.count_nonzero(self.select(all_of, any_of, none_of)))
+
+    # number of images carrying each code, as {code: count}
+    def counts_per_code(self):
+        masks = self.masks[:self.size]
+        return {code: int(np.count_nonzero(masks & self.bits[code])) for code in self.codes}
+
+    def __len__(self):
+        return self.size
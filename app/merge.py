@@ -0,0 +1,225 @@
+import os, sys, json, heapq, pickle, sqlite3, argparse, tempfile
+from app.results_model import encoder, read_results_file, read_timestamps_file, snapshot_row, write_snapshot_images
+
+# Streaming merge of the results of several validator machines
+# Inputs are results files of either snapshot version (a version 1 file brings its .timestamps.json along),
+# journals (*.jsonl) and SQLite results databases (*.sqlite3), in any number and any mix.
+# Every record is tagged with its input and sorted on (image, validator) in runs of run_size records.
+# Full runs are spilled to temporary files and merged with heapq.merge, so memory stays bounded by the run size
+# however many and however large the inputs are, and the merged output is written one image at a time.
+# Last writer wins per (image, validator): the record with the newest ts, on equal ts the one of the later input
+# (and within one input the later record), so the result does not depend on anything but the inputs and their order.
+# Pairs whose inputs disagree on the result or the remark are reported as conflicts.
+
+run_size = 500_000
+# runs merged at once, more are first merged into longer runs
+max_open_runs = 200
+
+# records of one input: (image, validator, result, remark, ts), result None for a time of a version 1 file
+def read_input(file):
+    if file.endswith(".sqlite3"):
+        return read_database(file)
+    if ".jsonl" in os.path.basename(file):
+        return read_journal(file)
+    return read_results_with_timestamps(file)
+
+def read_database(file):
+    connection = sqlite3.connect(f"file:{file}?mode=ro", uri = True)
+    try:
+        yield from connection.execute("SELECT image, validator, result, remark, ts FROM results")
+    finally:
+        connection.close()
+
+# a torn record at the end of a journal (crash while writing) ends it, like on replay
+def read_journal(file):
+    with open(file, "rb") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break
+            yield record["image"], record["validator"], record["result"], record["remark"], record.get("ts", 0)
+
+def read_results_with_timestamps(file):
+    yield from read_results_file(file)
+    timestamps_file = os.path.splitext(file)[0] + ".timestamps.json"
+    if os.path.exists(timestamps_file):
+        for image, validator, ts in read_timestamps_file(timestamps_file):
+            yield image, validator, None, None, ts
+
+# Sorted runs of records (image, validator, input index, sequence, ts, result, remark)
+class RunSpiller:
+
+    def __init__(self, directory, run_size):
+        self.directory = directory
+        self.run_size = run_size
+        self.run = []
+        # spilled runs, file paths
+        self.files = []
+        # records per pickle in a spilled run, every open run holds one batch while they are merged,
+        # so all of them together hold at most about one run
+        self.batch_size = max(100, run_size // max_open_runs)
+
+    # records are appended to run by the caller, which calls spill() once it holds run_size records
+    def spill(self):
+        self.run.sort()
+        self.spill_sorted(self.run)
+        self.run.clear()
+
+    def spill_sorted(self, records):
+        fd, file = tempfile.mkstemp(prefix = "run-", suffix = ".pickle", dir = self.directory)
+        with os.fdopen(fd, "wb") as f:
+            batch = []
+            for record in records:
+                batch.append(record)
+                if len(batch) == self.batch_size:
+                    pickle.dump(batch, f, pickle.HIGHEST_PROTOCOL)
+                    batch = []
+            if batch:
+                pickle.dump(batch, f, pickle.HIGHEST_PROTOCOL)
+        self.files.append(file)
+
+    @staticmethod
+    def read_run(file):
+        with open(file, "rb") as f:
+            while True:
+                try:
+                    batch = pickle.load(f)
+                except EOFError:
+                    return
+                yield from batch
+
+    # all records in sorted order, the last run stays in memory
+    def merged(self):
+        self.run.sort()
+        while len(self.files) >= max_open_runs:
+            files, self.files = self.files[:max_open_runs], self.files[max_open_runs:]
+            self.spill_sorted(heapq.merge(*[self.read_run(file) for file in files]))
+            for file in files:
+                os.remove(file)
+        return heapq.merge(*[self.read_run(file) for file in self.files], self.run)
+
+# (image, validator, [records]) of the sorted records, one group per pair
+def pairs(records):
+    group = []
+    key = None
+    for record in records:
+        if record[:2] != key:
+            if group:
+                yield key[0], key[1], group
+            key = record[:2]
+            group = []
+        group.append(record)
+    if group:
+        yield key[0], key[1], group
+
+# winner and the losing records that disagree with it, each distinct (result, remark) once with its newest record
+# records: (image, validator, input index, sequence, ts, result, remark) of one pair
+def resolve(records):
+    if len(records) == 1:
+        return (records[0], []) if records[0][5] is not None else (None, [])
+    results = [record for record in records if record[5] is not None]
+    if not results:
+        return None, []
+    if len(results) < len(records):
+        # times of a version 1 file belong to the results of the same input, which have ts 0
+        times = {record[2]: record[4] for record in records if record[5] is None}
+        results = [record if record[4] or record[2] not in times else record[:4] + (times[record[2]],) + record[5:] for record in results]
+    results.sort(key = lambda record: (record[4], record[2], record[3]))
+    winner = results[-1]
+    others = {}
+    for record in results[:-1]:
+        if record[5:] != winner[5:]:
+            others[record[5:]] = record
+    return winner, sorted(others.values(), key = lambda record: (record[4], record[2], record[3]), reverse = True)
+
+# results: (image, validator, result, remark, ts) of the winners, image by image
+# validators: the validators to index the snapshot rows with, in order
+def snapshot_images(winners, validators):
+    validator_index = {validator: index for index, validator in enumerate(validators)}
+    image = None
+    rows = []
+    for winner_image, validator, result, remark, ts in winners:
+        if winner_image != image:
+            if rows:
+                yield image, rows
+            image = winner_image
+            rows = []
+        rows.append(snapshot_row(validator_index[validator], result, remark, ts))
+    if rows:
+        yield image, rows
+
+# merge the inputs into one results snapshot (version 2) at output
+# conflicts_file: where the conflicts are written as JSON lines, not written if None
+# returns counts: inputs, records read, results and images written, conflicts
+def merge_results(inputs, output, *, conflicts_file = None, run_size = run_size, temp_dir = None):
+    summary = {"inputs": len(inputs), "records": 0, "results": 0, "images": 0, "conflicts": 0}
+    validators = set()
+    with tempfile.TemporaryDirectory(prefix = "label-validator-merge-", dir = temp_dir) as directory:
+        spiller = RunSpiller(directory, run_size)
+        run = spiller.run
+        for index, file in enumerate(inputs):
+            for sequence, (image, validator, result, remark, ts) in enumerate(read_input(file)):
+                if result is not None:
+                    validators.add(validator)
+                    summary["records"] += 1
+                    # "" and "None" are both no remark
+                    if not remark:
+                        remark = "None"
+                run.append((image, validator, index, sequence, ts or 0, result, remark))
+                if len(run) >= run_size:
+                    spiller.spill()
+
+        conflicts = open(conflicts_file, "w", encoding = "utf-8") if conflicts_file is not None else None
+        try:
+            def winners():
+                for image, validator, records in pairs(spiller.merged()):
+                    winner, others = resolve(records)
+                    if winner is None:
+                        continue
+                    if others:
+                        summary["conflicts"] += 1
+                        if conflicts is not None:
+                            conflicts.write(encoder.encode({"image": image, "validator": validator, "winner": conflict_entry(winner, inputs), "others": [conflict_entry(record, inputs) for record in others]}) + "\n")
+                    summary["results"] += 1
+                    yield image, validator, winner[5], winner[6], winner[4]
+
+            def counted(images):
+                for item in images:
+                    summary["images"] += 1
+                    yield item
+
+            temp_file = output + ".tmp"
+            with open(temp_file, "w", encoding = "utf-8") as f:
+                write_snapshot_images(f, sorted(validators), counted(snapshot_images(winners(), sorted(validators))))
+            os.replace(temp_file, output)
+        finally:
+            if conflicts is not None:
+                conflicts.close()
+    return summary
+
+def conflict_entry(record, inputs):
+    return {"result": record[5], "remark": record[6], "ts": record[4], "input": inputs[record[2]]}
+
+# usage: python -m app.merge FILE... -o OUTPUT [--conflicts FILE] [--run-size N]
+def main(argv):
+    parser = argparse.ArgumentParser(prog = "python -m app.merge", description = "merge results files, journals and SQLite results databases")
+    add_arguments(parser)
+    return merge_command(parser.parse_args(argv))
+
+def add_arguments(parser):
+    parser.add_argument("files", nargs = "+", help = "results files, journals (*.jsonl) or SQLite databases (*.sqlite3), later files win ties")
+    parser.add_argument("-o", "--output", required = True, help = "merged results file, can be used as validate_results.json")
+    parser.add_argument("--conflicts", metavar = "FILE", help = "conflicts as JSON lines, default OUTPUT.conflicts.jsonl")
+    parser.add_argument("--run-size", type = int, default = run_size, help = "records sorted in memory at a time")
+
+def merge_command(args):
+    conflicts_file = args.conflicts or args.output + ".conflicts.jsonl"
+    summary = merge_results(args.files, args.output, conflicts_file = conflicts_file, run_size = args.run_size)
+    print(f"inputs: {summary['inputs']}, records read: {summary['records']}")
+    print(f"merged: {summary['results']} results on {summary['images']} images into {args.output}")
+    print(f"conflicts: {summary['conflicts']}" + (f", listed in {conflicts_file}" if summary["conflicts"] else ""))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
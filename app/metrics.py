@@ -0,0 +1,140 @@
+import os, json, time, atexit, threading, functools
+from bisect import bisect_right
+from contextlib import contextmanager
+
+# Latency histograms and counters of the hot paths
+# Every timed call costs two perf_counter() calls and a bisect into fixed log-scale buckets,
+# so the hooks stay on all the time. Percentiles are read from the buckets, i.e. within one bucket (~19%).
+
+# bucket upper bounds in seconds: 4 buckets per power of two from 1 us to ~67 s
+bucket_bounds = [1e-6 * 2 ** (i / 4) for i in range(4 * 26 + 1)]
+
+class LatencyHistogram:
+
+    def __init__(self):
+        # the last bucket takes everything above the highest bound
+        self.buckets = [0] * (len(bucket_bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        self.buckets[bisect_right(bucket_bounds, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    # upper bound of the bucket holding the p-th percentile, p in [0, 100]
+    def percentile(self, p):
+        if self.count == 0:
+            return None
+        rank = max(1, round(self.count * p / 100))
+        seen = 0
+        for i, count in enumerate(self.buckets):
+            seen += count
+            if seen >= rank:
+                return min(bucket_bounds[i], self.max) if i < len(bucket_bounds) else self.max
+        return self.max
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "mean_ms": self.total / self.count * 1000 if self.count else None,
+            "p50_ms": self.percentile(50) * 1000 if self.count else None,
+            "p99_ms": self.percentile(99) * 1000 if self.count else None,
+            "max_ms": self.max * 1000,
+        }
+
+class Metrics:
+
+    def __init__(self):
+        # operation name -> LatencyHistogram
+        self.histograms = {}
+        # counter name -> value
+        self.counters = {}
+        # hooks run on the GUI thread, the heartbeat and the decode workers
+        self.lock = threading.Lock()
+        # number of samples at the last dump, nothing is written while it did not change
+        self.dumped_samples = 0
+        self.samples = 0
+
+    def record(self, name, seconds):
+        with self.lock:
+            if name not in self.histograms:
+                self.histograms[name] = LatencyHistogram()
+            self.histograms[name].record(seconds)
+            self.samples += 1
+
+    def increment(self, name, count = 1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + count
+            self.samples += 1
+
+    @contextmanager
+    def timer(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    # decorator
+    def timed(self, name):
+        def decorator(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    self.record(name, time.perf_counter() - start)
+            return wrapper
+        return decorator
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "latency": {name: histogram.summary() for name, histogram in sorted(self.histograms.items())},
+                "counters": dict(sorted(self.counters.items())),
+            }
+
+    # appends one JSON line with the totals since start, unless nothing happened since the last dump
+    def dump(self, metrics_file):
+        with self.lock:
+            if self.samples == self.dumped_samples:
+                return
+            self.dumped_samples = self.samples
+        line = json.dumps({"ts": time.time(), "pid": os.getpid(), **self.snapshot()}, ensure_ascii = False)
+        with open(metrics_file, "a", encoding = "utf-8") as f:
+            f.write(line + "\n")
+
+    # text for the debug overlay
+    def format(self):
+        snapshot = self.snapshot()
+        lines = [f"{'operation':<28}{'count':>7}{'p50 ms':>9}{'p99 ms':>9}"]
+        for name, row in snapshot["latency"].items():
+            lines.append(f"{name:<28}{row['count']:>7}{row['p50_ms']:>9.2f}{row['p99_ms']:>9.2f}")
+        for name, value in snapshot["counters"].items():
+            lines.append(f"{name:<28}{value:>7}")
+        return "\n".join(lines)
+
+# process-wide registry used by all hooks
+metrics = Metrics()
+
+# LABEL_VALIDATOR_PROFILE=FILE wraps the whole session in cProfile, the stats are written to FILE on exit
+# (read them with python -m pstats FILE)
+def start_profiling_from_env():
+    profile_file = os.environ.get("LABEL_VALIDATOR_PROFILE")
+    if not profile_file:
+        return None
+    import cProfile
+    profiler = cProfile.Profile()
+
+    def stop():
+        profiler.disable()
+        profiler.dump_stats(profile_file)
+
+    atexit.register(stop)
+    profiler.enable()
+    return profiler
@@ -0,0 +1,33 @@
+from collections import OrderedDict
+
+# Bounded in-memory LRU of decoded tile pixmaps, keyed by image path
+# shared by all image divs, so swaps and reselections never go back to the disk
+class PixmapCache:
+
+    def __init__(self, capacity = 256):
+        self.capacity = capacity
+        self.pixmaps = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, image_path):
+        pixmap = self.pixmaps.get(image_path)
+        if pixmap is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.pixmaps.move_to_end(image_path)
+        return pixmap
+
+    def put(self, image_path, pixmap):
+        self.pixmaps[image_path] = pixmap
+        self.pixmaps.move_to_end(image_path)
+        while len(self.pixmaps) > self.capacity:
+            self.pixmaps.popitem(last = False)
+
+    # membership test that does not count as a hit or miss
+    def __contains__(self, image_path):
+        return image_path in self.pixmaps
+
+    def __len__(self):
+        return len(self.pixmaps)
@@ -0,0 +1,198 @@
+from itertools import islice, repeat
+from operator import itemgetter
+import numpy as np
+from app.results_model import result_names
+
+# Progress and agreement report
+# Results are reduced to a rating matrix, one row per validator and one column per image with the result code
+# or -1, and a label mask per image; everything else is computed with NumPy on those.
+# A ResultsTable is read straight from its result code columns, the SQLite store aggregates in SQL and hands over
+# groups of images with the same labels and results, each group a column weighted by its number of images.
+# Only a plain stream of records is interned record by record.
+
+result_codes = {name: code for code, name in enumerate(result_names)}
+
+class ResultColumns:
+
+    # records are consumed in chunks of this size, each chunk is converted with C-level map/dict calls
+    chunk_size = 65536
+
+    # validators: names of the rows of ratings
+    # ratings: validators x columns int8, result code or -1
+    # masks: label mask of every column
+    # weights: images per column, None if every column is one image
+    def __init__(self, validators, ratings, masks, weights = None):
+        self.validators = validators
+        self.ratings = ratings
+        self.masks = masks
+        self.weights = weights
+
+    # records: (image, validator, result, remark), results other than accept/incorrect/reject are skipped
+    @classmethod
+    def from_records(cls, records, label_index):
+        image_rows = {}
+        image_names = []
+        validator_rows = {}
+        validators = []
+        images, validator_ids, results = [], [], []
+        records = iter(records)
+        while True:
+            chunk = list(islice(records, cls.chunk_size))
+            if not chunk:
+                break
+            chunk_images, chunk_validators, chunk_results = (list(map(itemgetter(field), chunk)) for field in range(3))
+            count = len(chunk)
+            result = np.fromiter(map(result_codes.get, chunk_results, repeat(-1)), dtype = np.int8, count = count)
+            # new images and validators get the next rows
+            new_images = [image for image in dict.fromkeys(chunk_images) if image not in image_rows]
+            image_rows.update(zip(new_images, range(len(image_names), len(image_names) + len(new_images))))
+            image_names += new_images
+            for validator in [validator for validator in dict.fromkeys(chunk_validators) if validator not in validator_rows]:
+                validator_rows[validator] = len(validators)
+                validators.append(validator)
+            known = result >= 0
+            images.append(np.fromiter(map(image_rows.__getitem__, chunk_images), dtype = np.int32, count = count)[known])
+            validator_ids.append(np.fromiter(map(validator_rows.__getitem__, chunk_validators), dtype = np.int16, count = count)[known])
+            results.append(result[known])
+        ratings = np.full((len(validators), len(image_names)), -1, dtype = np.int8)
+        if images:
+            ratings[np.concatenate(validator_ids), np.concatenate(images)] = np.concatenate(results)
+        return cls(validators, ratings, label_index.masks_of(image_names))
+
+    # table: a ResultsTable (results_model.py) that is not written to meanwhile, e.g. a copy
+    # the columns are the table's image ids, the rows its validator ids
+    @classmethod
+    def from_table(cls, table, label_index):
+        ratings = np.full((len(table.validator_names), len(table.image_names)), -1, dtype = np.int8)
+        for validator, codes in enumerate(table.codes):
+            codes = np.frombuffer(bytes(codes), dtype = np.uint8)
+            # table codes are 1 + the code here, 0 and other results are skipped
+            known = (codes >= 1) & (codes <= len(result_names))
+            ratings[validator, :len(codes)][known] = codes[known] - 1
+        return cls(list(table.validator_names), ratings, label_index.masks_of(table.image_names))
+
+    # signature_validators, groups: SqliteResultsStore.result_groups(), one column per group
+    @classmethod
+    def from_groups(cls, signature_validators, groups, label_index):
+        label_masks = {}
+        for labels, *_ in groups:
+            if labels not in label_masks:
+                label_masks[labels] = label_index.mask_of(labels)
+        masks = np.fromiter((label_masks[labels] for labels, *_ in groups), dtype = np.uint32, count = len(groups))
+        rows = np.array([row[1:] for row in groups], dtype = np.int64).reshape(len(groups), len(signature_validators) + 1)
+        validators = [validator for chunk in signature_validators for validator in chunk]
+        ratings = np.empty((len(validators), len(groups)), dtype = np.int8)
+        row = 0
+        for signature, chunk in enumerate(signature_validators):
+            for digit in range(len(chunk)):
+                ratings[row] = ((rows[:, signature] >> (2 * digit)) & 3) - 1
+                row += 1
+        return cls(validators, ratings, masks, rows[:, -1].copy())
+
+    # per column: number of results of each code, columns x codes
+    def code_counts(self):
+        counts = np.zeros((self.ratings.shape[1], len(result_names)), dtype = np.int64)
+        for row in self.ratings:
+            for code in range(len(result_names)):
+                counts[:, code] += row == code
+        return counts
+
+# confusion: codes x codes counts of two validators on the same images
+def cohen_kappa(confusion):
+    total = confusion.sum()
+    if total == 0:
+        return None
+    observed = np.trace(confusion) / total
+    expected = (confusion.sum(axis = 0) * confusion.sum(axis = 1)).sum() / total ** 2
+    if expected == 1:
+        return 1.0 if observed == 1 else None
+    return float((observed - expected) / (1 - expected))
+
+# Fleiss' kappa for a varying number of raters per image, over images with at least two ratings
+# counts: images (or groups of images) x codes, weights: images per row, None for one each
+def fleiss_kappa(counts, weights = None):
+    raters = counts.sum(axis = 1)
+    rated = raters >= 2
+    counts, raters = counts[rated], raters[rated]
+    weights = np.ones(len(raters), dtype = np.int64) if weights is None else weights[rated]
+    if weights.sum() == 0:
+        return None
+    agreement = np.average((counts * (counts - 1)).sum(axis = 1) / (raters * (raters - 1)), weights = weights)
+    proportions = (counts * weights[:, None]).sum(axis = 0) / (raters * weights).sum()
+    expected = (proportions ** 2).sum()
+    if expected == 1:
+        return 1.0 if agreement == 1 else None
+    return float((agreement - expected) / (1 - expected))
+
+def build_report(records, label_index):
+    return build_report_from_columns(ResultColumns.from_records(records, label_index), label_index)
+
+# number of columns per value, weighted by the images per column (weights None: one each)
+def count_values(values, weights, minlength):
+    return np.bincount(values, weights = weights, minlength = minlength).astype(np.int64)
+
+def build_report_from_columns(columns, label_index):
+    ratings = columns.ratings
+    weights = columns.weights
+    categories = len(result_names)
+    counts = columns.code_counts()
+    results = counts.sum(axis = 1)
+    validated = results > 0
+    report = {
+        "images": len(label_index),
+        "validated_images": int(validated.sum() if weights is None else weights[validated].sum()),
+        "results": int(results.sum() if weights is None else (results * weights).sum()),
+    }
+
+    # per validator: number of results and results by kind
+    # codes are shifted by one so that no result (-1) is counted as well and no column has to be masked out
+    report["validators"] = {}
+    for row, name in enumerate(columns.validators):
+        per_code = count_values(ratings[row] + 1, weights, categories + 1)[1:]
+        report["validators"][name] = {"results": int(per_code.sum()), **{result_names[code]: int(per_code[code]) for code in range(categories)}}
+
+    # per category: share of accept / incorrect / reject among the results on images carrying the code
+    # summed per distinct label mask first, a few thousand at most
+    masks, mask_of_column = np.unique(columns.masks, return_inverse = True)
+    per_mask = np.stack([np.bincount(mask_of_column, weights = counts[:, code] if weights is None else counts[:, code] * weights, minlength = len(masks)) for code in range(categories)], axis = 1)
+    report["categories"] = {}
+    for code, bit in label_index.bits.items():
+        per_code = per_mask[(masks & bit) != 0].sum(axis = 0)
+        total = int(per_code.sum())
+        report["categories"][code] = {"results": total, **{result_names[c]: (float(per_code[c] / total) if total else 0.0) for c in range(categories)}}
+
+    # agreement
+    report["cohen_kappa"] = {}
+    for a in range(len(columns.validators)):
+        for b in range(a + 1, len(columns.validators)):
+            pairs = (ratings[a].astype(np.int16) + 1) * (categories + 1) + (ratings[b] + 1)
+            confusion = count_values(pairs, weights, (categories + 1) ** 2).reshape(categories + 1, categories + 1)[1:, 1:]
+            report["cohen_kappa"][f"{columns.validators[a]} / {columns.validators[b]}"] = {
+                "images": int(confusion.sum()),
+                "kappa": cohen_kappa(confusion),
+            }
+    report["fleiss_kappa"] = fleiss_kappa(counts, weights)
+    return report
+
+def format_kappa(kappa):
+    return "-" if kappa is None else f"{kappa:.3f}"
+
+def format_report(report, catagory2food):
+    lines = [
+        f"images: {report['images']}",
+        f"validated images: {report['validated_images']}",
+        f"results: {report['results']}",
+        "",
+        f"{'validator':<16}{'results':>9}{'accept':>9}{'incorrect':>10}{'reject':>9}",
+    ]
+    for name, row in report["validators"].items():
+        lines.append(f"{name:<16}{row['results']:>9}{row['accept']:>9}{row['incorrect']:>10}{row['reject']:>9}")
+    lines += ["", f"{'category':<16}{'results':>9}{'accept':>9}{'incorrect':>10}{'reject':>9}"]
+    for code, row in report["categories"].items():
+        if row["results"]:
+            lines.append(f"{code + ' ' + catagory2food.get(code, ''):<16}{row['results']:>9}{row['accept']:>9.1%}{row['incorrect']:>10.1%}{row['reject']:>9.1%}")
+    lines += ["", "Cohen's kappa"]
+    for pair, row in report["cohen_kappa"].items():
+        lines.append(f"  {pair:<32}{format_kappa(row['kappa']):>8}  ({row['images']} images)")
+    lines.append(f"Fleiss' kappa: {format_kappa(report['fleiss_kappa'])}")
+    return "\n".join(lines)
@@ -0,0 +1,351 @@
+import os, json, time, threading
+from app.results_model import ResultsTable, is_snapshot, read_snapshot, snapshot_sequences, write_snapshot
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+    import msvcrt
+
+class ResultsLockedError(RuntimeError):
+    pass
+
+# the results cannot be opened read-only as they are, e.g. a database still to be created or upgraded by a writer
+class ResultsUnavailableError(RuntimeError):
+    pass
+
+# Exclusive lock of the one process that writes the results files of a data directory, held until release()
+# flock on POSIX, a lock on the first byte on Windows; the OS drops both when the process dies,
+# so a crashed writer never leaves a stale lock behind
+class WriterLock:
+
+    def __init__(self, lock_file):
+        self.lock_file = lock_file
+        self.file = None
+
+    # waits up to timeout seconds, False if another process still holds the lock
+    def acquire(self, timeout = 0):
+        f = open(self.lock_file, "a+")
+        deadline = time.time() + timeout
+        while True:
+            try:
+                if fcntl is not None:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                else:
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+                self.file = f
+                return True
+            except OSError:
+                if time.time() >= deadline:
+                    f.close()
+                    return False
+                time.sleep(0.1)
+
+    def release(self):
+        if self.file is None:
+            return
+        if fcntl is None:
+            self.file.seek(0)
+            msvcrt.locking(self.file.fileno(), msvcrt.LK_UNLCK, 1)
+        self.file.close()
+        self.file = None
+
+# Validation results kept in memory and persisted as a snapshot file plus an append-only journal
+# - every record is appended to the journal as one JSON line, fsync is batched
+# - on load the journal is replayed on top of the snapshot
+# - compaction folds the journal back into the snapshot
+# in memory the results are a ResultsTable (results_model.py), the snapshot is written in its format (version 2)
+# older snapshots {image name: {validator: "result - remark"}} with the times kept next to them as
+# {image name: {validator: ts}} are still read, the next compaction replaces them.
+# records from before timestamps were kept have ts 0
+# The times given to recorded results are strictly increasing in commit order, also when the clock steps back, so they
+# double as the store's commit sequence (seq): an incremental export keeps the newest exported seq and asks for the
+# records after it. Imported results keep their own time, their seq is the time of their commit, kept next to it.
+# One process writes the files: load() takes the WriterLock of the data directory (validate_results.lock) and
+# raises ResultsLockedError if another process still holds it after lock_timeout seconds.
+# A read_only store takes no lock and never truncates, moves or removes a file, so it can be opened while
+# the writer appends and compacts; it cannot record.
+class JournalResultsStore:
+
+    # smallest step between two times, a few units in the last place of a current time
+    ts_step = 1e-6
+
+    def __init__(self, snapshot_file, journal_file, *, read_only = False, lock_timeout = 0, fsync_batch = 32, compact_interval = 600, compact_records = 10000):
+        self.snapshot_file = snapshot_file
+        self.timestamps_file = os.path.splitext(snapshot_file)[0] + ".timestamps.json"
+        self.journal_file = journal_file
+        self.read_only = read_only
+        self.lock_timeout = lock_timeout
+        self.writer_lock = WriterLock(os.path.splitext(snapshot_file)[0] + ".lock")
+        # journal moved aside while its records are folded into the snapshot
+        self.compacting_file = journal_file + ".compacting"
+        # fsync after this many records, the owner is expected to call sync() periodically for the rest
+        self.fsync_batch = fsync_batch
+        # fold the journal into the snapshot every compact_interval seconds or once it holds compact_records records
+        self.compact_interval = compact_interval
+        self.compact_records = compact_records
+        self.last_compaction = time.time()
+
+        self.table = ResultsTable()
+        self.lock = threading.RLock()
+        self.journal = None
+        # records written but not fsynced yet
+        self.pending = 0
+        # records in the journal since the last compaction
+        self.journal_records = 0
+        # (seq, image, validator) of every record in the journals, in commit order, for iter_changes
+        self.changes = []
+        # newest seq of the records in the snapshot (the ones not in changes), and of all records
+        self.snapshot_ts = 0
+        self.last_ts = 0
+
+    def load(self):
+        if self.read_only:
+            self._load_read_only()
+            return
+        if not self.writer_lock.acquire(self.lock_timeout):
+            raise ResultsLockedError(f"the results in {os.path.dirname(os.path.abspath(self.snapshot_file))} are being written by another process")
+        with self.lock:
+            interrupted_compaction = os.path.exists(self.compacting_file)
+            self._read_files()
+
+            self.journal = open(self.journal_file, "a", encoding = "utf-8")
+
+            # a compaction was interrupted, finish folding its records into the snapshot
+            # before the journal is moved aside again
+            if interrupted_compaction:
+                self._write_snapshot(self.table.copy())
+                os.remove(self.compacting_file)
+
+    # the writer may compact while the files are read: read again until the snapshot and the journal being
+    # compacted are the same files before and after, so no record is read from neither of them
+    def _load_read_only(self):
+        with self.lock:
+            for attempt in range(10):
+                state = self._compaction_state()
+                self.table = ResultsTable()
+                self.journal_records = 0
+                self.changes = []
+                self._read_files()
+                if self._compaction_state() == state:
+                    break
+
+    def _compaction_state(self):
+        state = []
+        for file in (self.snapshot_file, self.compacting_file):
+            try:
+                stat = os.stat(file)
+            except FileNotFoundError:
+                state.append(None)
+                continue
+            state.append((stat.st_ino, stat.st_mtime_ns, stat.st_size))
+        return state
+
+    # snapshot, then the journal being compacted and the journal
+    def _read_files(self):
+        if os.path.exists(self.snapshot_file):
+            with open(self.snapshot_file, "r") as f:
+                snapshot = json.load(f)
+            timestamps = None
+            if not is_snapshot(snapshot) and os.path.exists(self.timestamps_file):
+                with open(self.timestamps_file, "r") as f:
+                    timestamps = json.load(f)
+            for record in read_snapshot(snapshot, timestamps):
+                self.table.set(*record)
+            for image, validator, seq in snapshot_sequences(snapshot):
+                self.table.set_seq(image, validator, seq)
+            del snapshot, timestamps
+        self.snapshot_ts = self.last_ts = self.table.newest_seq()
+        for journal_file in (self.compacting_file, self.journal_file):
+            self.journal_records += self._replay(journal_file)
+
+    def _replay(self, journal_file):
+        try:
+            f = open(journal_file, "rb")
+        except FileNotFoundError:
+            return 0
+        count = 0
+        valid_size = 0
+        with f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # torn write at the end of the journal after a crash, or a line the writer is still appending
+                    break
+                ts = record.get("ts", 0)
+                seq = record.get("seq", ts)
+                self.table.set(record["image"], record["validator"], record["result"], record["remark"], ts, seq)
+                self.changes.append((seq, record["image"], record["validator"]))
+                self.last_ts = max(self.last_ts, seq)
+                valid_size += len(line)
+                count += 1
+        # cut the torn record off, otherwise the next record would be appended to it
+        if not self.read_only and valid_size < os.path.getsize(journal_file):
+            os.truncate(journal_file, valid_size)
+        return count
+
+    # count strictly increasing times from now, called with the lock held
+    def _next_times(self, count):
+        ts = max(time.time(), self.last_ts + self.ts_step)
+        self.last_ts = ts + max(count - 1, 0) * self.ts_step
+        return ts
+
+    def _check_writable(self):
+        if self.read_only:
+            raise ResultsLockedError("the results were opened read-only")
+
+    def record(self, image, validator, result, remark):
+        self._check_writable()
+        with self.lock:
+            ts = self._next_times(1)
+            self.table.set(image, validator, result, remark, ts)
+            self.changes.append((ts, image, validator))
+            self.journal.write(json.dumps({"image": image, "validator": validator, "result": result, "remark": remark, "ts": ts}, ensure_ascii = False) + "\n")
+            self.journal.flush()
+            self.pending += 1
+            self.journal_records += 1
+            if self.pending >= self.fsync_batch:
+                self.sync()
+
+    # records: [(image, validator, result, remark)], appended to the journal in one write and fsynced together
+    def record_many(self, records):
+        self._check_writable()
+        with self.lock:
+            # every record a time of its own, a reader that sees part of the batch still gets a valid watermark
+            first = self._next_times(len(records))
+            times = [first + index * self.ts_step for index in range(len(records))]
+            for (image, validator, result, remark), ts in zip(records, times):
+                self.table.set(image, validator, result, remark, ts)
+                self.changes.append((ts, image, validator))
+            self.journal.write("".join(json.dumps({"image": image, "validator": validator, "result": result, "remark": remark, "ts": ts}, ensure_ascii = False) + "\n" for (image, validator, result, remark), ts in zip(records, times)))
+            self.journal.flush()
+            self.pending += len(records)
+            self.journal_records += len(records)
+            self.sync()
+
+    # records: [(image, validator, result, remark, ts)] of another store, e.g. an older results file
+    # a record is only taken if it is newer than the result of its (image, validator), and keeps its time;
+    # the ones taken are appended to the journal in one write. Returns the number of records taken.
+    def import_records(self, records):
+        self._check_writable()
+        with self.lock:
+            lines = []
+            for image, validator, result, remark, ts in records:
+                current = self.table.get(image, validator)
+                if current is not None and ts <= current[2]:
+                    continue
+                seq = self._next_times(1)
+                self.table.set(image, validator, result, remark, ts, seq)
+                self.changes.append((seq, image, validator))
+                lines.append(json.dumps({"image": image, "validator": validator, "result": result, "remark": remark, "ts": ts, "seq": seq}, ensure_ascii = False) + "\n")
+            self.journal.write("".join(lines))
+            self.journal.flush()
+            self.pending += len(lines)
+            self.journal_records += len(lines)
+            self.sync()
+            return len(lines)
+
+    def has(self, image, validator):
+        return self.table.has(image, validator)
+
+    def images_validated_by(self, validator):
+        with self.lock:
+            return self.table.images_validated_by(validator)
+
+    # image name -> number of validators that validated it
+    def validator_counts(self):
+        with self.lock:
+            return self.table.validator_counts()
+
+    def __len__(self):
+        return len(self.table)
+
+    # copy of the table, e.g. for the report, records can be written while it is read
+    def copy_table(self):
+        with self.lock:
+            return self.table.copy()
+
+    # yields (image, validator, result, remark)
+    def iter_records(self):
+        for image, validator, result, remark, ts in self.copy_table().iter_records():
+            yield image, validator, result, remark
+
+    # yields (image, validator, result, remark, ts, seq) of the records committed after seq since, all records if
+    # since is None. Changes since the last compaction are read from the journal's change
+    # log, so an incremental export costs as much as the records it writes, not the whole table.
+    def iter_changes(self, since = None):
+        with self.lock:
+            if since is not None and since >= self.snapshot_ts:
+                changes = []
+                for seq, image, validator in self.changes:
+                    # overwritten later, the newer record comes further on
+                    if seq > since and self.table.seq(image, validator) == seq:
+                        changes.append((image, validator, *self.table.get(image, validator), seq))
+                return iter(changes)
+            table = self.table.copy()
+        return table.iter_changes(since)
+
+    # seq of a watermark kept as a record time by earlier versions, which had no imported records:
+    # every seq up to then is the time of its record
+    def seq_at(self, ts):
+        return ts
+
+    def merge(self, validate_results):
+        for image, results in validate_results.items():
+            for validator, value in results.items():
+                result, _, remark = value.partition(" - ")
+                self.record(image, validator, result, remark)
+
+    def sync(self):
+        with self.lock:
+            if self.journal is None or self.pending == 0:
+                return
+            os.fsync(self.journal.fileno())
+            self.pending = 0
+
+    # called periodically by the owner
+    def maintain(self):
+        self.sync()
+        if self.journal_records >= self.compact_records or (self.journal_records > 0 and time.time() - self.last_compaction >= self.compact_interval):
+            self.compact()
+
+    def compact(self):
+        with self.lock:
+            if self.journal is None or self.journal_records == 0:
+                return
+            # move the journal aside, new records go to a fresh journal while the snapshot is written
+            self.sync()
+            self.journal.close()
+            os.replace(self.journal_file, self.compacting_file)
+            self.journal = open(self.journal_file, "a", encoding = "utf-8")
+            self.journal_records = 0
+            self.last_compaction = time.time()
+            self.changes = []
+            self.snapshot_ts = self.last_ts
+            table = self.table.copy()
+
+        self._write_snapshot(table)
+        os.remove(self.compacting_file)
+
+    # the journal being compacted is only removed after the snapshot is written,
+    # so an interrupted write is repaired by replaying it on the next load
+    # the times file of an older snapshot is only removed once the new snapshot holds them
+    def _write_snapshot(self, table):
+        temp_file = self.snapshot_file + ".tmp"
+        with open(temp_file, "w") as f:
+            write_snapshot(table, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_file, self.snapshot_file)
+        if os.path.exists(self.timestamps_file):
+            os.remove(self.timestamps_file)
+
+    def close(self):
+        with self.lock:
+            if self.journal is not None:
+                self.sync()
+                self.journal.close()
+                self.journal = None
+            self.writer_lock.release()
@@ -0,0 +1,424 @@
+import re, json
+from array import array
+from itertools import compress
+
+# Compact in-memory model of the validation results
+# Image names and validators are interned to ids. Every validator has one dense column per field, indexed by image id:
+# a result code byte and a float64 time, so a result costs 9 bytes and an image name is stored once,
+# instead of a dict per image, a validator key per result and a "result - remark" string per result.
+# Remarks are only kept when not empty, results outside accept/incorrect/reject are kept as strings.
+
+result_names = ["accept", "incorrect", "reject"]
+# code 0: no result, code k: result_names[k - 1], other_code: the result string is in other_results
+result_codes = {name: code for code, name in enumerate(result_names, 1)}
+other_code = 255
+
+class ResultsTable:
+
+    def __init__(self):
+        # image id -> name, name -> image id
+        self.image_names = []
+        self.image_ids = {}
+        self.validator_names = []
+        self.validator_ids = {}
+        # per validator id, indexed by image id: result codes and times
+        # columns only grow up to the highest image id the validator has a result for
+        self.codes = []
+        self.times = []
+        # per validator id: {image id: remark} and {image id: result} for other_code
+        self.remarks = []
+        self.other_results = []
+        # per validator id: {image id: seq} of the results committed later than their time (imported),
+        # the seq of every other result is its time
+        self.sequences = []
+        # number of results
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def image_id(self, image):
+        image_id = self.image_ids.get(image)
+        if image_id is None:
+            image_id = self.image_ids[image] = len(self.image_names)
+            self.image_names.append(image)
+        return image_id
+
+    def validator_id(self, validator):
+        validator_id = self.validator_ids.get(validator)
+        if validator_id is None:
+            validator_id = self.validator_ids[validator] = len(self.validator_names)
+            self.validator_names.append(validator)
+            self.codes.append(bytearray())
+            self.times.append(array("d"))
+            self.remarks.append({})
+            self.other_results.append({})
+            self.sequences.append({})
+        return validator_id
+
+    # empty remarks are stored as "None" by the app, neither is kept
+    # seq: commit sequence of a result committed after its time, None if it is the time
+    def set(self, image, validator, result, remark, ts, seq = None):
+        image_id = self.image_id(image)
+        validator_id = self.validator_id(validator)
+        codes = self.codes[validator_id]
+        if image_id >= len(codes):
+            missing = image_id + 1 - len(codes)
+            codes.extend(bytes(missing))
+            self.times[validator_id].frombytes(bytes(8 * missing))
+        if not codes[image_id]:
+            self.count += 1
+        code = result_codes.get(result, other_code)
+        codes[image_id] = code
+        if code == other_code:
+            self.other_results[validator_id][image_id] = result
+        else:
+            self.other_results[validator_id].pop(image_id, None)
+        self.times[validator_id][image_id] = ts
+        if remark and remark != "None":
+            self.remarks[validator_id][image_id] = remark
+        else:
+            self.remarks[validator_id].pop(image_id, None)
+        if seq is not None and seq != ts:
+            self.sequences[validator_id][image_id] = seq
+        else:
+            self.sequences[validator_id].pop(image_id, None)
+
+    def _code(self, image_id, validator_id):
+        codes = self.codes[validator_id]
+        return codes[image_id] if image_id < len(codes) else 0
+
+    def has(self, image, validator):
+        image_id = self.image_ids.get(image)
+        validator_id = self.validator_ids.get(validator)
+        return image_id is not None and validator_id is not None and self._code(image_id, validator_id) != 0
+
+    # (result, remark, ts) of one image id and validator id, the code must not be 0
+    def _record(self, image_id, validator_id, code):
+        result = result_names[code - 1] if code != other_code else self.other_results[validator_id][image_id]
+        return result, self.remarks[validator_id].get(image_id, "None"), self.times[validator_id][image_id]
+
+    # (result, remark, ts) or None
+    def get(self, image, validator):
+        image_id = self.image_ids.get(image)
+        validator_id = self.validator_ids.get(validator)
+        if image_id is None or validator_id is None:
+            return None
+        code = self._code(image_id, validator_id)
+        return self._record(image_id, validator_id, code) if code else None
+
+    def set_seq(self, image, validator, seq):
+        self.sequences[self.validator_ids[validator]][self.image_ids[image]] = seq
+
+    # seq of the result of image and validator, None if there is none
+    def seq(self, image, validator):
+        image_id = self.image_ids.get(image)
+        validator_id = self.validator_ids.get(validator)
+        if image_id is None or validator_id is None or not self._code(image_id, validator_id):
+            return None
+        return self.sequences[validator_id].get(image_id, self.times[validator_id][image_id])
+
+    def images_validated_by(self, validator):
+        validator_id = self.validator_ids.get(validator)
+        if validator_id is None:
+            return set()
+        return set(compress(self.image_names, self.codes[validator_id]))
+
+    # image name -> number of validators that validated it
+    def validator_counts(self):
+        counts = [0] * len(self.image_names)
+        for codes in self.codes:
+            for image_id in compress(range(len(codes)), codes):
+                counts[image_id] += 1
+        return {image: count for image, count in zip(self.image_names, counts) if count}
+
+    # (validator, result, remark, ts) of one image id
+    def image_records(self, image_id):
+        for validator_id, codes in enumerate(self.codes):
+            code = codes[image_id] if image_id < len(codes) else 0
+            if code:
+                yield (self.validator_names[validator_id], *self._record(image_id, validator_id, code))
+
+    # yields (image, validator, result, remark, ts) image by image, only the records written after since unless it is None
+    def iter_records(self, since = None):
+        for image_id, image in enumerate(self.image_names):
+            for validator, result, remark, ts in self.image_records(image_id):
+                if since is None or ts > since:
+                    yield image, validator, result, remark, ts
+
+    # yields (image, validator, result, remark, ts, seq) image by image, only the records committed after seq since
+    # unless it is None
+    def iter_changes(self, since = None):
+        for image_id, image in enumerate(self.image_names):
+            for validator_id, codes in enumerate(self.codes):
+                code = codes[image_id] if image_id < len(codes) else 0
+                if not code:
+                    continue
+                result, remark, ts = self._record(image_id, validator_id, code)
+                seq = self.sequences[validator_id].get(image_id, ts)
+                if since is None or seq > since:
+                    yield image, self.validator_names[validator_id], result, remark, ts, seq
+
+    # newest seq of all results, 0 if there are none
+    def newest_seq(self):
+        newest = 0
+        for codes, times, sequences in zip(self.codes, self.times, self.sequences):
+            if sequences:
+                # the time of an imported result is not its seq
+                newest = max(newest, max(sequences.values()), max((ts for image_id, ts in enumerate(times) if codes[image_id] and image_id not in sequences), default = 0))
+            elif times:
+                newest = max(newest, max(times))
+        return newest
+
+    def copy(self):
+        table = ResultsTable()
+        table.image_names = self.image_names.copy()
+        table.image_ids = self.image_ids.copy()
+        table.validator_names = self.validator_names.copy()
+        table.validator_ids = self.validator_ids.copy()
+        table.codes = [codes[:] for codes in self.codes]
+        table.times = [times[:] for times in self.times]
+        table.remarks = [remarks.copy() for remarks in self.remarks]
+        table.other_results = [other_results.copy() for other_results in self.other_results]
+        table.sequences = [sequences.copy() for sequences in self.sequences]
+        table.count = self.count
+        return table
+
+# Snapshot format, version 2:
+# {"format": "label-validator-results", "version": 2, "validators": [...], "results": [...], "images": {
+# image name: [[validator index, result index, ts], [validator index, result index, ts, remark], ...],
+# ...}}
+# a result outside "results" is written as its string instead of an index
+# a result committed after its time (imported) carries its commit sequence as well: [..., ts, remark or null, seq]
+# Version 1 is the older {image name: {validator: "result - remark"}} with the times in a separate file.
+snapshot_format = "label-validator-results"
+snapshot_version = 2
+
+snapshot_header_keys = ("format", "version", "validators", "results")
+
+encoder = json.JSONEncoder(ensure_ascii = False, separators = (",", ":"))
+decoder = json.JSONDecoder()
+
+# writes the snapshot of the table, see write_snapshot_images
+def write_snapshot(table, f, *, chunk_size = 4096):
+    write_snapshot_images(f, table.validator_names, _table_images(table), chunk_size = chunk_size)
+
+# (image name, snapshot rows) of every image with a result
+def _table_images(table):
+    for image_id, image in enumerate(table.image_names):
+        rows = []
+        for validator_id, codes in enumerate(table.codes):
+            code = codes[image_id] if image_id < len(codes) else 0
+            if not code:
+                continue
+            row = [validator_id, code - 1 if code != other_code else table.other_results[validator_id][image_id], table.times[validator_id][image_id]]
+            remark = table.remarks[validator_id].get(image_id)
+            seq = table.sequences[validator_id].get(image_id)
+            if seq is not None:
+                row += [remark, seq]
+            elif remark is not None:
+                row.append(remark)
+            rows.append(row)
+        if rows:
+            yield image, rows
+
+# images: (image name, snapshot rows) with the validator indexes into validators, every image once
+# written in chunks of images, one line per chunk, so the results are never converted to dicts all at once
+def write_snapshot_images(f, validators, images, *, chunk_size = 4096):
+    header = {"format": snapshot_format, "version": snapshot_version, "validators": validators, "results": result_names}
+    f.write(encoder.encode(header)[:-1] + ',"images":{')
+    separator = "\n"
+    chunk = {}
+    for image, rows in images:
+        chunk[image] = rows
+        if len(chunk) == chunk_size:
+            f.write(separator + encoder.encode(chunk)[1:-1])
+            separator = ",\n"
+            chunk = {}
+    if chunk:
+        f.write(separator + encoder.encode(chunk)[1:-1])
+    f.write("\n}}\n")
+
+# snapshot row of one result, the result index or the result string if it has none
+def snapshot_row(validator_index, result, remark, ts):
+    code = result_codes.get(result)
+    row = [validator_index, code - 1 if code is not None else result, ts]
+    if remark and remark != "None":
+        row.append(remark)
+    return row
+
+def row_remark(row):
+    return row[3] if len(row) > 3 and row[3] is not None else "None"
+
+# (image, validator, seq) of the results of parsed version 2 snapshot data that carry a commit sequence
+def snapshot_sequences(data):
+    if not is_snapshot(data):
+        return
+    validators = data["validators"]
+    for image, rows in data["images"].items():
+        for row in rows:
+            if len(row) > 4:
+                yield image, validators[row[0]], row[4]
+
+def is_snapshot(data):
+    return isinstance(data, dict) and data.get("format") == snapshot_format
+
+# records (image, validator, result, remark, ts) of parsed snapshot data of either version
+# timestamps: {image name: {validator: ts}} of a version 1 snapshot, records without one have ts 0
+def read_snapshot(data, timestamps = None):
+    if is_snapshot(data):
+        if data.get("version") != snapshot_version:
+            raise ValueError(f"unsupported results snapshot version {data.get('version')!r}")
+        validators = data["validators"]
+        results = data["results"]
+        for image, rows in data["images"].items():
+            for row in rows:
+                result = results[row[1]] if isinstance(row[1], int) else row[1]
+                yield image, validators[row[0]], result, row_remark(row), row[2]
+        return
+    timestamps = timestamps or {}
+    for image, results in data.items():
+        image_timestamps = timestamps.get(image, {})
+        for validator, value in results.items():
+            result, _, remark = value.partition(" - ")
+            yield image, validator, result, remark, image_timestamps.get(validator, 0)
+
+# Incremental reader of one JSON document
+# Values are decoded with raw_decode from a window over the file, which is refilled as it is used up,
+# so a results file is read one image at a time instead of being parsed as a whole.
+class JsonStream:
+
+    whitespace = re.compile(r"[ \t\n\r]*")
+    # a key without escapes and its colon, the common case decoded without raw_decode
+    plain_key = re.compile(r'[ \t\n\r]*"([^"\\]*)"[ \t\n\r]*:')
+
+    def __init__(self, f, *, read_size = 1 << 20):
+        self.f = f
+        self.read_size = read_size
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+
+    def fill(self):
+        chunk = self.f.read(self.read_size)
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        self.eof = not chunk
+        return not self.eof
+
+    # next character after whitespace, not consumed, "" at the end of the file
+    def peek(self):
+        while True:
+            if self.pos < len(self.buffer):
+                char = self.buffer[self.pos]
+                if char not in " \t\n\r":
+                    return char
+                self.pos = self.whitespace.match(self.buffer, self.pos).end()
+                if self.pos < len(self.buffer):
+                    return self.buffer[self.pos]
+            if not self.fill():
+                return ""
+
+    # consumes the next character, which must be one of chars
+    def expect(self, chars):
+        char = self.peek()
+        if not char or char not in chars:
+            raise ValueError(f"expected one of {chars!r} at {char!r}")
+        self.pos += 1
+        return char
+
+    # key of an object member and its colon
+    def key(self):
+        match = self.plain_key.match(self.buffer, self.pos)
+        if match is not None:
+            self.pos = match.end()
+            return match.group(1)
+        key = self.value()
+        self.expect(":")
+        return key
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = decoder.raw_decode(self.buffer, self.pos)
+                # a number at the end of the window may go on in the file
+                if end < len(self.buffer) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self.fill()
+
+# keys of the object at the position of the stream, the caller reads each value before asking for the next key
+def object_keys(stream):
+    stream.expect("{")
+    if stream.peek() == "}":
+        stream.pos += 1
+        return
+    while True:
+        yield stream.key()
+        if stream.expect(",}") == "}":
+            return
+
+# (key, value) of the members of the object at the position of the stream
+# members written on one line, like the chunks of write_snapshot_images, are decoded together,
+# anything else member by member
+def object_items(stream):
+    stream.expect("{")
+    if stream.peek() == "}":
+        stream.pos += 1
+        return
+    while True:
+        stream.peek()
+        end = stream.buffer.find("\n", stream.pos)
+        # the rest of the line is read into the window, unless the lines are very long
+        if end < 0 and len(stream.buffer) - stream.pos < 4 * stream.read_size and stream.fill():
+            continue
+        if end >= 0:
+            line = stream.buffer[stream.pos:end].rstrip()
+            try:
+                members = json.loads("{" + line.removesuffix(",") + "}")
+            except ValueError:
+                members = None
+            if members is not None:
+                stream.pos = end
+                yield from members.items()
+                if not line.endswith(",") and stream.expect(",}") == "}":
+                    return
+                continue
+        yield stream.key(), stream.value()
+        if stream.expect(",}") == "}":
+            return
+
+# records (image, validator, result, remark, ts) of a results file of either version, read one image at a time
+# version 1 records have ts 0, their times are in a separate file
+def read_results_file(file):
+    with open(file, "r", encoding = "utf-8") as f:
+        stream = JsonStream(f)
+        header = {}
+        for key in object_keys(stream):
+            if key == "images" and is_snapshot(header):
+                if header.get("version") != snapshot_version:
+                    raise ValueError(f"unsupported results snapshot version {header.get('version')!r}")
+                validators = header["validators"]
+                results = header["results"]
+                for image, rows in object_items(stream):
+                    for row in rows:
+                        result = results[row[1]] if isinstance(row[1], int) else row[1]
+                        yield image, validators[row[0]], result, row_remark(row), row[2]
+            elif key in snapshot_header_keys:
+                header[key] = stream.value()
+            else:
+                for validator, value in stream.value().items():
+                    result, _, remark = value.partition(" - ")
+                    yield key, validator, result, remark, 0
+
+# (image, validator, ts) of the times kept next to a version 1 results file
+def read_timestamps_file(file):
+    with open(file, "r", encoding = "utf-8") as f:
+        stream = JsonStream(f)
+        for image in object_keys(stream):
+            for validator, ts in stream.value().items():
+                yield image, validator, ts
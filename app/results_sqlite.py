@@ -0,0 +1,239 @@
+import os, sqlite3, time, pathlib, threading
+from app.results import JournalResultsStore, ResultsUnavailableError
+from app.results_model import result_names
+
+# Validation results kept in a local SQLite database
+# Same interface as JournalResultsStore, but nothing is held in memory and every record is committed
+# on its own, so several app instances can write to the same database at once.
+# WAL mode needs shared memory between the writers, so the database must live on a local disk
+# (any number of processes on that machine can use it).
+# Every write takes the next commit sequence number (seq) inside its write transaction; writers are serialized,
+# so seq order is commit order whatever the clocks of the writers say, and incremental exports follow seq.
+# read_only: the database is opened with mode=ro and never created or changed (no schema, no upgrade),
+# load() raises ResultsUnavailableError if there is none or it still needs the upgrade of a writer.
+class SqliteResultsStore:
+
+    schema = """
+        CREATE TABLE IF NOT EXISTS results (
+            image TEXT NOT NULL,
+            validator TEXT NOT NULL,
+            result TEXT NOT NULL,
+            remark TEXT NOT NULL,
+            ts REAL NOT NULL,
+            seq INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (image, validator)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS results_by_validator ON results (validator, image);
+        CREATE INDEX IF NOT EXISTS results_by_result ON results (result);
+        CREATE INDEX IF NOT EXISTS results_by_ts ON results (ts);
+    """
+    insert = "INSERT OR REPLACE INTO results (image, validator, result, remark, ts, seq) VALUES (?, ?, ?, ?, ?, (SELECT COALESCE(MAX(seq), 0) + 1 FROM results))"
+    # keeps the stored result unless the new one is newer
+    insert_newer = """
+        INSERT INTO results (image, validator, result, remark, ts, seq) VALUES (?, ?, ?, ?, ?, (SELECT COALESCE(MAX(seq), 0) + 1 FROM results))
+        ON CONFLICT (image, validator) DO UPDATE SET result = excluded.result, remark = excluded.remark, ts = excluded.ts, seq = excluded.seq
+        WHERE excluded.ts > results.ts
+    """
+
+    # validators per signature of result_groups, 2 bits each in a 64-bit integer
+    validators_per_signature = 30
+
+    def __init__(self, database_file, *, read_only = False, busy_timeout = 10):
+        self.database_file = database_file
+        self.read_only = read_only
+        self.busy_timeout = busy_timeout
+        self.connection = None
+        # the connection is shared with the heartbeat thread
+        self.lock = threading.RLock()
+
+    def load(self):
+        if self.read_only:
+            self._load_read_only()
+            return
+        with self.lock:
+            self.connection = sqlite3.connect(self.database_file, timeout = self.busy_timeout, isolation_level = None, check_same_thread = False)
+            self.connection.execute("PRAGMA journal_mode = WAL")
+            self.connection.execute("PRAGMA synchronous = NORMAL")
+            self.connection.executescript(self.schema)
+            self._add_seq()
+            self.connection.execute("CREATE INDEX IF NOT EXISTS results_by_seq ON results (seq)")
+
+    def _load_read_only(self):
+        if not os.path.exists(self.database_file):
+            raise ResultsUnavailableError(f"there is no results database {self.database_file}")
+        with self.lock:
+            self.connection = sqlite3.connect(pathlib.Path(self.database_file).resolve().as_uri() + "?mode=ro", uri = True, timeout = self.busy_timeout, isolation_level = None, check_same_thread = False)
+            columns = self._columns()
+            if "seq" not in columns:
+                self.close()
+                if not columns:
+                    raise ResultsUnavailableError(f"{self.database_file} is not a results database")
+                raise ResultsUnavailableError(f"the results database {self.database_file} was written by an earlier version, start the app once to upgrade it")
+
+    def _columns(self):
+        return {column[1] for column in self.connection.execute("PRAGMA table_info(results)")}
+
+    # databases of earlier versions have no seq, their records are numbered in the order of their times
+    def _add_seq(self):
+        if "seq" in self._columns():
+            return
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            # another process may have added it meanwhile
+            if "seq" not in self._columns():
+                self.connection.execute("ALTER TABLE results ADD COLUMN seq INTEGER NOT NULL DEFAULT 0")
+                self.connection.execute("""
+                    UPDATE results SET seq = numbered.seq
+                    FROM (SELECT image, validator, ROW_NUMBER() OVER (ORDER BY ts, image, validator) AS seq FROM results) AS numbered
+                    WHERE results.image = numbered.image AND results.validator = numbered.validator
+                """)
+            self.connection.execute("COMMIT")
+        except BaseException:
+            self.connection.execute("ROLLBACK")
+            raise
+
+    def is_empty(self):
+        with self.lock:
+            return self.connection.execute("SELECT 1 FROM results LIMIT 1").fetchone() is None
+
+    def has(self, image, validator):
+        with self.lock:
+            row = self.connection.execute("SELECT 1 FROM results WHERE image = ? AND validator = ?", (image, validator)).fetchone()
+        return row is not None
+
+    def images_validated_by(self, validator):
+        with self.lock:
+            return {image for (image,) in self.connection.execute("SELECT image FROM results WHERE validator = ?", (validator,))}
+
+    # image name -> number of validators that validated it
+    def validator_counts(self):
+        with self.lock:
+            return dict(self.connection.execute("SELECT image, COUNT(*) FROM results GROUP BY image"))
+
+    def record(self, image, validator, result, remark):
+        with self.lock:
+            self.connection.execute(self.insert, (image, validator, result, remark, time.time()))
+
+    # records: [(image, validator, result, remark)], committed in one transaction
+    def record_many(self, records):
+        ts = time.time()
+        self._insert([(image, validator, result, remark, ts) for image, validator, result, remark in records])
+
+    # yields (image, validator, result, remark)
+    def iter_records(self):
+        with self.lock:
+            rows = self.connection.execute("SELECT image, validator, result, remark FROM results ORDER BY image").fetchall()
+        yield from rows
+
+    # long reads use a read-only connection of their own, WAL readers do not block the writers
+    def _reader(self):
+        return sqlite3.connect(pathlib.Path(self.database_file).resolve().as_uri() + "?mode=ro", uri = True, timeout = self.busy_timeout)
+
+    # yields (image, validator, result, remark, ts, seq) of the records committed after seq since (in commit order),
+    # all records if since is None
+    def iter_changes(self, since = None):
+        connection = self._reader()
+        try:
+            if since is None:
+                yield from connection.execute("SELECT image, validator, result, remark, ts, seq FROM results")
+            else:
+                yield from connection.execute("SELECT image, validator, result, remark, ts, seq FROM results WHERE seq > ? ORDER BY seq", (since,))
+        finally:
+            connection.close()
+
+    # seq of a watermark kept as a record time by earlier versions
+    def seq_at(self, ts):
+        with self.lock:
+            return self.connection.execute("SELECT COALESCE(MAX(seq), 0) FROM results WHERE ts <= ?", (ts,)).fetchone()[0]
+
+    # for the report: the validators of every signature and (label string, signature, ..., number of images) per
+    # distinct labels and results of an image. Signature j holds its validator i in bits 2i and 2i + 1: the result
+    # code of the ResultsTable (0 none or another result, 1 + the index in result_names).
+    # SQLite aggregates, no single record reaches Python.
+    def result_groups(self):
+        connection = self._reader()
+        try:
+            # distinct validators by skipping through the (validator, image) index
+            validators = [validator for (validator,) in connection.execute("""
+                WITH RECURSIVE validators (validator) AS (
+                    SELECT MIN(validator) FROM results
+                    UNION ALL
+                    SELECT (SELECT MIN(validator) FROM results WHERE validator > validators.validator) FROM validators WHERE validator IS NOT NULL
+                ) SELECT validator FROM validators WHERE validator IS NOT NULL
+            """)]
+            code = "CASE result " + " ".join(f"WHEN '{name}' THEN {index + 1}" for index, name in enumerate(result_names)) + " ELSE 0 END"
+            signature_validators = [validators[first:first + self.validators_per_signature] for first in range(0, len(validators), self.validators_per_signature)]
+            signatures = [f"sum(({code}) * (CASE validator " + " ".join(f"WHEN ? THEN {1 << (2 * i)}" for i in range(len(chunk))) + " ELSE 0 END))" for chunk in signature_validators]
+            columns = ", ".join(f"s{j}" for j in range(len(signatures)))
+            rows = connection.execute(f"""
+                SELECT labels, {columns}, COUNT(*) FROM (
+                    SELECT substr(image, 1, instr(image, '_') - 1) AS labels, {", ".join(f"{signature} AS s{j}" for j, signature in enumerate(signatures))}
+                    FROM results GROUP BY image
+                ) GROUP BY labels, {columns}
+            """, validators).fetchall() if validators else []
+            return signature_validators, rows
+        finally:
+            connection.close()
+
+    def merge(self, validate_results):
+        rows = []
+        ts = time.time()
+        for image, results in validate_results.items():
+            for validator, value in results.items():
+                result, _, remark = value.partition(" - ")
+                rows.append((image, validator, result, remark, ts))
+        self._insert(rows)
+
+    # rows: [(image, validator, result, remark, ts)], written in one transaction
+    def _insert(self, rows):
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                self.connection.executemany(self.insert, rows)
+                self.connection.execute("COMMIT")
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+
+    # records: [(image, validator, result, remark, ts)] of another store, e.g. an older results file
+    # a record is only taken if it is newer than the result of its (image, validator), and keeps its time;
+    # all in one transaction. Returns the number of records taken.
+    def import_records(self, records):
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                before = self.connection.total_changes
+                self.connection.executemany(self.insert_newer, records)
+                taken = self.connection.total_changes - before
+                self.connection.execute("COMMIT")
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+        return taken
+
+    # one-shot import of the JSON snapshot and its journal
+    def import_json(self, snapshot_file, journal_file):
+        json_store = JournalResultsStore(snapshot_file, journal_file, read_only = True)
+        json_store.load()
+        json_store.close()
+        # keep the time of every record, in the order of the times, so seq numbers them like _add_seq does
+        self._insert(sorted((record[:5] for record in json_store.iter_changes()), key = lambda record: record[4]))
+        return len(json_store)
+
+    # every record is committed on its own, nothing to flush
+    def sync(self):
+        pass
+
+    def maintain(self):
+        pass
+
+    def compact(self):
+        with self.lock:
+            self.connection.execute("PRAGMA wal_checkpoint(PASSIVE)")
+
+    def close(self):
+        with self.lock:
+            if self.connection is None:
+                return
+            self.connection.close()
+            self.connection = None
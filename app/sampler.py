@@ -0,0 +1,100 @@
+import random
+
+# Pool of items with constant time random draw, insertion and removal
+# items are kept in a list, their positions in a dict
+# removing an item moves the last item into its slot, so the list never has holes
+class RandomPool:
+
+    def __init__(self, items = ()):
+        self.items = []
+        self.positions = {}
+        for item in items:
+            self.add(item)
+
+    def add(self, item):
+        if item in self.positions:
+            return
+        self.positions[item] = len(self.items)
+        self.items.append(item)
+
+    def discard(self, item):
+        position = self.positions.pop(item, None)
+        if position is None:
+            return
+        last = self.items.pop()
+        if position < len(self.items):
+            self.items[position] = last
+            self.positions[last] = position
+
+    def sample(self, num = 1):
+        # distinct items, at most as many as in the pool
+        num = min(num, len(self.items))
+        if num == 0:
+            return []
+        if num == 1:
+            return [self.items[random.randrange(len(self.items))]]
+        chosen = {}
+        while len(chosen) < num:
+            chosen.setdefault(random.randrange(len(self.items)))
+        return [self.items[i] for i in chosen]
+
+    def __contains__(self, item):
+        return item in self.positions
+
+    def __len__(self):
+        return len(self.items)
+
+# Pool that draws the items with the lowest count first, e.g. images with the fewest validations
+# items with the same count sit in one RandomPool (bucket), so ties are broken at random
+# counts are remembered after discard, an item added back returns to its bucket
+class CoveragePool:
+
+    def __init__(self, items_with_counts = ()):
+        # buckets[count] holds the items with that count
+        self.buckets = []
+        self.counts = {}
+        self.size = 0
+        for item, count in items_with_counts:
+            self.counts[item] = count
+            self.add(item)
+
+    def bucket(self, count):
+        while len(self.buckets) <= count:
+            self.buckets.append(RandomPool())
+        return self.buckets[count]
+
+    def add(self, item):
+        bucket = self.bucket(self.counts.setdefault(item, 0))
+        if item not in bucket:
+            bucket.add(item)
+            self.size += 1
+
+    def discard(self, item):
+        if item not in self.counts:
+            return
+        bucket = self.bucket(self.counts[item])
+        if item in bucket:
+            bucket.discard(item)
+            self.size -= 1
+
+    def set_count(self, item, count):
+        if item in self:
+            self.discard(item)
+            self.counts[item] = count
+            self.add(item)
+        else:
+            self.counts[item] = count
+
+    def sample(self, num = 1):
+        items = []
+        for bucket in self.buckets:
+            if len(items) == num:
+                break
+            items += bucket.sample(num - len(items))
+        return items
+
+    def __contains__(self, item):
+        return item in self.counts and item in self.bucket(self.counts[item])
+
+    def __len__(self):
+        return self.size
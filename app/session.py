@@ -0,0 +1,33 @@
+import os, json
+from app.catalog import image_name_of, parse_image_file_name
+
+# Session files (.data): the images of the main section with their remarks
+# Images are stored by image name, their key in the catalog, and resolved to paths through the catalog on load,
+# so a session still opens after the image folders moved, or on another machine with the same images.
+# format: {"format": "label-validator-session", "version": 1, "images": [[image name or null, remark], ...]}
+# null is an empty div. Older sessions are a list [[image path, remark], ...], their paths are resolved
+# by image name the same way.
+session_format = "label-validator-session"
+session_version = 1
+
+# items: (image path, remark) per div, empty divs show placeholder_image
+def write_session(session_file, items, placeholder_image):
+    images = [[None if image_path == placeholder_image else image_name_of(image_path), remark] for image_path, remark in items]
+    with open(session_file, "w", encoding = "utf-8") as f:
+        json.dump({"format": session_format, "version": session_version, "images": images}, f, indent = 4, ensure_ascii = False)
+
+# [(image name or None, remark)] of a session file of either format
+def read_session(session_file):
+    try:
+        with open(session_file, "r", encoding = "utf-8") as f:
+            data = json.load(f)
+    except UnicodeDecodeError:
+        # older sessions were written in the encoding of the machine
+        with open(session_file, "r") as f:
+            data = json.load(f)
+    if isinstance(data, list):
+        # the placeholder image (or anything else not named like a dataset image) was an empty div
+        return [(image_name_of(image_path) if parse_image_file_name(os.path.basename(image_path)) else None, remark) for image_path, remark in data]
+    if data.get("format") != session_format or data.get("version") != session_version:
+        raise ValueError(f"not a session file of version {session_version}: {session_file}")
+    return [(image_name, remark) for image_name, remark in data["images"]]
@@ -0,0 +1,107 @@
+import os, json, multiprocessing
+from concurrent.futures import CancelledError, ProcessPoolExecutor
+from app.catalog import image_name_of
+
+def lower_priority(niceness):
+    if niceness and hasattr(os, "nice"):
+        os.nice(niceness)
+
+# Results of a per-image pass over the image files, kept on disk by image name
+# A stored entry is up to date as long as the mtime and size of the file (its signature) did not change,
+# so an update only runs the pass on new and changed files, on a process pool.
+# format: {"version", key: {image name: entry}}, the entry holds the payload and the signature (layout: entry())
+# Subclasses set key, version and work: a module-level function image path -> (image path, payload).
+class SignatureCache:
+
+    key = "entries"
+    version = 1
+    work = None
+    # save after this many new entries, an interrupted run continues from there
+    save_interval = 5000
+    chunksize = 64
+    # start method of the workers, None for the default of the platform
+    start_method = None
+
+    def __init__(self, cache_file):
+        self.cache_file = cache_file
+        self.entries = {}
+        # pool of the running update, stop() cancels it
+        self.executor = None
+        self.stopped = False
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.cache_file, "r") as f:
+                stored = json.load(f)
+        except (OSError, ValueError):
+            return
+        if stored.get("version") == self.version:
+            self.entries = stored[self.key]
+
+    def save(self):
+        temp_file = self.cache_file + ".tmp"
+        with open(temp_file, "w") as f:
+            json.dump({"version": self.version, self.key: self.entries}, f, separators = (",", ":"))
+        os.replace(temp_file, self.cache_file)
+
+    @staticmethod
+    def signature(image_path):
+        try:
+            stat = os.stat(image_path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    # stored entry of a payload: [payload, mtime in ns, size]
+    def entry(self, payload, signature):
+        return [payload, *signature]
+
+    # (mtime in ns, size) a stored entry was made for
+    def stored_signature(self, stored):
+        return tuple(stored[-2:])
+
+    # image paths of the entries [(image name, catalog entry)] without an up-to-date stored entry
+    def missing(self, entries):
+        missing = []
+        for image_name, entry in entries:
+            stored = self.entries.get(image_name)
+            if stored is None or self.stored_signature(stored) != self.signature(entry.path):
+                missing.append(entry.path)
+        return missing
+
+    # run work on the missing images on a process pool, returns the number of images done
+    # on_done(image path, payload) is called for every image done
+    def update(self, entries, *, processes = None, niceness = 0, progress = None, on_done = None):
+        missing = self.missing(entries)
+        if not missing or self.stopped:
+            return 0
+        done = 0
+        mp_context = multiprocessing.get_context(self.start_method) if self.start_method else None
+        with ProcessPoolExecutor(max_workers = processes, mp_context = mp_context, initializer = lower_priority, initargs = (niceness,)) as executor:
+            self.executor = executor
+            try:
+                for image_path, payload in executor.map(self.work, missing, chunksize = self.chunksize):
+                    signature = self.signature(image_path)
+                    if signature is not None:
+                        self.entries[image_name_of(image_path)] = self.entry(payload, signature)
+                    if on_done is not None:
+                        on_done(image_path, payload)
+                    done += 1
+                    if done % self.save_interval == 0:
+                        self.save()
+                        if progress is not None:
+                            progress(done, len(missing))
+            except CancelledError:
+                pass
+            finally:
+                self.executor = None
+        self.save()
+        return done
+
+    # called from another thread, the entries done so far are saved
+    def stop(self):
+        self.stopped = True
+        executor = self.executor
+        if executor is not None:
+            executor.shutdown(wait = False, cancel_futures = True)
@@ -0,0 +1,153 @@
+import os, sys, time, hashlib, threading
+from concurrent.futures import ProcessPoolExecutor
+from PyQt5.QtGui import QImage
+from app.catalog import Catalog, default_data_dir, default_image_roots, default_manifest_file
+from app.image_loader import decode_image
+
+# Thumbnail cache on disk
+# Tile-size renders are stored as JPEG files named by a hash of (image path, mtime, size, tile size),
+# so a changed or moved image never hits an outdated thumbnail.
+# The cache is bounded by max_bytes, least recently used thumbnails are evicted first.
+# Recency is the mtime of the thumbnail file, it is touched on every hit.
+class ThumbnailCache:
+
+    def __init__(self, cache_dir, max_bytes, width, height, *, quality = 90):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.width = width
+        self.height = height
+        self.quality = quality
+
+        # thumbnail path -> (last used, size in bytes), built on first put
+        self.index = None
+        self.total_bytes = 0
+        # used from the decode worker threads
+        self.lock = threading.Lock()
+
+    def thumbnail_path(self, image_path):
+        try:
+            stat = os.stat(image_path)
+        except OSError:
+            return None
+        key = f"{os.path.abspath(image_path)}\0{stat.st_mtime_ns}\0{stat.st_size}\0{self.width}x{self.height}"
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, digest[:2], digest + ".jpg")
+
+    def contains(self, image_path):
+        thumbnail_path = self.thumbnail_path(image_path)
+        return thumbnail_path is not None and os.path.exists(thumbnail_path)
+
+    # returns the cached QImage or None
+    def get(self, image_path):
+        thumbnail_path = self.thumbnail_path(image_path)
+        if thumbnail_path is None:
+            return None
+        image = QImage(thumbnail_path)
+        if image.isNull():
+            return None
+        try:
+            os.utime(thumbnail_path)
+        except OSError:
+            pass
+        with self.lock:
+            if self.index is not None and thumbnail_path in self.index:
+                self.index[thumbnail_path] = (time.time(), self.index[thumbnail_path][1])
+        return image
+
+    # returns the number of bytes written
+    def put(self, image_path, image, *, evict = True):
+        thumbnail_path = self.thumbnail_path(image_path)
+        if thumbnail_path is None or image.isNull():
+            return 0
+        os.makedirs(os.path.dirname(thumbnail_path), exist_ok = True)
+        # write under a temporary name, a reader must never see half a thumbnail
+        temp_file = f"{thumbnail_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        if not image.save(temp_file, "JPEG", self.quality):
+            return 0
+        os.replace(temp_file, thumbnail_path)
+        size = os.path.getsize(thumbnail_path)
+
+        if evict:
+            with self.lock:
+                self._load_index()
+                if thumbnail_path in self.index:
+                    self.total_bytes -= self.index[thumbnail_path][1]
+                self.index[thumbnail_path] = (os.path.getmtime(thumbnail_path), size)
+                self.total_bytes += size
+                if self.total_bytes > self.max_bytes:
+                    self._evict()
+        return size
+
+    def _load_index(self):
+        if self.index is not None:
+            return
+        self.index = {}
+        self.total_bytes = 0
+        if not os.path.isdir(self.cache_dir):
+            return
+        for subdir in os.scandir(self.cache_dir):
+            if not subdir.is_dir():
+                continue
+            for entry in os.scandir(subdir.path):
+                if not entry.name.endswith(".jpg"):
+                    continue
+                stat = entry.stat()
+                self.index[entry.path] = (stat.st_mtime, stat.st_size)
+                self.total_bytes += stat.st_size
+
+    # evict down to 90% of the budget, so not every put has to evict
+    def _evict(self):
+        target = self.max_bytes * 0.9
+        for thumbnail_path in sorted(self.index, key = lambda path: self.index[path][0]):
+            if self.total_bytes <= target:
+                break
+            try:
+                os.remove(thumbnail_path)
+            except OSError:
+                pass
+            self.total_bytes -= self.index.pop(thumbnail_path)[1]
+
+    def evict(self):
+        with self.lock:
+            self.index = None
+            self._load_index()
+            if self.total_bytes > self.max_bytes:
+                self._evict()
+
+# tile size of the GUI (div_size)
+tile_size = 224
+
+# cache directory in the data directory, budget set as LABEL_VALIDATOR_THUMBNAIL_CACHE_MB (default 512 MB)
+def default_thumbnail_cache(width, height):
+    cache_dir = os.path.join(default_data_dir(), ".thumbnails")
+    max_bytes = int(float(os.environ.get("LABEL_VALIDATOR_THUMBNAIL_CACHE_MB", 512)) * 1024 * 1024)
+    return ThumbnailCache(cache_dir, max_bytes, width, height)
+
+# pre-warm the cache for the whole catalog on a process pool
+worker_cache = None
+
+def init_warm_worker(width, height):
+    global worker_cache
+    worker_cache = default_thumbnail_cache(width, height)
+
+def warm_one(image_path):
+    if worker_cache.contains(image_path):
+        return 0
+    # eviction is left to the parent, every worker only knows what it wrote itself
+    return worker_cache.put(image_path, decode_image(image_path, worker_cache.width, worker_cache.height), evict = False)
+
+def warm(image_paths, width, height, *, processes = None):
+    written = 0
+    with ProcessPoolExecutor(max_workers = processes, initializer = init_warm_worker, initargs = (width, height)) as executor:
+        for size in executor.map(warm_one, image_paths, chunksize = 64):
+            written += size
+    default_thumbnail_cache(width, height).evict()
+    return written
+
+# usage: python -m app.thumbnail_cache [processes]
+if __name__ == '__main__':
+    catalog = Catalog(default_image_roots(), default_manifest_file())
+    catalog.refresh()
+    processes = int(sys.argv[1]) if len(sys.argv) > 1 else None
+    written = warm(catalog.paths(), tile_size, tile_size, processes = processes)
+    print(f"{len(catalog)} images, {written / 1024 / 1024:.1f} MB of new thumbnails")
@@ -0,0 +1,286 @@
+import os, sys, stat, time, struct, select, threading
+from app.catalog import parse_image_file_name
+
+# Watches the image directories for image files that are added or removed while the app runs
+# on_change(kind, path) is called on the watcher thread with kind "added" or "removed" for every image file
+# that fits the name format. Sub directories created later are watched as well.
+# Linux uses inotify (through ctypes, no extra dependency), elsewhere the directories are polled.
+
+# directories: {directory path: (mtime in ns, file names, sub directory names)} as known when the watch starts
+def start_watcher(directories, on_change, *, poll_interval = 5):
+    watcher = None
+    if sys.platform.startswith("linux"):
+        try:
+            watcher = InotifyWatcher(directories, on_change)
+        except OSError:
+            # no inotify (e.g. out of watches), fall back to polling
+            watcher = None
+    if watcher is None:
+        watcher = PollingWatcher(directories, on_change, poll_interval = poll_interval)
+    threading.Thread(target = watcher.run, daemon = True).start()
+    return watcher
+
+def is_image_file(name):
+    return not name.startswith('.') and parse_image_file_name(name) is not None
+
+def scan(path):
+    files = set()
+    subdirs = set()
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                if entry.name.startswith('.'):
+                    continue
+                if entry.is_dir(follow_symlinks = False):
+                    subdirs.add(entry.name)
+                elif is_image_file(entry.name):
+                    files.add(entry.name)
+    except OSError:
+        pass
+    return files, subdirs
+
+# a symlink, or a hard link to a file that has another name as well
+def is_link(path):
+    try:
+        info = os.lstat(path)
+    except OSError:
+        return False
+    return stat.S_ISLNK(info.st_mode) or info.st_nlink > 1
+
+# Compares every directory's mtime every poll_interval seconds, only changed directories are listed again
+class PollingWatcher:
+
+    def __init__(self, directories, on_change, *, poll_interval = 5):
+        self.on_change = on_change
+        self.poll_interval = poll_interval
+        # path -> [mtime, file names, sub directory names]
+        self.directories = {path: [mtime, set(files), set(subdirs)] for path, (mtime, files, subdirs) in directories.items()}
+        self.stopped = False
+
+    def run(self):
+        while not self.stopped:
+            time.sleep(self.poll_interval)
+            self.poll()
+
+    def poll(self):
+        for path in list(self.directories):
+            if path not in self.directories:
+                continue
+            try:
+                mtime = os.stat(path).st_mtime_ns
+            except OSError:
+                self.remove_directory(path)
+                continue
+            if mtime != self.directories[path][0]:
+                self.update_directory(path, mtime)
+
+    def update_directory(self, path, mtime):
+        record = self.directories[path]
+        files, subdirs = scan(path)
+        for name in files - record[1]:
+            self.on_change("added", os.path.join(path, name))
+        for name in record[1] - files:
+            self.on_change("removed", os.path.join(path, name))
+        for name in subdirs - record[2]:
+            self.add_directory(os.path.join(path, name))
+        for name in record[2] - subdirs:
+            self.remove_directory(os.path.join(path, name))
+        self.directories[path] = [mtime, files, subdirs]
+
+    # a new directory: everything in it is new
+    def add_directory(self, path):
+        if path in self.directories:
+            return
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return
+        self.directories[path] = [None, set(), set()]
+        self.update_directory(path, mtime)
+
+    def remove_directory(self, path):
+        record = self.directories.pop(path, None)
+        if record is None:
+            return
+        for name in record[1]:
+            self.on_change("removed", os.path.join(path, name))
+        for name in record[2]:
+            self.remove_directory(os.path.join(path, name))
+
+    def stop(self):
+        self.stopped = True
+
+# inotify(7) through ctypes, one watch per directory
+class InotifyWatcher:
+
+    IN_CLOSE_WRITE = 0x008
+    IN_MOVED_FROM = 0x040
+    IN_MOVED_TO = 0x080
+    IN_CREATE = 0x100
+    IN_DELETE = 0x200
+    IN_DELETE_SELF = 0x400
+    IN_MOVE_SELF = 0x800
+    IN_Q_OVERFLOW = 0x4000
+    IN_IGNORED = 0x8000
+    IN_ISDIR = 0x40000000
+    IN_NONBLOCK = 0x800
+    IN_CLOEXEC = 0x80000
+
+    # files count as added once they are completely written or moved in, not when they are created,
+    # except links: a hard link or symlink to an existing file is complete when it is created and is never written
+    mask = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+    event_header = struct.Struct("iIII")
+
+    def __init__(self, directories, on_change):
+        import ctypes, ctypes.util
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno = True)
+        self.libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self.fd = self.libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.ctypes = ctypes
+        self.on_change = on_change
+        self.directories = directories
+        # watch descriptor -> directory path, and the image files known in every directory
+        self.paths = {}
+        self.files = {}
+        self.stopped = False
+        # polling watcher taking over if the watches can not be set up
+        self.fallback = None
+
+    # called on the watcher thread
+    def add_watches(self):
+        for path, (mtime, files, subdirs) in self.directories.items():
+            self.watch(path)
+            self.files[path] = set(files)
+        # changes between the catalog scan and the watch are not reported by inotify,
+        # directories whose mtime changed meanwhile are compared once more
+        for path, (mtime, files, subdirs) in self.directories.items():
+            try:
+                changed = os.stat(path).st_mtime_ns != mtime
+            except OSError:
+                changed = True
+            if changed:
+                self.rescan(path)
+        self.directories = None
+
+    def watch(self, path):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), self.mask)
+        if wd < 0:
+            error = self.ctypes.get_errno()
+            # the directory is gone already
+            if error in (2, 20):
+                return
+            raise OSError(error, f"inotify_add_watch failed for {path}")
+        self.paths[wd] = path
+        self.files.setdefault(path, set())
+
+    # bring the known files of a directory up to date, new sub directories are watched and scanned
+    def rescan(self, path):
+        files, subdirs = scan(path)
+        known = self.files.get(path, set())
+        for name in files - known:
+            self.on_change("added", os.path.join(path, name))
+        for name in known - files:
+            self.on_change("removed", os.path.join(path, name))
+        self.files[path] = files
+        for name in subdirs:
+            subdir = os.path.join(path, name)
+            if subdir not in self.files:
+                self.watch_new(subdir)
+
+    # a directory created while watching, its files are reported by the rescan
+    def watch_new(self, path):
+        try:
+            self.watch(path)
+        except OSError:
+            # out of watches, the files found now are still added
+            pass
+        self.rescan(path)
+
+    def rescan_all(self):
+        for path in list(self.files):
+            # forgotten with a parent meanwhile
+            if path not in self.files:
+                continue
+            if os.path.isdir(path):
+                self.rescan(path)
+            else:
+                self.forget_directory(path)
+
+    def forget_directory(self, path):
+        for name in self.files.pop(path, set()):
+            self.on_change("removed", os.path.join(path, name))
+        for subdir in [known for known in self.files if known.startswith(path + os.sep)]:
+            self.forget_directory(subdir)
+
+    def run(self):
+        directories = self.directories
+        try:
+            self.add_watches()
+        except OSError:
+            # e.g. more directories than inotify watches allowed, poll instead
+            os.close(self.fd)
+            self.fallback = PollingWatcher(directories, self.on_change)
+            self.fallback.stopped = self.stopped
+            self.fallback.run()
+            return
+        while not self.stopped:
+            # wake up now and then to notice stop()
+            readable, _, _ = select.select([self.fd], [], [], 1)
+            if not readable:
+                continue
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                continue
+            self.handle(data)
+        os.close(self.fd)
+
+    def handle(self, data):
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = self.event_header.unpack_from(data, offset)
+            name = data[offset + self.event_header.size:offset + self.event_header.size + length].rstrip(b"\0")
+            offset += self.event_header.size + length
+            if mask & self.IN_Q_OVERFLOW:
+                # events were dropped, no telling which: compare every watched directory again
+                self.rescan_all()
+                continue
+            path = self.paths.get(wd)
+            if path is None:
+                continue
+            if mask & self.IN_IGNORED:
+                self.paths.pop(wd, None)
+                continue
+            if mask & (self.IN_DELETE_SELF | self.IN_MOVE_SELF):
+                self.forget_directory(path)
+                continue
+            name = os.fsdecode(name)
+            full_path = os.path.join(path, name)
+            if mask & self.IN_ISDIR:
+                if mask & (self.IN_CREATE | self.IN_MOVED_TO):
+                    self.watch_new(full_path)
+                elif mask & (self.IN_DELETE | self.IN_MOVED_FROM):
+                    self.forget_directory(full_path)
+                continue
+            if not is_image_file(name):
+                continue
+            known = self.files.setdefault(path, set())
+            if mask & (self.IN_CLOSE_WRITE | self.IN_MOVED_TO):
+                if name not in known:
+                    known.add(name)
+                    self.on_change("added", full_path)
+            elif mask & self.IN_CREATE:
+                if name not in known and is_link(full_path):
+                    known.add(name)
+                    self.on_change("added", full_path)
+            elif mask & (self.IN_DELETE | self.IN_MOVED_FROM):
+                if name in known:
+                    known.discard(name)
+                    self.on_change("removed", full_path)
+
+    def stop(self):
+        self.stopped = True
+        if self.fallback is not None:
+            self.fallback.stop()
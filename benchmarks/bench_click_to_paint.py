@@ -0,0 +1,100 @@
+# Benchmark: click-to-paint latency of the main window, offscreen
+# every interaction is timed from the call to the end of the event processing that repaints the window
+# (state change, style polish and paint), on a small synthetic dataset in a temporary data directory
+# usage: python -m benchmarks.bench_click_to_paint [--repeat N] [-o FILE] [--compare FILE]
+import os, sys, json, time, shutil, argparse, tempfile, statistics
+from benchmarks.bench_scalability import generate, git_commit
+
+images = 200
+
+def setup(data_dir):
+    os.environ["LABEL_VALIDATOR_DATA_DIR"] = data_dir
+    os.environ["LABEL_VALIDATOR_IMAGE_ROOTS"] = os.path.join(data_dir, "images")
+    os.environ["LABEL_VALIDATOR_IMAGE_CHECK"] = "0"
+    os.environ.pop("LABEL_VALIDATOR_COORDINATOR", None)
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    generate(data_dir, images)
+
+    from PyQt5 import QtWidgets
+    from app.app import App, Root
+    application = QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+    root = Root()
+    app = App(root)
+    root.show()
+    app.random_image()
+    for div, image in zip(app.main_img_div, app.control.images):
+        app.set_image_div(div, image)
+    # until every tile shows its decoded image
+    deadline = time.perf_counter() + 60
+    while time.perf_counter() < deadline and app.image_loader.pending:
+        application.processEvents()
+        time.sleep(0.001)
+    application.processEvents()
+    return application, app
+
+# milliseconds per call of action, including the repaint it causes
+def latency(application, action, repeat):
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        action(i)
+        application.processEvents()
+        times.append((time.perf_counter() - start) * 1000)
+    return {"p50_ms": statistics.median(times), "mean_ms": statistics.fmean(times), "max_ms": max(times)}
+
+def run(repeat):
+    from PyQt5.QtCore import Qt
+    data_dir = tempfile.mkdtemp(prefix = "label-validator-paint-")
+    try:
+        application, app = setup(data_dir)
+        main = app.main_img_div
+        # shown in main[0] already, so its tile comes from the pixmap cache
+        temp_image = main[0].current_image
+        scenarios = {
+            # plain click on the next image: one div unselected, one selected, validate buttons stay active
+            "click": lambda i: app.image_clicked(main[i % len(main)], Qt.NoModifier),
+            # ctrl-click toggles one div, validate buttons change with the first / last selected image
+            "ctrl_click": lambda i: app.image_clicked(main[0], Qt.ControlModifier),
+            "select_all_and_clear": lambda i: app.select_all() if i % 2 == 0 else app.clear_selection(),
+            # the temp div activates and deactivates the swap buttons of all divs
+            "temp_set_and_clear": lambda i: app.set_image_div(app.temp_img_div, temp_image) if i % 2 == 0 else app.clear_image_div(app.temp_img_div),
+        }
+        report = {}
+        for name, action in scenarios.items():
+            app.clear_selection()
+            application.processEvents()
+            report[name] = latency(application, action, repeat)
+        app.image_loader.shutdown()
+        app.control.close()
+        return report
+    finally:
+        shutil.rmtree(data_dir, ignore_errors = True)
+
+def print_report(report, baseline = None):
+    print(f"{'interaction':<24}{'p50 ms':>10}{'mean ms':>10}{'max ms':>10}" + (f"{'old p50':>10}{'new/old':>9}" if baseline else ""))
+    for name, row in report.items():
+        line = f"{name:<24}{row['p50_ms']:>10.3f}{row['mean_ms']:>10.3f}{row['max_ms']:>10.3f}"
+        old = baseline["interactions"].get(name) if baseline else None
+        if old:
+            line += f"{old['p50_ms']:>10.3f}{row['p50_ms'] / old['p50_ms']:>8.2f}x"
+        print(line)
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog = "python -m benchmarks.bench_click_to_paint")
+    parser.add_argument("--repeat", type = int, default = 400)
+    parser.add_argument("-o", "--output", help = "write the results as JSON")
+    parser.add_argument("--compare", metavar = "FILE", help = "JSON results of an earlier run")
+    args = parser.parse_args(argv)
+
+    report = run(args.repeat)
+    baseline = None
+    if args.compare:
+        with open(args.compare, "r") as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"meta": {"commit": git_commit(), "time": time.time()}, "interactions": report}, f, indent = 4)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,52 @@
+# Simulation: clicks until every image is validated by at least `target` validators
+# compares uniform sampling with coverage-aware sampling (fewest validations first),
+# plus the draw latency of the coverage pool on a large catalog
+# usage: python -m benchmarks.bench_coverage [images] [validators] [target]
+import sys, time
+from app.sampler import RandomPool, CoveragePool
+
+def simulate(images, validators, target, make_pool):
+    counts = [0] * images
+    pools = [make_pool(range(images)) for _ in range(validators)]
+    covered = 0
+    clicks = 0
+    # validators take turns, each click validates one drawn image
+    while covered < images:
+        for validator, pool in enumerate(pools):
+            drawn = pool.sample(1)
+            if not drawn:
+                continue
+            image = drawn[0]
+            pool.discard(image)
+            clicks += 1
+            counts[image] += 1
+            if counts[image] == target:
+                covered += 1
+            for other, other_pool in enumerate(pools):
+                if other != validator and isinstance(other_pool, CoveragePool):
+                    other_pool.set_count(image, counts[image])
+            if covered == images:
+                break
+    return clicks
+
+def draw_latency(size, draws = 10000):
+    pool = CoveragePool((i, i % 3) for i in range(size))
+    start = time.perf_counter()
+    for _ in range(draws):
+        image = pool.sample(3)[0]
+        pool.discard(image)
+        pool.set_count(image, pool.counts[image] + 1)
+        pool.add(image)
+    return (time.perf_counter() - start) / draws
+
+def main(images, validators, target):
+    print(f"{images} images, {validators} validators, target {target} validations per image (minimum {images * target} clicks)")
+    uniform = simulate(images, validators, target, lambda items: RandomPool(items))
+    coverage = simulate(images, validators, target, lambda items: CoveragePool((item, 0) for item in items))
+    print(f"  uniform:  {uniform} clicks")
+    print(f"  coverage: {coverage} clicks ({uniform / coverage:.2f}x fewer)")
+    print(f"coverage pool draw on 1M images: {draw_latency(1_000_000) * 1e6:.1f} us")
+
+if __name__ == '__main__':
+    args = [int(arg) for arg in sys.argv[1:]]
+    main(*(args + [10_000, 4, 2][len(args):]))
@@ -0,0 +1,25 @@
+# Benchmark: start-up cost of the headless core against the GUI module
+# every import runs in a fresh interpreter
+# usage: python -m benchmarks.bench_import [repeat]
+import os, sys, time, subprocess
+
+modules = ["app.core", "app.cli", "app.app"]
+
+def time_import(module, repeat):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH = root)
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", f"import {module}"], check = True, cwd = root, env = env)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+def main(repeat):
+    baseline = time_import("os", repeat)
+    print(f"{'module':>10} {'ms':>8}  (interpreter start {baseline * 1000:.1f} ms excluded)")
+    for module in modules:
+        print(f"{module:>10} {(time_import(module, repeat) - baseline) * 1000:8.1f}")
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10)
@@ -0,0 +1,81 @@
+# Benchmark: merging the results files of several machines, streaming against loading every file
+# the files are version 2 snapshots of synthetic results, every machine holds a random share of the same
+# (image, validator) pairs, so most pairs are in several files and some of them disagree
+# "load" is what merging looked like before: every file parsed as a whole into nested dicts, newest ts kept
+# each approach runs in a fresh interpreter, its peak RSS is reported
+# usage: python -m benchmarks.bench_merge [--files N] [--results N] [--run-size N]
+import os, sys, json, time, random, shutil, argparse, tempfile, subprocess
+from benchmarks.bench_scalability import max_rss_mb
+
+validators = ["Jeffrey Chen", "Nancy Li", "Zoe Wang", "Vivian Wu"]
+results = ["accept", "accept", "accept", "incorrect", "reject"]
+
+# files snapshots with about results results each, drawn from 2 * results pairs
+def generate(directory, files, results_per_file):
+    from app.results_model import ResultsTable, write_snapshot
+    rng = random.Random(0)
+    pairs = 2 * results_per_file
+    paths = []
+    for index in range(files):
+        table = ResultsTable()
+        for pair in sorted(rng.sample(range(pairs), results_per_file)):
+            table.set(f"A01_{pair // len(validators)}_1", validators[pair % len(validators)], rng.choice(results), "None", 1.7e9 + rng.randrange(1000))
+        path = os.path.join(directory, f"machine{index}.json")
+        with open(path, "w") as f:
+            write_snapshot(table, f)
+        paths.append(path)
+    return paths
+
+def run_streaming(paths, output, run_size):
+    from app.merge import merge_results
+    return merge_results(paths, output, run_size = run_size)["results"]
+
+def run_load(paths, output, run_size):
+    from app.results_model import read_snapshot
+    merged = {}
+    for path in paths:
+        with open(path, "r") as f:
+            data = json.load(f)
+        for image, validator, result, remark, ts in read_snapshot(data):
+            current = merged.setdefault(image, {}).get(validator)
+            if current is None or ts >= current[2]:
+                merged[image][validator] = (result, remark, ts)
+        del data
+    with open(output, "w") as f:
+        json.dump(merged, f)
+    return sum(len(results) for results in merged.values())
+
+def child(approach, output, run_size, paths):
+    start = time.perf_counter()
+    count = {"streaming": run_streaming, "load": run_load}[approach](paths, output, run_size)
+    print(json.dumps({"seconds": time.perf_counter() - start, "rss_mb": max_rss_mb(), "results": count}))
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog = "python -m benchmarks.bench_merge")
+    parser.add_argument("--files", type = int, default = 12)
+    parser.add_argument("--results", type = int, default = 250_000, help = "results per file")
+    parser.add_argument("--run-size", type = int, default = 200_000)
+    args = parser.parse_args(argv)
+
+    directory = tempfile.mkdtemp(prefix = "label-validator-merge-bench-")
+    try:
+        start = time.perf_counter()
+        paths = generate(directory, args.files, args.results)
+        size = sum(os.path.getsize(path) for path in paths)
+        print(f"{args.files} files, {args.files * args.results} results, {size / 2 ** 20:.0f} MB, generated in {time.perf_counter() - start:.1f} s")
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        print(f"{'approach':<12}{'s':>8}{'peak RSS MB':>14}{'results':>10}")
+        for approach in ["streaming", "load"]:
+            output = os.path.join(directory, f"{approach}.out")
+            line = subprocess.run([sys.executable, "-m", "benchmarks.bench_merge", "--child", approach, output, str(args.run_size), *paths],
+                                  check = True, cwd = root, capture_output = True, text = True).stdout
+            row = json.loads(line)
+            print(f"{approach:<12}{row['seconds']:>8.1f}{row['rss_mb']:>14.0f}{row['results']:>10}")
+    finally:
+        shutil.rmtree(directory, ignore_errors = True)
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ["--child"]:
+        child(sys.argv[2], sys.argv[3], int(sys.argv[4]), sys.argv[5:])
+    else:
+        main(sys.argv[1:])
@@ -0,0 +1,58 @@
+# Benchmark: report engine over synthetic results, for each way the results reach it
+# "records": a plain stream of records, interned one by one
+# "table": the JSON store's ResultsTable, read from its interned ids and result code columns
+# "sqlite": the SQLite store, aggregated in SQL (result_groups), timed from the query on
+# the label index is built from the image names, like the app builds it from the catalog
+# usage: python -m benchmarks.bench_report [images] [validators per image]
+import os, sys, time, random, shutil, tempfile
+from app.core import ControlSystem
+from app.label_index import LabelIndex
+from app.report import ResultColumns, build_report, build_report_from_columns
+from app.results_model import ResultsTable
+from app.results_sqlite import SqliteResultsStore
+
+validators = ["Jeffrey Chen", "Nancy Li", "Zoe Wang", "Vivian Wu"]
+results = ["accept", "accept", "accept", "incorrect", "reject"]
+
+def synthetic_records(images, per_image):
+    codes = list(ControlSystem.catagory2food)
+    rng = random.Random(0)
+    records = []
+    for i in range(images):
+        image = "".join(rng.sample(codes, rng.randint(1, 3))) + f"_{i}_{rng.randint(1, 3)}"
+        for validator in rng.sample(validators, per_image):
+            records.append((image, validator, rng.choice(results), "None"))
+    return records
+
+def timed(fn):
+    start = time.perf_counter()
+    report = fn()
+    return time.perf_counter() - start, report
+
+def main(images, per_image):
+    records = synthetic_records(images, per_image)
+    index = LabelIndex.build(ControlSystem.catagory2food, {image: image.partition('_')[0] for image, _, _, _ in records})
+    table = ResultsTable()
+    for record in records:
+        table.set(*record, 0)
+    directory = tempfile.mkdtemp(prefix = "label-validator-report-")
+    try:
+        store = SqliteResultsStore(os.path.join(directory, "results.sqlite3"))
+        store.load()
+        store._insert([(*record, 0) for record in records])
+        store.connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        rows = [
+            ("records", *timed(lambda: build_report(iter(records), index))),
+            ("table", *timed(lambda: build_report_from_columns(ResultColumns.from_table(table, index), index))),
+            ("sqlite", *timed(lambda: build_report_from_columns(ResultColumns.from_groups(*store.result_groups(), index), index))),
+        ]
+        store.close()
+    finally:
+        shutil.rmtree(directory, ignore_errors = True)
+    print(f"{len(records)} results on {images} images")
+    for name, elapsed, report in rows:
+        print(f"{name:<8}{elapsed:>8.2f} s   Fleiss' kappa {report['fleiss_kappa']:.3f}")
+
+if __name__ == '__main__':
+    args = [int(arg) for arg in sys.argv[1:]]
+    main(*(args + [1_000_000, 2][len(args):]))
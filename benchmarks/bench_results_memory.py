@@ -0,0 +1,71 @@
+# Benchmark: memory of the results held by the JSON store, nested dicts of strings against the ResultsTable
+# the nested dicts are what the store held before: {image: {validator: "result - remark"}} plus {image: {validator: ts}}
+# the records are built up front, so the image name strings they share are not counted for either
+# usage: python -m benchmarks.bench_results_memory [images] [validators per image]
+import io, sys, json, time, random, tracemalloc
+from app.core import ControlSystem
+from app.results_model import ResultsTable, read_snapshot, write_snapshot
+
+validators = ["Jeffrey Chen", "Nancy Li", "Zoe Wang", "Vivian Wu"]
+results = ["accept", "accept", "accept", "incorrect", "reject"]
+# share of results with a remark
+remark_share = 0.02
+
+def synthetic_records(images, per_image):
+    codes = list(ControlSystem.catagory2food)
+    rng = random.Random(0)
+    ts = time.time()
+    for i in range(images):
+        image = "".join(rng.sample(codes, rng.randint(1, 3))) + f"_{i}_{rng.randint(1, 3)}"
+        for validator in rng.sample(validators, per_image):
+            remark = "blurry - cropped" if rng.random() < remark_share else "None"
+            yield image, validator, rng.choice(results), remark, ts + i
+
+def nested_dicts(records):
+    validate_results = {}
+    timestamps = {}
+    for image, validator, result, remark, ts in records:
+        validate_results.setdefault(image, {})[validator] = result + " - " + remark
+        timestamps.setdefault(image, {})[validator] = ts
+    return validate_results, timestamps
+
+def results_table(records):
+    table = ResultsTable()
+    for record in records:
+        table.set(*record)
+    return table
+
+# (bytes allocated by what build returns, seconds, value)
+def measure(build, records):
+    tracemalloc.start()
+    start = time.perf_counter()
+    value = build(iter(records))
+    elapsed = time.perf_counter() - start
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return size, elapsed, value
+
+def main(images, per_image):
+    records = list(synthetic_records(images, per_image))
+    count = len(records)
+    dict_size, dict_time, (validate_results, timestamps) = measure(nested_dicts, records)
+    table_size, table_time, table = measure(results_table, records)
+
+    # snapshot size and round trip of the table
+    out = io.StringIO()
+    start = time.perf_counter()
+    write_snapshot(table, out)
+    write_time = time.perf_counter() - start
+    legacy_bytes = len(json.dumps(validate_results, ensure_ascii = False, separators = (",", ":"))) + len(json.dumps(timestamps, separators = (",", ":")))
+    assert list(read_snapshot(json.loads(out.getvalue()))) == list(table.iter_records())
+
+    print(f"{count} results on {images} images")
+    print(f"{'':<14}{'MB':>10}{'bytes/result':>14}{'build s':>10}")
+    print(f"{'nested dicts':<14}{dict_size / 2 ** 20:>10.1f}{dict_size / count:>14.1f}{dict_time:>10.2f}")
+    print(f"{'ResultsTable':<14}{table_size / 2 ** 20:>10.1f}{table_size / count:>14.1f}{table_time:>10.2f}")
+    print(f"saving: {1 - table_size / dict_size:.0%}")
+    print(f"snapshot: {len(out.getvalue()) / 2 ** 20:.1f} MB in {write_time:.2f} s, before {legacy_bytes / 2 ** 20:.1f} MB in two files")
+
+if __name__ == '__main__':
+    args = [int(arg) for arg in sys.argv[1:]]
+    main(*(args + [1_000_000, 2][len(args):]))
@@ -0,0 +1,56 @@
+# Benchmark: latency of drawing 3 random unvalidated images
+# compares the RandomPool sampler against the old shuffle-and-scan over the whole image list
+# usage: python -m benchmarks.bench_sampler [sizes...]
+import sys, time, random
+from app.sampler import RandomPool
+
+draws = 200
+legacy_limit = 100_000  # shuffle-and-scan becomes too slow to measure past this
+
+def synthetic_images(size):
+    return [f"/images/A01B02_{i}_1.jpg" for i in range(size)]
+
+def time_per_call(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat
+
+def bench_pool(images):
+    pool = RandomPool(images)
+    # validator is at 99% coverage, the worst case for shuffle-and-scan
+    for image in images[:len(images) - len(images) // 100]:
+        pool.discard(image)
+
+    def draw_and_record():
+        drawn = pool.sample(3)
+        pool.discard(drawn[0])
+        pool.add(drawn[0])
+
+    return time_per_call(draw_and_record, draws)
+
+def bench_legacy(images):
+    validated = set(images[:len(images) - len(images) // 100])
+
+    def shuffle_and_scan():
+        chosen = []
+        random.shuffle(images)
+        for image in images:
+            if image not in chosen and image not in validated:
+                chosen.append(image)
+            if len(chosen) == 3:
+                return chosen
+
+    return time_per_call(shuffle_and_scan, max(1, draws // 20))
+
+def main(sizes):
+    print(f"{'images':>10} {'pool (us)':>12} {'legacy (us)':>12}")
+    for size in sizes:
+        images = synthetic_images(size)
+        pool_time = bench_pool(images)
+        legacy_time = bench_legacy(images) if size <= legacy_limit else None
+        legacy_text = f"{legacy_time * 1e6:12.1f}" if legacy_time is not None else f"{'-':>12}"
+        print(f"{size:>10} {pool_time * 1e6:12.1f} {legacy_text}")
+
+if __name__ == '__main__':
+    main([int(size) for size in sys.argv[1:]] or [1_000, 10_000, 100_000, 1_000_000])
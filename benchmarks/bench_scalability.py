@@ -0,0 +1,272 @@
+# Benchmark: hot paths of the core and the GUI on synthetic datasets of growing size
+# every size runs in a fresh interpreter on its own generated data directory
+# (LABEL_VALIDATOR_DATA_DIR and LABEL_VALIDATOR_IMAGE_ROOTS point there, real results are never touched)
+# results are printed as a table and can be written as JSON and compared with an earlier run
+# usage: python -m benchmarks.bench_scalability [--sizes N...] [--backend json|sqlite] [--no-gui] [--legacy-snapshot] [-o FILE] [--compare FILE] [--data-dir DIR] [--keep]
+import os, sys, json, time, random, shutil, argparse, platform, tempfile, subprocess
+
+validators = ["Jeffrey Chen", "Nancy Li", "Zoe Wang", "Vivian Wu"]
+results = ["accept", "accept", "accept", "incorrect", "reject"]
+codes = [
+    "A01", "A02", "B01", "B02", "B03", "B04", "B05", "B06", "C01", "C02", "C03", "C04",
+    "C05", "C06", "C07", "C08", "D01", "D02", "D03", "D04", "E01", "E02", "E03", "F01",
+]
+
+# images are spread over sub directories like a real dataset
+files_per_directory = 10000
+# share of images that already carry a result in the snapshot
+validated_share = 0.5
+# records in the journal, replayed on start
+journal_records = 1000
+# calls timed per path
+repeat = 200
+
+# Data generation
+
+# one real JPEG every image file links to, so decoding costs what a photo of that size costs
+def write_template(path):
+    try:
+        from PyQt5.QtGui import QImage, QColor
+    except ImportError:
+        # without Qt only the file names matter
+        open(path, "wb").close()
+        return
+    image = QImage(1024, 768, QImage.Format_RGB32)
+    rng = random.Random(0)
+    for y in range(0, 768, 16):
+        for x in range(0, 1024, 16):
+            color = QColor(rng.randrange(256), rng.randrange(256), rng.randrange(256))
+            for dy in range(16):
+                for dx in range(0, 16, 4):
+                    image.setPixelColor(x + dx, y + dy, color)
+    image.save(path, "JPEG", 90)
+
+def link(source, target):
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copyfile(source, target)
+
+# legacy_snapshot: results as a version 1 snapshot with its timestamps file, as written before version 2,
+# to time loading and migrating them; by default they are a version 2 snapshot like the stores write
+def generate(data_dir, size, *, legacy_snapshot = False):
+    from app.results_model import snapshot_row, write_snapshot_images
+    images_dir = os.path.join(data_dir, "images")
+    template = os.path.join(data_dir, "template.jpg")
+    write_template(template)
+    rng = random.Random(size)
+
+    names = []
+    for i in range(size):
+        directory = os.path.join(images_dir, f"{i // files_per_directory:04d}")
+        if i % files_per_directory == 0:
+            os.makedirs(directory)
+        name = "".join(sorted(rng.sample(codes, rng.randint(1, 3)))) + f"_{i}_{rng.randint(1, 3)}"
+        link(template, os.path.join(directory, name + ".jpg"))
+        names.append(name)
+
+    # (image, {validator: result}) of the validated images, drawn one image at a time while the snapshot is written
+    ts = time.time() - 86400
+    validated = rng.sample(names, int(size * validated_share))
+    def image_results():
+        for name in validated:
+            yield name, {validator: rng.choice(results) for validator in rng.sample(validators, rng.randint(1, 2))}
+
+    snapshot_file = os.path.join(data_dir, "validate_results.json")
+    if legacy_snapshot:
+        with open(snapshot_file, "w") as snapshot, open(os.path.join(data_dir, "validate_results.timestamps.json"), "w") as timestamps:
+            snapshot.write("{")
+            timestamps.write("{")
+            for i, (name, by_validator) in enumerate(image_results()):
+                separator = "," if i else ""
+                snapshot.write(separator + json.dumps(name) + ":" + json.dumps({validator: result + " - None" for validator, result in by_validator.items()}))
+                timestamps.write(separator + json.dumps(name) + ":" + json.dumps({validator: ts for validator in by_validator}))
+            snapshot.write("}")
+            timestamps.write("}")
+    else:
+        validator_index = {validator: index for index, validator in enumerate(validators)}
+        with open(snapshot_file, "w") as snapshot:
+            write_snapshot_images(snapshot, validators, ((name, [snapshot_row(validator_index[validator], result, "None", ts) for validator, result in by_validator.items()]) for name, by_validator in image_results()))
+
+    with open(os.path.join(data_dir, "validate_results.journal.jsonl"), "w") as journal:
+        for name in rng.sample(names, min(journal_records, size)):
+            journal.write(json.dumps({"image": name, "validator": rng.choice(validators), "result": rng.choice(results), "remark": "None", "ts": ts}) + "\n")
+    return names
+
+# Timing
+
+def timed(fn):
+    start = time.perf_counter()
+    value = fn()
+    return time.perf_counter() - start, value
+
+def time_per_call(fn, count):
+    start = time.perf_counter()
+    for _ in range(count):
+        fn()
+    return (time.perf_counter() - start) / count
+
+def max_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    # kilobytes on Linux, bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 1024 / 1024 if sys.platform == "darwin" else rss / 1024
+
+def bench_core(names, metrics):
+    from app.core import ControlSystem
+    from app.export import export_results
+
+    # first start: full folder scan, results load and journal replay
+    metrics["init_cold_s"], control = timed(lambda: ControlSystem(background = False, use_coordinator = False))
+    control.close()
+    # later starts: catalog manifest instead of the scan
+    metrics["init_warm_s"], control = timed(lambda: ControlSystem(background = False, use_coordinator = False))
+
+    metrics["sampler_build_s"], _ = timed(lambda: control.set_current_validator(0))
+    metrics["random_images_us"] = time_per_call(lambda: control.random_images(num = 3), repeat) * 1e6
+    metrics["coverage_sampler_build_s"], _ = timed(lambda: control.set_sampling_mode("coverage") or control.sampler())
+    metrics["coverage_random_images_us"] = time_per_call(lambda: control.random_images(num = 3), repeat) * 1e6
+    control.set_sampling_mode("uniform")
+
+    records = iter(random.Random(1).sample(names, min(repeat, len(names))))
+    metrics["record_result_us"] = time_per_call(lambda: control.record_image_result(next(records), "accept", ""), min(repeat, len(names))) * 1e6
+    # one heartbeat: fsync of the records since the last batch
+    metrics["heartbeat_s"], _ = timed(control.results.maintain)
+    # the heartbeat's periodic save of everything
+    metrics["compact_s"], _ = timed(control.results.compact)
+
+    metrics["label_index_build_s"], _ = timed(control.label_index)
+    metrics["report_s"], _ = timed(control.report)
+    with open(os.devnull, "w") as devnull:
+        metrics["export_csv_s"], _ = timed(lambda: export_results(control.results, control.catalog, "csv", out = devnull))
+
+    metrics["exit_s"], _ = timed(control.close)
+
+def bench_gui(metrics):
+    from PyQt5 import QtWidgets
+    from app.app import App, Root, div_size
+    from app.image_loader import decode_image
+
+    application = QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+    root = Root()
+    metrics["gui_init_s"], app = timed(lambda: App(root))
+
+    def show_random_images():
+        app.random_image()
+        # until every random div shows its decoded image
+        deadline = time.perf_counter() + 60
+        while time.perf_counter() < deadline:
+            application.processEvents()
+            if all(div.current_image == app.control.placeholder_image or div.current_image in app.pixmap_cache for div in app.rand_img_div):
+                break
+            time.sleep(0.0005)
+
+    # the first batch is decoded on demand, later ones were prefetched while the previous one was shown
+    metrics["gui_first_random_image_ms"] = timed(show_random_images)[0] * 1000
+    metrics["gui_random_image_ms"] = time_per_call(show_random_images, 20) * 1000
+
+    # set_image_div's decode without and with the thumbnail cache
+    paths = app.control.images[:20]
+    metrics["decode_ms"] = time_per_call(lambda: [decode_image(path, div_size, div_size) for path in paths], 1) / len(paths) * 1000
+    cache = app.image_loader.thumbnail_cache
+    for path in paths:
+        cache.put(path, decode_image(path, div_size, div_size))
+    metrics["thumbnail_hit_ms"] = time_per_call(lambda: [cache.get(path) for path in paths], 1) / len(paths) * 1000
+
+    app.image_loader.shutdown()
+    app.control.close()
+
+# runs one size in this interpreter, prints the metrics as JSON
+def run_one(size, data_dir, gui, legacy_snapshot):
+    os.environ["LABEL_VALIDATOR_DATA_DIR"] = data_dir
+    os.environ["LABEL_VALIDATOR_IMAGE_ROOTS"] = os.path.join(data_dir, "images")
+    os.environ["LABEL_VALIDATOR_RESULTS_DB"] = os.path.join(data_dir, "validate_results.sqlite3")
+    # the image check pass would compete with the timed paths for the CPU
+    os.environ["LABEL_VALIDATOR_IMAGE_CHECK"] = "0"
+    os.environ.pop("LABEL_VALIDATOR_COORDINATOR", None)
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+    metrics = {}
+    metrics["generate_s"], names = timed(lambda: generate(data_dir, size, legacy_snapshot = legacy_snapshot))
+    bench_core(names, metrics)
+    if gui:
+        bench_gui(metrics)
+    metrics["max_rss_mb"] = max_rss_mb()
+    print(json.dumps(metrics))
+
+# Driver
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output = True, text = True, check = True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(args):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH = root, LABEL_VALIDATOR_RESULTS_BACKEND = args.backend)
+    report = {
+        "meta": {"commit": git_commit(), "backend": args.backend, "python": platform.python_version(), "platform": platform.platform(), "time": time.time(),
+                 "snapshot": "version 1 (legacy)" if args.legacy_snapshot else "version 2"},
+        "sizes": {},
+    }
+    for size in args.sizes:
+        data_dir = tempfile.mkdtemp(prefix = f"label-validator-{size}-", dir = args.data_dir)
+        try:
+            command = [sys.executable, "-m", "benchmarks.bench_scalability", "--run-one", str(size), "--data-dir", data_dir] + (["--no-gui"] if args.no_gui else []) + (["--legacy-snapshot"] if args.legacy_snapshot else [])
+            output = subprocess.run(command, cwd = root, env = env, stdout = subprocess.PIPE, text = True, check = True).stdout
+            report["sizes"][str(size)] = json.loads(output.strip().splitlines()[-1])
+        finally:
+            if not args.keep:
+                shutil.rmtree(data_dir, ignore_errors = True)
+        print_metrics(size, report["sizes"][str(size)])
+    return report
+
+def print_metrics(size, metrics):
+    print(f"{size} images")
+    for name, value in metrics.items():
+        print(f"  {name:<28}{'-' if value is None else f'{value:.3f}':>12}")
+
+def print_comparison(report, baseline):
+    print(f"compared with {baseline['meta'].get('commit')} (new / old)")
+    for size, metrics in report["sizes"].items():
+        old_metrics = baseline["sizes"].get(size)
+        if old_metrics is None:
+            continue
+        print(f"{size} images")
+        for name, value in metrics.items():
+            old = old_metrics.get(name)
+            if value is None or not old:
+                continue
+            print(f"  {name:<28}{old:>12.3f}{value:>12.3f}{value / old:>8.2f}x")
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog = "python -m benchmarks.bench_scalability")
+    parser.add_argument("--sizes", nargs = "+", type = int, default = [1000, 100_000, 1_000_000])
+    parser.add_argument("--backend", default = "json", choices = ["json", "sqlite"])
+    parser.add_argument("--no-gui", action = "store_true", help = "skip the GUI paths")
+    parser.add_argument("--legacy-snapshot", action = "store_true", help = "start from a version 1 snapshot with a timestamps file instead of version 2")
+    parser.add_argument("-o", "--output", help = "write the results as JSON")
+    parser.add_argument("--compare", metavar = "FILE", help = "JSON results of an earlier run")
+    parser.add_argument("--data-dir", help = "where the synthetic datasets are generated, default the temp directory")
+    parser.add_argument("--keep", action = "store_true", help = "keep the generated datasets")
+    parser.add_argument("--run-one", type = int, help = argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.run_one is not None:
+        run_one(args.run_one, args.data_dir, not args.no_gui, args.legacy_snapshot)
+        return
+
+    report = run(args)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent = 4)
+    if args.compare:
+        with open(args.compare, "r") as f:
+            print_comparison(report, json.load(f))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
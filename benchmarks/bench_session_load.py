@@ -0,0 +1,88 @@
+# Benchmark: loading saved sessions back to back, as a review queue, offscreen
+# every session holds 12 images no other session shows; between two sessions the reviewer looks at the grid
+# for --dwell ms (events are processed meanwhile). Timed per session, from the call of show_session:
+# "usable" until it returned (labels, titles and remarks are set, the grid takes clicks),
+# "complete" until every tile shows its decoded image and the window repainted.
+# "queue" is the review queue as it is, with the next session decoded ahead; "cold" loads the same kind of sessions
+# with the look-ahead turned off. The thumbnail cache is off, so every image that is not prefetched is decoded.
+# usage: python -m benchmarks.bench_session_load [--sessions N] [--dwell MS]
+import os, sys, time, shutil, argparse, tempfile, statistics
+from benchmarks.bench_scalability import generate
+
+def setup(data_dir, images):
+    os.environ["LABEL_VALIDATOR_DATA_DIR"] = data_dir
+    os.environ["LABEL_VALIDATOR_IMAGE_ROOTS"] = os.path.join(data_dir, "images")
+    os.environ["LABEL_VALIDATOR_IMAGE_CHECK"] = "0"
+    os.environ.pop("LABEL_VALIDATOR_COORDINATOR", None)
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    names = generate(data_dir, images)
+
+    from PyQt5 import QtWidgets
+    from app.app import App, Root
+    application = QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+    root = Root()
+    app = App(root)
+    app.image_loader.thumbnail_cache = None
+    root.show()
+    application.processEvents()
+    return application, app, names
+
+def wait(application, until, timeout = 60):
+    deadline = time.perf_counter() + timeout
+    while not until() and time.perf_counter() < deadline:
+        application.processEvents()
+        time.sleep(0.0005)
+
+def run_queue(application, app, session_files, dwell, prefetch):
+    if prefetch:
+        vars(app).pop("prefetch_session", None)
+    else:
+        app.prefetch_session = lambda index: None
+    app.session_files = session_files
+    rows = []
+    for index in range(len(session_files)):
+        start = time.perf_counter()
+        app.show_session(index)
+        usable = time.perf_counter() - start
+        wait(application, lambda: not any(div in app.image_loader.pending for div in app.main_img_div))
+        application.processEvents()
+        complete = time.perf_counter() - start
+        rows.append((usable * 1000, complete * 1000))
+        end = time.perf_counter() + dwell / 1000
+        wait(application, lambda: time.perf_counter() >= end)
+    # the first session is never prefetched
+    return rows[1:]
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog = "python -m benchmarks.bench_session_load")
+    parser.add_argument("--sessions", type = int, default = 10)
+    parser.add_argument("--dwell", type = float, default = 300, help = "ms the reviewer looks at each session")
+    args = parser.parse_args(argv)
+
+    data_dir = tempfile.mkdtemp(prefix = "label-validator-session-")
+    try:
+        application, app, names = setup(data_dir, 2 * 12 * args.sessions)
+        entries = app.control.catalog.entries
+        report = {}
+        for mode, offset in [("cold", 0), ("queue", 12 * args.sessions)]:
+            session_files = []
+            for i in range(args.sessions):
+                session_file = os.path.join(data_dir, f"{mode}{i}.data")
+                start = offset + 12 * i
+                app.control.write_session(session_file, [(entries[name].path, "") for name in names[start:start + 12]])
+                session_files.append(session_file)
+            report[mode] = run_queue(application, app, session_files, args.dwell, prefetch = mode == "queue")
+        app.image_loader.shutdown()
+        app.control.close()
+    finally:
+        shutil.rmtree(data_dir, ignore_errors = True)
+
+    print(f"{args.sessions} sessions of 12 images, {args.dwell:.0f} ms per session")
+    print(f"{'mode':<8}{'usable p50 ms':>16}{'complete p50 ms':>18}{'complete max ms':>18}")
+    for mode, rows in report.items():
+        usable = [row[0] for row in rows]
+        complete = [row[1] for row in rows]
+        print(f"{mode:<8}{statistics.median(usable):>16.2f}{statistics.median(complete):>18.2f}{max(complete):>18.2f}")
+
+if __name__ == '__main__':
+    main(sys.argv[1:])